@@ -2,7 +2,18 @@
 健康檢查 API
 """
 from fastapi import APIRouter, HTTPException
-from app.core.redis import get_redis_client
+from app.core.redis import get_async_redis_client
+from app.core.replicas import replica_router
+from app.core.scripts import get_script_stats
+from app.middleware.rate_limit import default_rate_limiter, queue_rate_limiter
+from app.services.inventory_service import InventoryService
+from app.services.product_service import ProductService
+from app.services.purchase_batcher import purchase_batcher
+from app.services.sold_out import sold_out_registry
+from app.services.turnstile_service import TurnstileService
+from app.services.turnstile_dispatcher import turnstile_dispatcher
+from app.tasks.product_lease import product_lease_manager
+from app.tasks.queue_manager import queue_scheduler
 
 router = APIRouter()
 
@@ -11,8 +22,8 @@ router = APIRouter()
 async def health_check():
     """健康檢查端點"""
     try:
-        redis_client = get_redis_client()
-        redis_client.ping()
+        redis_client = get_async_redis_client()
+        await redis_client.ping()
         
         return {
             "status": "healthy",
@@ -23,3 +34,84 @@ async def health_check():
             status_code=503,
             detail=f"Service unhealthy: {str(e)}"
         )
+
+
+
+@router.get("/health/scripts")
+async def script_stats():
+    """Lua 腳本呼叫次數與延遲統計"""
+    return {"scripts": get_script_stats()}
+
+
+@router.get("/health/queue-manager")
+async def queue_manager_status():
+    """佇列管理租約狀態：本 worker 與各商品的管理者"""
+    product_ids = await ProductService.get_product_ids()
+    owners = await product_lease_manager.get_lease_owners(product_ids)
+    
+    return {
+        "worker_id": product_lease_manager.worker_id,
+        "lease_ttl_ms": product_lease_manager.ttl_ms,
+        "owned_products": product_lease_manager.get_owned_products(),
+        "stats": product_lease_manager.stats,
+        "scheduler": {
+            "interval_ms": round(queue_scheduler.interval * 1000),
+            **queue_scheduler.stats
+        },
+        "leases": owners
+    }
+
+
+@router.get("/health/rate-limit")
+async def rate_limit_stats():
+    """速率限制統計：本地拒絕與 Redis 判定次數"""
+    return {
+        name: {
+            **limiter.stats,
+            "algorithm": limiter.algorithm,
+            "tracked_ips": len(limiter.local_bucket) if limiter.local_bucket is not None else 0
+        }
+        for name, limiter in (("default", default_rate_limiter), ("queue", queue_rate_limiter))
+    }
+
+
+@router.get("/health/replicas")
+async def replica_status():
+    """唯讀複本狀態：各複本的複製延遲與讀取分流統計"""
+    return {
+        "max_staleness_ms": replica_router.max_staleness_ms,
+        "staleness_ms": replica_router.staleness_ms,
+        "healthy": replica_router.healthy,
+        "stats": replica_router.stats
+    }
+
+
+@router.get("/health/purchase")
+async def purchase_stats():
+    """購買統計：庫存分片數、已售完商品與批次提交設定、提交筆數與批次數"""
+    return {
+        "stock_shards": InventoryService.get_stock_shards(),
+        "sold_out": sold_out_registry.get_sold_out(),
+        "sold_out_stats": sold_out_registry.stats,
+        "batching": purchase_batcher.enabled,
+        "window_ms": purchase_batcher.window * 1000,
+        "max_batch": purchase_batcher.max_batch,
+        "stats": purchase_batcher.stats
+    }
+
+
+@router.get("/health/turnstile")
+async def turnstile_stats():
+    """Turnstile 驗證統計：驗證次數、快取命中、進行中與排隊中的驗證數"""
+    return {
+        "verifier": TurnstileService.get_verifier().__name__,
+        "http2": TurnstileService.is_http2_enabled(),
+        "max_concurrency": TurnstileService.get_max_concurrency(),
+        "stats": TurnstileService.get_stats(),
+        "dispatcher": {
+            **turnstile_dispatcher.stats,
+            "backlog": turnstile_dispatcher.get_backlog(),
+            "max_backlog": turnstile_dispatcher.max_backlog,
+            "max_in_flight": turnstile_dispatcher.max_in_flight
+        }
+    }
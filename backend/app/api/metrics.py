@@ -0,0 +1,39 @@
+"""
+Prometheus 指標 API
+"""
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from app.core.metrics import metrics_publisher, render_metrics
+from app.services.product_service import ProductService
+from app.services.queue_service import QueueService
+
+router = APIRouter()
+
+
+async def _collect_queue_depths() -> dict:
+    """各商品目前的佇列人數（抓取時直接讀取 Redis，與 worker 數無關）"""
+    product_ids = await ProductService.get_product_ids(stale_ok=True)
+    depths = await QueueService.get_queue_depths(product_ids, stale_ok=True)
+    
+    return {
+        "eshield_queue_depth": {
+            "type": "gauge",
+            "help": "各商品目前的佇列人數",
+            "labelnames": ["product_id", "queue"],
+            "buckets": [],
+            "samples": [
+                [[product_id, queue], depth[f"total_in_{queue}"]]
+                for product_id, depth in depths.items()
+                for queue in ("waiting", "active")
+            ]
+        }
+    }
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus 指標（所有 worker 加總）"""
+    snapshot = await metrics_publisher.collect()
+    snapshot.update(await _collect_queue_depths())
+    
+    return PlainTextResponse(render_metrics(snapshot), media_type="text/plain; version=0.0.4")
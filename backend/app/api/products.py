@@ -3,7 +3,8 @@
 """
 from fastapi import APIRouter, HTTPException
 from app.services.product_service import ProductService
-from app.models.product import Product, ProductListResponse
+from app.services.product_cache import product_catalog_cache
+from app.models.product import Product, ProductListResponse, ProductUpsertRequest
 
 router = APIRouter()
 
@@ -11,14 +12,14 @@ router = APIRouter()
 @router.get("/products", response_model=ProductListResponse)
 async def get_products():
     """取得商品列表"""
-    products = ProductService.get_all_products()
+    products = await product_catalog_cache.get_all_products()
     return ProductListResponse(products=products)
 
 
 @router.get("/products/{product_id}", response_model=Product)
 async def get_product(product_id: str):
     """取得商品詳情"""
-    product = ProductService.get_product(product_id)
+    product = await product_catalog_cache.get_product(product_id)
     if not product:
         raise HTTPException(status_code=404, detail="商品不存在")
     return product
@@ -27,5 +28,32 @@ async def get_product(product_id: str):
 @router.post("/products/reset-stock")
 async def reset_stock():
     """重置所有商品庫存為初始值"""
-    ProductService.reset_stock()
+    await ProductService.reset_stock()
+    product_catalog_cache.invalidate()
     return {"success": True, "message": "庫存已重置"}
+
+
+@router.put("/products/{product_id}", response_model=Product)
+async def upsert_product(product_id: str, request: ProductUpsertRequest):
+    """新增或更新商品（同時登錄到商品索引）"""
+    await ProductService.upsert_product(
+        {
+            "id": product_id,
+            "name": request.name,
+            "image_url": request.image_url,
+            "price": request.price,
+            "total_stock": request.total_stock
+        },
+        reset_stock=request.reset_stock
+    )
+    product_catalog_cache.invalidate(product_id)
+    return await ProductService.get_product(product_id)
+
+
+@router.delete("/products/{product_id}")
+async def delete_product(product_id: str):
+    """刪除商品（同時自商品索引移除）"""
+    if not await ProductService.delete_product(product_id):
+        raise HTTPException(status_code=404, detail="商品不存在")
+    product_catalog_cache.invalidate(product_id)
+    return {"success": True, "message": "商品已刪除"}
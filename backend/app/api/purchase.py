@@ -4,9 +4,9 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel, Field
 from typing import Optional
-from app.services.queue_service import QueueService
 from app.services.inventory_service import InventoryService
-from app.services.session_service import SessionService
+from app.services.purchase_batcher import purchase_batcher
+from app.services.sold_out import sold_out_registry
 
 router = APIRouter()
 
@@ -29,20 +29,22 @@ class PurchaseResponse(BaseModel):
     error: Optional[str] = Field(None, description="錯誤代碼（失敗時）")
 
 
+PURCHASE_ERROR_MESSAGES = {
+    "NOT_IN_ACTIVE_QUEUE": "您不在搖滾區，無法購買",
+    "ALREADY_PURCHASED": "每人限購 1 雙，您已完成購買",
+    "INSUFFICIENT_STOCK": "庫存不足",
+    "PRODUCT_NOT_FOUND": "商品不存在"
+}
+
+
 @router.post("/purchase", response_model=PurchaseResponse)
 async def purchase(request: PurchaseRequest):
-    """處理購買（僅搖滾區使用者可購買）"""
-    session = SessionService.get_session(request.session_id)
-    if not session:
-        raise HTTPException(status_code=404, detail="會話不存在")
-    
-    position_active = QueueService.get_active_position(request.product_id, request.session_id)
-    
-    if position_active is None:
+    """處理購買（僅搖滾區使用者可購買，單一 Lua 腳本完成；售完時不存取 Redis）"""
+    if sold_out_registry.is_sold_out(request.product_id):
         return PurchaseResponse(
             success=False,
-            error="NOT_IN_ACTIVE_QUEUE",
-            message="您不在搖滾區，無法購買"
+            error="SOLD_OUT",
+            message="商品已售完"
         )
     
     if request.quantity != 1:
@@ -52,38 +54,25 @@ async def purchase(request: PurchaseRequest):
             message="每人限購 1 雙"
         )
     
-    success, error, remaining_stock = InventoryService.decrement_stock(
+    success, error, remaining_stock = await purchase_batcher.purchase(
         request.product_id,
-        request.quantity,
-        request.session_id
+        request.session_id,
+        request.quantity
     )
     
     if not success:
-        if error == "INSUFFICIENT_STOCK":
-            return PurchaseResponse(
-                success=False,
-                error="INSUFFICIENT_STOCK",
-                message="庫存不足"
-            )
-        elif error == "PRODUCT_NOT_FOUND":
-            return PurchaseResponse(
-                success=False,
-                error="PRODUCT_NOT_FOUND",
-                message="商品不存在"
-            )
-        else:
-            return PurchaseResponse(
-                success=False,
-                error=error or "UNKNOWN_ERROR",
-                message="購買失敗"
-            )
+        if error == "SESSION_NOT_FOUND":
+            raise HTTPException(status_code=404, detail="會話不存在")
+        return PurchaseResponse(
+            success=False,
+            error=error or "UNKNOWN_ERROR",
+            message=PURCHASE_ERROR_MESSAGES.get(error, "購買失敗")
+        )
     
-    QueueService.remove_from_active(request.product_id, request.session_id)
-    SessionService.update_session(
-        request.session_id,
-        queue_status="purchased"
-    )
-    QueueService.move_to_active(request.product_id)
+    if remaining_stock == 0 and not InventoryService.is_sharded():
+        # 本行程立即生效，其他副本由售完通知更新；
+        # 分片時加總為 0 可能只是其他購買的預留尚未結算，一律以購買流程確認後發布的售完通知為準
+        sold_out_registry.mark(request.product_id)
     
     import uuid
     order_id = f"order_{uuid.uuid4().hex[:8]}"
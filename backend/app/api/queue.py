@@ -5,18 +5,54 @@ from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import StreamingResponse
 from app.services.queue_service import QueueService
 from app.services.session_service import SessionService
-from app.services.turnstile_service import TurnstileService
+from app.services.turnstile_dispatcher import turnstile_dispatcher, OVERLOADED_ERROR
+from app.services.queue_broadcaster import queue_broadcaster
+from app.services.sold_out import sold_out_registry
+from app.tasks.queue_manager import notify_queue_change
 from app.middleware.rate_limit import queue_rate_limiter
+from app.core.metrics import SSE_CONNECTIONS
 from app.models.queue import JoinQueueRequest, JoinQueueResponse, QueueStatus
+from typing import Optional
 import asyncio
 import json
 
 router = APIRouter()
 
+STREAM_RESYNC_SECONDS = 15
+
+
+def _sold_out_status(session_id: str, product_id: str, status: str = "sold_out") -> QueueStatus:
+    """售完時的佇列狀態（不存取 Redis）"""
+    return QueueStatus(
+        session_id=session_id,
+        queue_position_waiting=-1,
+        queue_position_active=-1,
+        total_in_waiting=0,
+        total_in_active=0,
+        estimated_wait_time=0,
+        status=status,
+        product_id=product_id
+    )
+
+
+async def _get_sold_out_status(session_id: str, product_id: str) -> Optional[QueueStatus]:
+    """售完時的佇列狀態（只讀取會話狀態：已購買的會話維持 purchased，會話不存在時為 None）"""
+    queue_status = await SessionService.get_queue_status(session_id, product_id)
+    if queue_status is None:
+        return None
+    return _sold_out_status(session_id, product_id, "purchased" if queue_status == "purchased" else "sold_out")
+
 
 @router.post("/queue/join", response_model=JoinQueueResponse)
 async def join_queue(request: JoinQueueRequest, http_request: Request):
     """加入佇列（需通過 Turnstile 驗證）"""
+    if sold_out_registry.is_sold_out(request.product_id):
+        return JoinQueueResponse(
+            success=False,
+            error="SOLD_OUT",
+            message="商品已售完"
+        )
+    
     try:
         await queue_rate_limiter.check_rate_limit(http_request, "queue_join")
     except HTTPException:
@@ -27,7 +63,14 @@ async def join_queue(request: JoinQueueRequest, http_request: Request):
         )
     
     client_ip = http_request.client.host if http_request.client else None
-    verified, error = await TurnstileService.verify_token(request.turnstile_token, client_ip)
+    verified, error = await turnstile_dispatcher.verify(request.turnstile_token, client_ip)
+    
+    if error == OVERLOADED_ERROR:
+        raise HTTPException(
+            status_code=503,
+            detail="驗證請求過多，請稍後再試",
+            headers={"Retry-After": str(turnstile_dispatcher.get_retry_after())}
+        )
     
     if not verified:
         return JoinQueueResponse(
@@ -36,16 +79,15 @@ async def join_queue(request: JoinQueueRequest, http_request: Request):
             message="Turnstile 驗證失敗，無法加入佇列"
         )
     
-    session_id = SessionService.create_session(turnstile_verified=True)
-    position = QueueService.join_waiting_queue(request.product_id, session_id)
-    
-    SessionService.update_session(
-        session_id,
-        product_id=request.product_id,
-        queue_position_waiting=position,
-        queue_status="waiting"
+    session_id, position = await QueueService.join_with_new_session(
+        request.product_id,
+        turnstile_verified=True
     )
     
+    if position == 0:
+        # 排隊區原本沒有人，搖滾區可能有空位，喚醒佇列管理任務立即遞補
+        await notify_queue_change(request.product_id)
+    
     return JoinQueueResponse(
         success=True,
         session_id=session_id,
@@ -56,13 +98,19 @@ async def join_queue(request: JoinQueueRequest, http_request: Request):
 
 @router.get("/queue/status", response_model=QueueStatus)
 async def get_queue_status(session_id: str, product_id: str):
-    """查詢佇列狀態"""
-    session = SessionService.get_session(session_id)
-    if not session:
+    """查詢佇列狀態（單一 Redis 往返；售完時只讀取會話狀態）"""
+    if sold_out_registry.is_sold_out(product_id):
+        sold_out_status = await _get_sold_out_status(session_id, product_id)
+        if sold_out_status is None:
+            raise HTTPException(status_code=404, detail="會話不存在")
+        return sold_out_status
+    
+    snapshot = await QueueService.get_status_snapshot(product_id, session_id)
+    if not snapshot["session_exists"]:
         raise HTTPException(status_code=404, detail="會話不存在")
     
-    position_waiting = QueueService.get_waiting_position(product_id, session_id)
-    position_active = QueueService.get_active_position(product_id, session_id)
+    position_waiting = snapshot["queue_position_waiting"]
+    position_active = snapshot["queue_position_active"]
     
     if position_waiting is None and position_active is None:
         raise HTTPException(status_code=404, detail="使用者不在佇列中")
@@ -70,10 +118,13 @@ async def get_queue_status(session_id: str, product_id: str):
     position_waiting = position_waiting if position_waiting is not None else -1
     position_active = position_active if position_active is not None else -1
     
-    total_waiting = QueueService.get_waiting_count(product_id)
-    total_active = QueueService.get_active_count(product_id)
-    estimated_wait_time = QueueService.estimate_wait_time(
-        product_id, position_waiting, position_active
+    total_waiting = snapshot["total_in_waiting"]
+    total_active = snapshot["total_in_active"]
+    estimated_wait_time = QueueService.calculate_wait_time(
+        position_waiting,
+        position_active,
+        snapshot["promote_rate"],
+        snapshot["exit_rate"]
     )
     
     if position_active >= 0:
@@ -97,24 +148,53 @@ async def get_queue_status(session_id: str, product_id: str):
 
 @router.get("/queue/stream")
 async def stream_queue_status(session_id: str, product_id: str):
-    """SSE 端點：即時推送佇列狀態更新"""
+    """SSE 端點：即時推送佇列狀態更新（由佇列廣播驅動，不逐連線輪詢 Redis）"""
+    sold_out_data = _sold_out_status(session_id, product_id).model_dump(exclude={"session_id", "product_id"})
+    
     async def event_generator():
+        SSE_CONNECTIONS.inc()
         try:
+            if sold_out_registry.is_sold_out(product_id):
+                sold_out_status = await _get_sold_out_status(session_id, product_id)
+                if sold_out_status is None:
+                    yield f"event: queue_update\ndata: {json.dumps({'error': 'SESSION_NOT_FOUND'})}\n\n"
+                else:
+                    data = sold_out_status.model_dump(exclude={"session_id", "product_id"})
+                    yield f"event: queue_update\ndata: {json.dumps(data)}\n\n"
+                return
+            
+            anchor = await QueueService.get_status_snapshot(product_id, session_id)
+            state = anchor
+            
+            if not anchor["session_exists"]:
+                yield f"event: queue_update\ndata: {json.dumps({'error': 'SESSION_NOT_FOUND'})}\n\n"
+                return
+            
             while True:
-                position_waiting = QueueService.get_waiting_position(product_id, session_id)
-                position_active = QueueService.get_active_position(product_id, session_id)
+                head = max(state["head"], anchor["head"])
+                queue_index = anchor["queue_index"]
+                
+                if queue_index is not None and queue_index < head:
+                    anchor = state = await QueueService.get_status_snapshot(product_id, session_id)
+                    head = anchor["head"]
+                    queue_index = anchor["queue_index"]
                 
-                if position_waiting is None and position_active is None:
+                position_active = anchor["queue_position_active"]
+                
+                if queue_index is None and position_active is None:
                     yield f"event: queue_update\ndata: {json.dumps({'error': 'NOT_IN_QUEUE'})}\n\n"
                     break
                 
-                position_waiting = position_waiting if position_waiting is not None else -1
+                position_waiting = (
+                    QueueService.calculate_position(queue_index, head, state["tail"], state["total_in_waiting"])
+                    if queue_index is not None else -1
+                )
                 position_active = position_active if position_active is not None else -1
                 
-                total_waiting = QueueService.get_waiting_count(product_id)
-                total_active = QueueService.get_active_count(product_id)
-                estimated_wait_time = QueueService.estimate_wait_time(
-                    product_id, position_waiting, position_active
+                total_waiting = state["total_in_waiting"]
+                total_active = state["total_in_active"]
+                estimated_wait_time = QueueService.calculate_wait_time(
+                    position_waiting, position_active, state["promote_rate"], state["exit_rate"]
                 )
                 
                 if position_active == 0:
@@ -140,12 +220,24 @@ async def stream_queue_status(session_id: str, product_id: str):
                 if status in ["ready_to_purchase", "purchased", "expired"]:
                     break
                 
-                await asyncio.sleep(3)
+                update = await queue_broadcaster.wait_for_update(product_id, STREAM_RESYNC_SECONDS)
                 
+                if sold_out_registry.is_sold_out(product_id):
+                    yield f"event: queue_update\ndata: {json.dumps(sold_out_data)}\n\n"
+                    break
+                
+                if update is None or position_active >= 0:
+                    # 未收到廣播或已在搖滾區（人數有上限），直接向 Redis 重新定位
+                    anchor = state = await QueueService.get_status_snapshot(product_id, session_id)
+                else:
+                    state = update
+        
         except asyncio.CancelledError:
             pass
         except Exception as e:
             yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+        finally:
+            SSE_CONNECTIONS.dec()
     
     return StreamingResponse(
         event_generator(),
@@ -0,0 +1,387 @@
+"""
+Prometheus 格式指標
+
+各 worker 在記憶體中累計指標（只做字典與串列運算，不經過 Redis），
+並定期將快照寫入 Redis；/metrics 讀取所有仍存活 worker 的快照後加總輸出，
+因此多個 uvicorn worker 或副本的計數會合併成一份。
+Redis 指令依呼叫的服務（QueueService、InventoryService 等）分類，
+服務由 instrument_redis 類別裝飾器以 contextvar 標記。
+"""
+import asyncio
+import functools
+import inspect
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_redis_service: ContextVar[str] = ContextVar("redis_service", default="other")
+
+
+class Counter:
+    """累加計數指標"""
+    
+    type = "counter"
+    
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+    
+    def inc(self, labels: Tuple[str, ...] = (), amount: float = 1):
+        """增加計數"""
+        self._values[labels] = self._values.get(labels, 0) + amount
+    
+    def snapshot(self) -> List[list]:
+        """取得 [labels, value] 快照"""
+        return [[list(labels), value] for labels, value in self._values.items()]
+
+
+class Gauge(Counter):
+    """可增減的即時值指標（跨 worker 加總）"""
+    
+    type = "gauge"
+    
+    def dec(self, labels: Tuple[str, ...] = (), amount: float = 1):
+        """減少數值"""
+        self.inc(labels, -amount)
+    
+    def set(self, value: float, labels: Tuple[str, ...] = ()):
+        """設定數值"""
+        self._values[labels] = value
+
+
+class Histogram:
+    """延遲分布指標（各 bucket 分開計數，輸出時再累加）"""
+    
+    type = "histogram"
+    
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values: Dict[Tuple[str, ...], list] = {}
+    
+    def observe(self, value: float, labels: Tuple[str, ...] = ()):
+        """記錄一次觀測值（秒）"""
+        entry = self._values.get(labels)
+        if entry is None:
+            entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+    
+    def snapshot(self) -> List[list]:
+        """取得 [labels, [bucket counts, sum]] 快照"""
+        return [[list(labels), [list(counts), total]] for labels, (counts, total) in self._values.items()]
+
+
+class MetricsRegistry:
+    """指標註冊表"""
+    
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+    
+    def _register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+    
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        """註冊計數指標"""
+        return self._register(Counter(name, documentation, labelnames))
+    
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        """註冊即時值指標"""
+        return self._register(Gauge(name, documentation, labelnames))
+    
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ) -> Histogram:
+        """註冊延遲分布指標"""
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+    
+    def snapshot(self) -> Dict[str, dict]:
+        """取得本 worker 所有指標的快照（可序列化為 JSON）"""
+        return {
+            name: {
+                "type": metric.type,
+                "help": metric.documentation,
+                "labelnames": list(metric.labelnames),
+                "buckets": list(getattr(metric, "buckets", ())),
+                "samples": metric.snapshot()
+            }
+            for name, metric in self._metrics.items()
+        }
+
+
+def merge_snapshots(snapshots: List[Dict[str, dict]]) -> Dict[str, dict]:
+    """加總多個 worker 的快照（計數與 bucket 逐項相加）"""
+    merged: Dict[str, dict] = {}
+    
+    for snapshot in snapshots:
+        for name, metric in snapshot.items():
+            target = merged.setdefault(name, {**metric, "samples": {}})
+            for labels, value in metric["samples"]:
+                key = tuple(labels)
+                if metric["type"] != "histogram":
+                    target["samples"][key] = target["samples"].get(key, 0) + value
+                    continue
+                
+                current = target["samples"].get(key)
+                if current is None:
+                    target["samples"][key] = [list(value[0]), value[1]]
+                else:
+                    current[0] = [a + b for a, b in zip(current[0], value[0])]
+                    current[1] += value[1]
+    
+    for metric in merged.values():
+        metric["samples"] = [[list(labels), value] for labels, value in metric["samples"].items()]
+    return merged
+
+
+def _escape_label_value(value) -> str:
+    """跳脫標籤值中的反斜線、雙引號與換行"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    """組成 {name="value"} 標籤字串"""
+    pairs = [f'{name}="{_escape_label_value(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    """數值輸出（整數不帶小數點）"""
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def render_metrics(snapshot: Dict[str, dict]) -> str:
+    """輸出 Prometheus text exposition format"""
+    lines = []
+    
+    for name, metric in sorted(snapshot.items()):
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        labelnames = metric["labelnames"]
+        
+        for labels, value in metric["samples"]:
+            if metric["type"] != "histogram":
+                lines.append(f"{name}{_format_labels(labelnames, labels)} {_format_value(value)}")
+                continue
+            
+            counts, total = value
+            cumulative = 0
+            for bound, count in zip(list(metric["buckets"]) + ["+Inf"], counts):
+                cumulative += count
+                le = "+Inf" if bound == "+Inf" else _format_value(bound)
+                bucket_labels = _format_labels(labelnames, labels, 'le="' + le + '"')
+                lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labelnames, labels)} {_format_value(total)}")
+            lines.append(f"{name}_count{_format_labels(labelnames, labels)} {cumulative}")
+    
+    return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+HTTP_REQUEST_DURATION = registry.histogram(
+    "eshield_http_request_duration_seconds",
+    "HTTP 請求處理時間（至回應標頭送出，SSE 不含串流時間）",
+    ("method", "route", "status")
+)
+REDIS_COMMANDS = registry.counter(
+    "eshield_redis_commands_total",
+    "Redis 指令數（pipeline 內的指令逐一計算）",
+    ("service", "command")
+)
+REDIS_ROUNDTRIP_DURATION = registry.histogram(
+    "eshield_redis_roundtrip_duration_seconds",
+    "Redis 往返時間（單一指令或整個 pipeline）",
+    ("service",)
+)
+QUEUE_PROMOTIONS = registry.counter(
+    "eshield_queue_promotions_total",
+    "由排隊區移入搖滾區的人數",
+    ("product_id",)
+)
+SSE_CONNECTIONS = registry.gauge(
+    "eshield_sse_connections",
+    "目前開啟的 SSE 佇列狀態連線數"
+)
+QUEUE_MANAGER_TICK_DURATION = registry.histogram(
+    "eshield_queue_manager_tick_duration_seconds",
+    "佇列管理任務每週期處理本 worker 持有商品的時間"
+)
+QUEUE_MANAGER_BACKLOG = registry.gauge(
+    "eshield_queue_manager_backlog",
+    "本 worker 持有商品的排隊區總人數（最近一次週期）"
+)
+TURNSTILE_VERIFY_DURATION = registry.histogram(
+    "eshield_turnstile_verify_duration_seconds",
+    "Turnstile 驗證時間（不含快取命中）",
+    ("result",)
+)
+
+
+def observe_redis(commands: Sequence[str], elapsed: float):
+    """記錄一次 Redis 往返（由 Redis 客戶端呼叫）"""
+    service = _redis_service.get()
+    for command in commands:
+        REDIS_COMMANDS.inc((service, str(command).upper()))
+    REDIS_ROUNDTRIP_DURATION.observe(elapsed, (service,))
+
+
+def _with_service(service: str, func):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        token = _redis_service.set(service)
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            _redis_service.reset(token)
+    return wrapper
+
+
+def instrument_redis(service: str):
+    """類別裝飾器：類別內所有 async 方法發出的 Redis 指令標記為 service"""
+    def decorate(cls):
+        for name, attr in list(vars(cls).items()):
+            is_static = isinstance(attr, staticmethod)
+            func = attr.__func__ if is_static else attr
+            if not inspect.iscoroutinefunction(func):
+                continue
+            wrapped = _with_service(service, func)
+            setattr(cls, name, staticmethod(wrapped) if is_static else wrapped)
+        return cls
+    return decorate
+
+
+class WorkerMetricsPublisher:
+    """定期將本 worker 的指標快照寫入 Redis，供 /metrics 跨 worker 加總"""
+    
+    WORKERS_KEY = "metrics:workers"
+    
+    def __init__(self, interval_seconds: float = 5):
+        """
+        初始化指標發布器
+        
+        Args:
+            interval_seconds: 快照寫入間隔（秒），超過三個間隔未更新的 worker 視為已停止
+        """
+        self.interval_seconds = interval_seconds
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._task: Optional[asyncio.Task] = None
+    
+    @staticmethod
+    def _get_snapshot_key(worker_id: str) -> str:
+        """取得 worker 指標快照 Redis key"""
+        return f"metrics:worker:{worker_id}"
+    
+    async def publish(self):
+        """寫入本 worker 的指標快照"""
+        from app.core.redis import get_async_redis_client
+        
+        ttl_ms = int(self.interval_seconds * 3 * 1000)
+        redis_client = get_async_redis_client()
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.set(self._get_snapshot_key(self.worker_id), json.dumps(registry.snapshot()), px=ttl_ms)
+        pipe.zadd(self.WORKERS_KEY, {self.worker_id: int(time.time() * 1000)})
+        await pipe.execute()
+    
+    async def collect(self) -> Dict[str, dict]:
+        """
+        取得所有存活 worker 加總後的指標
+        
+        Redis 無法連線時只回傳本 worker 的指標。
+        """
+        from app.core.redis import get_async_redis_client
+        
+        try:
+            await self.publish()
+            redis_client = get_async_redis_client()
+            stale_before = int((time.time() - self.interval_seconds * 3) * 1000)
+            await redis_client.zremrangebyscore(self.WORKERS_KEY, "-inf", stale_before)
+            worker_ids = await redis_client.zrange(self.WORKERS_KEY, 0, -1)
+            # 各 worker 的快照可能在不同 Cluster 節點，以 pipeline 取代 MGET
+            pipe = redis_client.pipeline(transaction=False)
+            for worker_id in worker_ids:
+                pipe.get(self._get_snapshot_key(worker_id))
+            payloads = await pipe.execute()
+        except Exception as e:
+            logger.warning(f"無法讀取其他 worker 的指標，只輸出本 worker: {str(e)}")
+            snapshots = [registry.snapshot()]
+        else:
+            snapshots = [json.loads(payload) for payload in payloads if payload]
+        
+        merged = merge_snapshots(snapshots)
+        merged["eshield_metrics_workers"] = {
+            "type": "gauge",
+            "help": "回報指標的 worker 數",
+            "labelnames": [],
+            "buckets": [],
+            "samples": [[[], len(snapshots)]]
+        }
+        return merged
+    
+    async def _run(self):
+        """定期寫入快照"""
+        while True:
+            try:
+                await self.publish()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"寫入指標快照失敗: {str(e)}")
+            await asyncio.sleep(self.interval_seconds)
+    
+    def start(self) -> asyncio.Task:
+        """啟動快照寫入任務"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return self._task
+    
+    async def stop(self):
+        """停止快照寫入任務並移除本 worker 的快照"""
+        if self._task is None:
+            return
+        
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        
+        from app.core.redis import get_async_redis_client
+        redis_client = get_async_redis_client()
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.zrem(self.WORKERS_KEY, self.worker_id)
+        pipe.delete(self._get_snapshot_key(self.worker_id))
+        await pipe.execute()
+
+
+metrics_publisher = WorkerMetricsPublisher(
+    interval_seconds=float(os.getenv("METRICS_PUBLISH_INTERVAL_SECONDS", "5"))
+)
@@ -1,13 +1,104 @@
 """
 Redis 連線模組
+
+設定 REDIS_CLUSTER=true 時改用 Redis Cluster 客戶端。同一商品的 key 以 hash tag（見 hash_tag）
+落在同一個 slot，Lua 腳本與單一商品的操作不會跨 slot；不同商品則分散到各節點。
+
+設定 REDIS_SENTINELS 時經由 Sentinel 取得主節點；複本（REDIS_REPLICA_URLS 或 Sentinel 回報的複本）
+只供可容忍延遲的讀取使用，路由與延遲上限見 app.core.replicas。
 """
 import os
-from typing import Optional
+import time
+from typing import List, Optional, Tuple, Union
 import redis
+import redis.asyncio as aioredis
+from redis.asyncio.client import Pipeline
+from redis.asyncio.cluster import ClusterPipeline, RedisCluster
+from redis.asyncio.sentinel import Sentinel
 from redis.connection import ConnectionPool
+from app.core.metrics import observe_redis
+
+
+def hash_tag(value: str) -> str:
+    """
+    產生 Redis Cluster hash tag
+    
+    key 中只有 {...} 內的部分參與 slot 計算，含有相同 tag 的 key 會落在同一個 slot。
+    """
+    return f"{{{value}}}"
+
+
+class InstrumentedPipeline(Pipeline):
+    """記錄指令數與往返時間的 pipeline"""
+    
+    async def execute(self, raise_on_error: bool = True):
+        commands = [args[0] for args, _ in self.command_stack]
+        started = time.perf_counter()
+        try:
+            return await super().execute(raise_on_error)
+        finally:
+            if commands:
+                observe_redis(commands, time.perf_counter() - started)
+
+
+class InstrumentedRedis(aioredis.Redis):
+    """記錄指令數與往返時間的非同步 Redis 客戶端（依呼叫服務分類，見 app.core.metrics）"""
+    
+    async def execute_command(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            observe_redis(args[:1], time.perf_counter() - started)
+    
+    def pipeline(self, transaction: bool = True, shard_hint: Optional[str] = None) -> InstrumentedPipeline:
+        return InstrumentedPipeline(
+            self.connection_pool, self.response_callbacks, transaction, shard_hint
+        )
+
+
+class InstrumentedClusterPipeline(ClusterPipeline):
+    """記錄指令數與往返時間的 Cluster pipeline（依 slot 分送到各節點）"""
+    
+    async def execute(self, raise_on_error: bool = True, allow_redirections: bool = True):
+        commands = [command.args[0] for command in self._command_stack]
+        started = time.perf_counter()
+        try:
+            return await super().execute(raise_on_error, allow_redirections)
+        finally:
+            if commands:
+                observe_redis(commands, time.perf_counter() - started)
+
+
+class InstrumentedRedisCluster(RedisCluster):
+    """記錄指令數與往返時間的非同步 Redis Cluster 客戶端"""
+    
+    async def execute_command(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            observe_redis(args[:1], time.perf_counter() - started)
+    
+    def pipeline(self, transaction: bool = True, shard_hint: Optional[str] = None) -> InstrumentedClusterPipeline:
+        """
+        建立 pipeline
+        
+        Cluster 不支援跨 slot 的 MULTI，transaction 參數僅為與單機客戶端相容而保留；
+        需要原子性的單一商品操作一律以 Lua 腳本執行。
+        """
+        return InstrumentedClusterPipeline(self)
+
+
+AsyncRedisClient = Union[aioredis.Redis, RedisCluster]
 
 _redis_pool: Optional[ConnectionPool] = None
-_redis_client: Optional[redis.Redis] = None
+_redis_client: Optional[Union[redis.Redis, redis.RedisCluster]] = None
+
+_async_redis_pool: Optional[aioredis.ConnectionPool] = None
+_async_redis_client: Optional[AsyncRedisClient] = None
+_async_pubsub_client: Optional[aioredis.Redis] = None
+_async_sentinel: Optional[Sentinel] = None
 
 
 def get_redis_url() -> str:
@@ -15,18 +106,190 @@ def get_redis_url() -> str:
     return os.getenv("REDIS_URL", "redis://localhost:6379")
 
 
-def get_redis_client() -> redis.Redis:
-    """取得 Redis 客戶端（單例模式）"""
+def is_cluster_mode() -> bool:
+    """是否連線到 Redis Cluster（環境變數 REDIS_CLUSTER）"""
+    return os.getenv("REDIS_CLUSTER", "false").lower() == "true"
+
+
+def get_sentinel_settings() -> Optional[Tuple[List[Tuple[str, int]], str]]:
+    """
+    取得 Sentinel 設定
+    
+    環境變數：
+        REDIS_SENTINELS: Sentinel 位址（host:port，以逗號分隔），未設定表示不使用 Sentinel
+        REDIS_SENTINEL_SERVICE: 主節點服務名稱
+    
+    Returns:
+        Optional[Tuple[List[Tuple[str, int]], str]]: (Sentinel 位址, 服務名稱)
+    """
+    sentinels = [address.strip() for address in os.getenv("REDIS_SENTINELS", "").split(",") if address.strip()]
+    if not sentinels:
+        return None
+    
+    addresses = []
+    for address in sentinels:
+        host, _, port = address.rpartition(":")
+        addresses.append((host, int(port)))
+    return addresses, os.getenv("REDIS_SENTINEL_SERVICE", "mymaster")
+
+
+def get_replica_urls() -> List[str]:
+    """取得唯讀複本 URL（環境變數 REDIS_REPLICA_URLS，以逗號分隔）"""
+    return [url.strip() for url in os.getenv("REDIS_REPLICA_URLS", "").split(",") if url.strip()]
+
+
+def get_pool_settings() -> dict:
+    """
+    取得連線池設定
+    
+    環境變數：
+        REDIS_MAX_CONNECTIONS: 連線池大小
+        REDIS_POOL_TIMEOUT: 連線池耗盡時等待可用連線的秒數
+        REDIS_SOCKET_TIMEOUT: 單一指令逾時（秒）
+        REDIS_SOCKET_CONNECT_TIMEOUT: 建立連線逾時（秒）
+        REDIS_HEALTH_CHECK_INTERVAL: 閒置連線健康檢查間隔（秒，0 表示停用）
+    """
+    return {
+        "max_connections": int(os.getenv("REDIS_MAX_CONNECTIONS", "200")),
+        "timeout": float(os.getenv("REDIS_POOL_TIMEOUT", "5")),
+        "socket_timeout": float(os.getenv("REDIS_SOCKET_TIMEOUT", "5")),
+        "socket_connect_timeout": float(os.getenv("REDIS_SOCKET_CONNECT_TIMEOUT", "5")),
+        "health_check_interval": int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", "30")),
+    }
+
+
+def get_redis_client() -> Union[redis.Redis, redis.RedisCluster]:
+    """取得同步 Redis 客戶端（單例模式，供腳本與測試使用）"""
     global _redis_client, _redis_pool
     
     if _redis_client is None:
         redis_url = get_redis_url()
-        _redis_pool = ConnectionPool.from_url(redis_url, decode_responses=True)
-        _redis_client = redis.Redis(connection_pool=_redis_pool)
+        if is_cluster_mode():
+            _redis_client = redis.RedisCluster.from_url(redis_url, decode_responses=True)
+        else:
+            _redis_pool = ConnectionPool.from_url(redis_url, decode_responses=True)
+            _redis_client = redis.Redis(connection_pool=_redis_pool)
     
     return _redis_client
 
 
+def _create_async_cluster_client() -> InstrumentedRedisCluster:
+    """建立 Redis Cluster 客戶端（REDIS_URL 為任一節點，啟動時自動探索其他節點；連線數上限為每個節點）"""
+    settings = get_pool_settings()
+    return InstrumentedRedisCluster.from_url(
+        get_redis_url(),
+        decode_responses=True,
+        max_connections=settings["max_connections"],
+        socket_timeout=settings["socket_timeout"],
+        socket_connect_timeout=settings["socket_connect_timeout"],
+        health_check_interval=settings["health_check_interval"]
+    )
+
+
+def get_async_redis_client() -> AsyncRedisClient:
+    """
+    取得非同步 Redis 客戶端（單例模式）
+    
+    連線池綁定於建立時的 event loop，正式環境由 lifespan 呼叫
+    init_async_redis() 建立並於關閉時釋放。
+    """
+    global _async_redis_client, _async_redis_pool
+    
+    if _async_redis_client is None:
+        if is_cluster_mode():
+            _async_redis_client = _create_async_cluster_client()
+        elif get_sentinel_settings():
+            _, service_name = get_sentinel_settings()
+            _async_redis_client = _get_async_sentinel().master_for(
+                service_name, redis_class=InstrumentedRedis, **_get_sentinel_pool_settings()
+            )
+            _async_redis_pool = _async_redis_client.connection_pool
+        else:
+            _async_redis_pool = aioredis.BlockingConnectionPool.from_url(
+                get_redis_url(),
+                decode_responses=True,
+                retry_on_timeout=True,
+                **get_pool_settings()
+            )
+            _async_redis_client = InstrumentedRedis(connection_pool=_async_redis_pool)
+    
+    return _async_redis_client
+
+
+def _get_sentinel_pool_settings() -> dict:
+    """Sentinel 連線池設定（SentinelConnectionPool 不支援等待可用連線的 timeout）"""
+    settings = get_pool_settings()
+    settings.pop("timeout")
+    return {"decode_responses": True, "retry_on_timeout": True, **settings}
+
+
+def _get_async_sentinel() -> Sentinel:
+    """取得 Sentinel 客戶端（單例模式）"""
+    global _async_sentinel
+    
+    if _async_sentinel is None:
+        sentinels, _ = get_sentinel_settings()
+        _async_sentinel = Sentinel(sentinels, socket_timeout=get_pool_settings()["socket_timeout"])
+    
+    return _async_sentinel
+
+
+def create_async_replica_clients() -> List[aioredis.Redis]:
+    """
+    建立唯讀複本客戶端（每次呼叫建立新的連線池，由呼叫端負責關閉）
+    
+    使用 REDIS_REPLICA_URLS 時每個 URL 一個客戶端；使用 Sentinel 時為單一客戶端，
+    由 SentinelConnectionPool 在 Sentinel 回報的複本間輪替。Cluster 模式不拆分讀寫，回傳空清單。
+    """
+    if is_cluster_mode():
+        return []
+    
+    if get_sentinel_settings():
+        _, service_name = get_sentinel_settings()
+        return [
+            _get_async_sentinel().slave_for(
+                service_name, redis_class=InstrumentedRedis, **_get_sentinel_pool_settings()
+            )
+        ]
+    
+    return [
+        InstrumentedRedis(
+            connection_pool=aioredis.BlockingConnectionPool.from_url(
+                url,
+                decode_responses=True,
+                retry_on_timeout=True,
+                **get_pool_settings()
+            )
+        )
+        for url in get_replica_urls()
+    ]
+
+
+def get_async_pubsub_client() -> aioredis.Redis:
+    """
+    取得 pub/sub 用的非同步 Redis 客戶端
+    
+    Cluster 客戶端不支援 pub/sub，改以單一節點連線發布與訂閱
+    （Cluster 的 PUBLISH 會轉送到所有節點）；單機模式即為一般客戶端。
+    """
+    global _async_pubsub_client
+    
+    if not is_cluster_mode():
+        return get_async_redis_client()
+    
+    if _async_pubsub_client is None:
+        _async_pubsub_client = InstrumentedRedis.from_url(get_redis_url(), decode_responses=True)
+    
+    return _async_pubsub_client
+
+
+async def init_async_redis() -> AsyncRedisClient:
+    """建立非同步連線池並確認 Redis 可連線"""
+    client = get_async_redis_client()
+    await client.ping()
+    return client
+
+
 def close_redis():
     """關閉 Redis 連線"""
     global _redis_client, _redis_pool
@@ -38,3 +301,25 @@ def close_redis():
     if _redis_pool:
         _redis_pool.disconnect()
         _redis_pool = None
+
+
+async def close_async_redis():
+    """關閉非同步 Redis 連線"""
+    global _async_redis_client, _async_redis_pool, _async_pubsub_client, _async_sentinel
+    
+    if _async_pubsub_client:
+        await _async_pubsub_client.aclose()
+        _async_pubsub_client = None
+    
+    if _async_redis_client:
+        await _async_redis_client.aclose()
+        _async_redis_client = None
+    
+    if _async_redis_pool:
+        await _async_redis_pool.disconnect()
+        _async_redis_pool = None
+    
+    if _async_sentinel:
+        for sentinel in _async_sentinel.sentinels:
+            await sentinel.aclose()
+        _async_sentinel = None
@@ -0,0 +1,156 @@
+"""
+唯讀複本路由
+
+可容忍短暫延遲的讀取（商品列表、佇列人數、SSE 總覽）以 get_async_read_client() 取得客戶端，
+由健康的複本輪流處理；加入、晉升、購買與依會話定位的查詢一律使用主節點，
+讓主節點的 CPU 保留給必須原子執行的寫入。
+
+延遲以心跳量測：每次檢查時在主節點寫入目前時間，再從各複本讀回，兩者的差即為複製延遲。
+延遲超過上限或無法連線的複本暫停使用，沒有可用複本時改讀主節點，
+因此讀到的資料最多落後 max_staleness_ms + check_interval_ms。
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import List, Optional, Set
+import redis.asyncio as aioredis
+from app.core.redis import AsyncRedisClient, create_async_replica_clients, get_async_redis_client
+
+logger = logging.getLogger(__name__)
+
+
+class ReplicaRouter:
+    """依複製延遲將可容忍延遲的讀取分送到複本"""
+    
+    HEARTBEAT_KEY = "replication:heartbeat"
+    
+    def __init__(self, max_staleness_ms: int = 1000, check_interval_ms: int = 500):
+        """
+        初始化複本路由
+        
+        Args:
+            max_staleness_ms: 可接受的最大複製延遲（毫秒）
+            check_interval_ms: 延遲檢查間隔（毫秒）
+        """
+        self.max_staleness_ms = max_staleness_ms
+        self.check_interval_ms = check_interval_ms
+        self._replicas: Optional[List[aioredis.Redis]] = None
+        self.healthy: List[int] = []
+        self._next = 0
+        self._checker_task: Optional[asyncio.Task] = None
+        self.staleness_ms: List[Optional[int]] = []
+        self.stats = {
+            "replica_reads": 0,
+            "primary_reads": 0,
+            "stale": 0
+        }
+    
+    def _get_replicas(self) -> List[aioredis.Redis]:
+        """取得複本客戶端（延遲建立）"""
+        if self._replicas is None:
+            self._replicas = create_async_replica_clients()
+            self.staleness_ms = [None] * len(self._replicas)
+        return self._replicas
+    
+    def get_client(self) -> AsyncRedisClient:
+        """取得讀取用客戶端：健康的複本輪流使用，沒有時為主節點"""
+        healthy = self.healthy
+        if not healthy:
+            self.stats["primary_reads"] += 1
+            return get_async_redis_client()
+        
+        self._next = (self._next + 1) % len(healthy)
+        self.stats["replica_reads"] += 1
+        return self._replicas[healthy[self._next]]
+    
+    async def check(self) -> List[int]:
+        """
+        量測各複本的複製延遲並更新可用複本
+        
+        Returns:
+            List[int]: 可用複本的索引
+        """
+        replicas = self._get_replicas()
+        if not replicas:
+            return []
+        
+        await get_async_redis_client().set(self.HEARTBEAT_KEY, int(time.time() * 1000))
+        
+        healthy = []
+        stale: Set[int] = set()
+        for index, replica in enumerate(replicas):
+            try:
+                heartbeat = await replica.get(self.HEARTBEAT_KEY)
+            except Exception as e:
+                logger.warning(f"複本 {index} 無法連線，暫停使用: {str(e)}")
+                self.staleness_ms[index] = None
+                continue
+            
+            staleness = max(int(time.time() * 1000) - int(heartbeat), 0) if heartbeat else None
+            self.staleness_ms[index] = staleness
+            if staleness is not None and staleness <= self.max_staleness_ms:
+                healthy.append(index)
+            else:
+                stale.add(index)
+        
+        newly_stale = stale & set(self.healthy)
+        if newly_stale:
+            self.stats["stale"] += len(newly_stale)
+            logger.warning(f"複本 {sorted(newly_stale)} 複製延遲超過 {self.max_staleness_ms}ms，改讀其他複本或主節點")
+        
+        self.healthy = healthy
+        return healthy
+    
+    async def _run(self):
+        """定期檢查複本延遲"""
+        while True:
+            try:
+                await self.check()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.healthy = []
+                logger.error(f"複本延遲檢查錯誤，暫時改讀主節點: {str(e)}")
+            await asyncio.sleep(self.check_interval_ms / 1000)
+    
+    def start(self) -> Optional[asyncio.Task]:
+        """啟動延遲檢查任務（未設定複本時不啟動）"""
+        if not self._get_replicas():
+            return None
+        if self._checker_task is None or self._checker_task.done():
+            self._checker_task = asyncio.create_task(self._run())
+        return self._checker_task
+    
+    async def stop(self):
+        """停止延遲檢查任務並關閉複本連線"""
+        if self._checker_task is not None:
+            self._checker_task.cancel()
+            try:
+                await self._checker_task
+            except asyncio.CancelledError:
+                pass
+            self._checker_task = None
+        
+        self.healthy = []
+        for replica in self._replicas or []:
+            await replica.aclose(close_connection_pool=True)
+        self._replicas = None
+
+
+replica_router = ReplicaRouter(
+    max_staleness_ms=int(os.getenv("REDIS_REPLICA_MAX_STALENESS_MS", "1000")),
+    check_interval_ms=int(os.getenv("REDIS_REPLICA_CHECK_INTERVAL_MS", "500"))
+)
+
+
+def get_async_read_client(stale_ok: bool = True) -> AsyncRedisClient:
+    """
+    取得讀取用客戶端（見模組說明）
+    
+    Args:
+        stale_ok: 呼叫端是否可容忍複製延遲；False 時一律使用主節點
+    """
+    if not stale_ok:
+        return get_async_redis_client()
+    return replica_router.get_client()
@@ -0,0 +1,169 @@
+"""
+Lua 腳本註冊模組
+
+啟動時一次讀取 app/scripts/*.lua 並以 SCRIPT LOAD 註冊，之後以 EVALSHA 呼叫；
+Redis 重啟或故障轉移後遇到 NOSCRIPT 會自動重新載入。
+"""
+import hashlib
+import logging
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import redis.asyncio as aioredis
+from redis.exceptions import NoScriptError
+from app.core.redis import get_async_redis_client
+
+logger = logging.getLogger(__name__)
+
+SCRIPTS_DIR = Path(__file__).resolve().parent.parent / "scripts"
+
+_scripts: Dict[str, str] = {}
+_script_shas: Dict[str, str] = {}
+_script_stats: Dict[str, Dict[str, float]] = {}
+
+
+def load_scripts() -> Dict[str, str]:
+    """從磁碟讀取所有 Lua 腳本（只讀取一次）"""
+    if not _scripts:
+        for script_path in sorted(SCRIPTS_DIR.glob("*.lua")):
+            source = script_path.read_text(encoding="utf-8")
+            _scripts[script_path.stem] = source
+            _script_shas[script_path.stem] = hashlib.sha1(source.encode("utf-8")).hexdigest()
+            _script_stats[script_path.stem] = {
+                "calls": 0,
+                "errors": 0,
+                "reloads": 0,
+                "total_ms": 0.0,
+                "max_ms": 0.0
+            }
+    return _scripts
+
+
+async def register_scripts(client: Optional[aioredis.Redis] = None):
+    """以 SCRIPT LOAD 將所有腳本註冊到 Redis"""
+    redis_client = client or get_async_redis_client()
+    
+    for name, source in load_scripts().items():
+        _script_shas[name] = await redis_client.script_load(source)
+    
+    logger.info(f"已註冊 {len(_script_shas)} 個 Lua 腳本: {', '.join(_script_shas)}")
+
+
+async def run_script(
+    name: str,
+    keys: Sequence[str],
+    args: Sequence[Any],
+    client: Optional[aioredis.Redis] = None
+) -> Any:
+    """
+    以 EVALSHA 執行已註冊的腳本
+    
+    Args:
+        name: 腳本名稱（檔名去除 .lua）
+        keys: KEYS 參數
+        args: ARGV 參數
+        client: Redis 客戶端（預設為共用的非同步客戶端）
+    
+    Returns:
+        Any: 腳本回傳值
+    """
+    scripts = load_scripts()
+    if name not in scripts:
+        raise KeyError(f"未知的 Lua 腳本: {name}")
+    
+    redis_client = client or get_async_redis_client()
+    stats = _script_stats[name]
+    started = time.perf_counter()
+    
+    try:
+        try:
+            return await redis_client.evalsha(_script_shas[name], len(keys), *keys, *args)
+        except NoScriptError:
+            logger.warning(f"Lua 腳本 {name} 不存在於 Redis（可能已重啟），重新載入")
+            stats["reloads"] += 1
+            _script_shas[name] = await redis_client.script_load(scripts[name])
+            return await redis_client.evalsha(_script_shas[name], len(keys), *keys, *args)
+    except Exception:
+        stats["errors"] += 1
+        raise
+    finally:
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        stats["calls"] += 1
+        stats["total_ms"] += elapsed_ms
+        stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+
+
+async def run_script_many(
+    name: str,
+    calls: Sequence[Tuple[Sequence[str], Sequence[Any]]],
+    client: Optional[aioredis.Redis] = None
+) -> List[Any]:
+    """
+    以一個 pipeline 執行同一腳本多次（各次的 key 可落在不同 slot），只需一次往返
+    
+    遇到 NOSCRIPT 的呼叫未曾執行，重新載入腳本後只重送這些呼叫。
+    
+    Args:
+        name: 腳本名稱（檔名去除 .lua）
+        calls: 每次呼叫的 (KEYS 參數, ARGV 參數)
+        client: Redis 客戶端（預設為共用的非同步客戶端）
+    
+    Returns:
+        List[Any]: 與 calls 對應的腳本回傳值
+    """
+    scripts = load_scripts()
+    if name not in scripts:
+        raise KeyError(f"未知的 Lua 腳本: {name}")
+    if not calls:
+        return []
+    
+    redis_client = client or get_async_redis_client()
+    stats = _script_stats[name]
+    started = time.perf_counter()
+    
+    async def execute(indexes: List[int]) -> List[Any]:
+        pipe = redis_client.pipeline(transaction=False)
+        for index in indexes:
+            keys, args = calls[index]
+            pipe.evalsha(_script_shas[name], len(keys), *keys, *args)
+        return await pipe.execute(raise_on_error=False)
+    
+    try:
+        results = await execute(list(range(len(calls))))
+        missing = [index for index, result in enumerate(results) if isinstance(result, NoScriptError)]
+        if missing:
+            logger.warning(f"Lua 腳本 {name} 不存在於 Redis（可能已重啟），重新載入")
+            stats["reloads"] += 1
+            _script_shas[name] = await redis_client.script_load(scripts[name])
+            for index, result in zip(missing, await execute(missing)):
+                results[index] = result
+        
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+        return results
+    except Exception:
+        stats["errors"] += 1
+        raise
+    finally:
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        stats["calls"] += len(calls)
+        stats["total_ms"] += elapsed_ms
+        stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+
+
+def get_script_stats() -> Dict[str, Dict[str, Any]]:
+    """取得各腳本的呼叫次數與延遲統計"""
+    load_scripts()
+    return {
+        name: {
+            "sha": _script_shas[name],
+            "calls": int(stats["calls"]),
+            "errors": int(stats["errors"]),
+            "reloads": int(stats["reloads"]),
+            "avg_ms": round(stats["total_ms"] / stats["calls"], 3) if stats["calls"] else 0.0,
+            "max_ms": round(stats["max_ms"], 3)
+        }
+        for name, stats in _script_stats.items()
+    }
+
@@ -6,15 +6,26 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.exceptions import RequestValidationError
 from starlette.exceptions import HTTPException as StarletteHTTPException
 from contextlib import asynccontextmanager
-from app.api import health, products, queue, purchase
+from app.api import health, metrics, products, queue, purchase
 from app.services.product_service import ProductService
-from app.tasks.queue_manager import start_queue_manager
+from app.tasks.queue_manager import start_queue_manager, stop_queue_manager
+from app.services.queue_broadcaster import queue_broadcaster
+from app.services.product_cache import product_catalog_cache
+from app.services.turnstile_service import TurnstileService
+from app.services.turnstile_dispatcher import turnstile_dispatcher
+from app.services.purchase_batcher import purchase_batcher
+from app.services.sold_out import sold_out_registry
 from app.middleware.error_handler import (
     http_exception_handler,
     validation_exception_handler,
     general_exception_handler
 )
 from app.core.logging import setup_logging
+from app.core.redis import init_async_redis, close_async_redis
+from app.core.replicas import replica_router
+from app.core.scripts import register_scripts
+from app.core.metrics import metrics_publisher
+from app.middleware.metrics import MetricsMiddleware
 import logging
 
 
@@ -24,13 +35,38 @@ async def lifespan(app: FastAPI):
     setup_logging()
     logger = logging.getLogger(__name__)
     
+    logger.info("建立 Redis 連線池...")
+    await init_async_redis()
+    replica_router.start()
+    logger.info("註冊 Lua 腳本...")
+    await register_scripts()
+    logger.info("建立 Turnstile 驗證連線池...")
+    await TurnstileService.start()
+    turnstile_dispatcher.start()
     logger.info("初始化商品資料...")
-    ProductService.initialize_products()
+    await ProductService.initialize_products()
+    logger.info("啟動商品快取失效與售完狀態訂閱...")
+    product_catalog_cache.start()
+    sold_out_registry.start()
+    logger.info("啟動佇列狀態廣播訂閱...")
+    queue_broadcaster.start()
     logger.info("啟動佇列管理任務...")
     start_queue_manager()
+    logger.info("啟動指標快照發布...")
+    metrics_publisher.start()
     logger.info("應用程式啟動完成")
     yield
     logger.info("應用程式關閉中...")
+    await metrics_publisher.stop()
+    await purchase_batcher.stop()
+    await stop_queue_manager()
+    await queue_broadcaster.stop()
+    await sold_out_registry.stop()
+    await product_catalog_cache.stop()
+    await turnstile_dispatcher.stop()
+    await TurnstileService.close()
+    await replica_router.stop()
+    await close_async_redis()
 
 
 app = FastAPI(
@@ -51,8 +87,10 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
 
 app.include_router(health.router, prefix="/api", tags=["健康檢查"])
+app.include_router(metrics.router, tags=["監控"])
 app.include_router(products.router, prefix="/api", tags=["商品"])
 app.include_router(queue.router, prefix="/api", tags=["佇列"])
 app.include_router(purchase.router, prefix="/api", tags=["購買"])
@@ -27,7 +27,8 @@ async def http_exception_handler(request: Request, exc: StarletteHTTPException):
             "success": False,
             "error": f"HTTP_{exc.status_code}",
             "message": exc.detail if isinstance(exc.detail, str) else str(exc.detail)
-        }
+        },
+        headers=getattr(exc, "headers", None)
     )
 
 
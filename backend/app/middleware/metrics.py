@@ -0,0 +1,54 @@
+"""
+請求延遲指標中間件
+
+以純 ASGI 中間件實作（不包裝 StreamingResponse），於回應標頭送出時記錄延遲，
+路由標籤使用路徑樣板（例如 /api/products/{product_id}），避免商品 ID 造成標籤爆量。
+"""
+import time
+from starlette.routing import Match
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from app.core.metrics import HTTP_REQUEST_DURATION
+
+
+class MetricsMiddleware:
+    """記錄各路由的請求延遲"""
+    
+    def __init__(self, app: ASGIApp):
+        self.app = app
+    
+    @staticmethod
+    def _get_route(scope: Scope) -> str:
+        """取得請求對應的路由樣板（無對應路由時為 unmatched）"""
+        for route in scope["app"].router.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route.path
+        return "unmatched"
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        started = time.perf_counter()
+        recorded = False
+        
+        def record(status: int):
+            nonlocal recorded
+            if not recorded:
+                recorded = True
+                HTTP_REQUEST_DURATION.observe(
+                    time.perf_counter() - started,
+                    (scope["method"], self._get_route(scope), str(status))
+                )
+        
+        async def send_wrapper(message: Message):
+            if message["type"] == "http.response.start":
+                record(message["status"])
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception:
+            record(500)
+            raise
@@ -2,24 +2,117 @@
 速率限制中間件
 """
 from fastapi import Request, HTTPException
-from app.core.redis import get_redis_client
-from typing import Optional
+from app.core.metrics import instrument_redis
+from app.core.scripts import run_script
+from collections import OrderedDict
+from typing import Optional, Tuple
+import math
+import os
 import time
+import uuid
 
 
+class LocalTokenBucket:
+    """行程內的每 IP token bucket（有上限的 LRU），在呼叫 Redis 前先擋下明顯濫用的客戶端"""
+    
+    def __init__(self, capacity: float, refill_per_second: float, max_entries: int = 100000):
+        """
+        初始化本地 token bucket
+        
+        Args:
+            capacity: 每個 key 最多累積的 token 數（突發上限）
+            refill_per_second: 每秒補充的 token 數
+            max_entries: 最多追蹤的 key 數（超過時淘汰最久未使用者）
+        """
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.max_entries = max_entries
+        self._buckets: "OrderedDict[str, list]" = OrderedDict()
+    
+    def _get_bucket(self, key: str, now: float) -> list:
+        """取得並補充 key 的 bucket：[tokens, 上次補充時間, 封鎖至]"""
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = [self.capacity, now, 0.0]
+            self._buckets[key] = bucket
+            if len(self._buckets) > self.max_entries:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(self.capacity, bucket[0] + (now - bucket[1]) * self.refill_per_second)
+            bucket[1] = now
+        return bucket
+    
+    def consume(self, key: str) -> Tuple[bool, float]:
+        """
+        嘗試消耗一個 token
+        
+        Returns:
+            Tuple[bool, float]: (是否允許, 需等待秒數)
+        """
+        now = time.monotonic()
+        bucket = self._get_bucket(key, now)
+        
+        if bucket[2] > now:
+            return False, bucket[2] - now
+        
+        if bucket[0] < 1:
+            if self.refill_per_second <= 0:
+                return False, 1.0
+            return False, (1 - bucket[0]) / self.refill_per_second
+        
+        bucket[0] -= 1
+        return True, 0.0
+    
+    def block(self, key: str, seconds: float):
+        """在本地封鎖 key 一段時間（Redis 已判定超過限制時使用）"""
+        now = time.monotonic()
+        bucket = self._get_bucket(key, now)
+        bucket[2] = max(bucket[2], now + seconds)
+    
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+@instrument_redis("RateLimiter")
 class RateLimiter:
     """速率限制器"""
     
-    def __init__(self, max_requests: int = 10, window_seconds: int = 60):
+    ALGORITHM_SCRIPTS = {
+        "sliding_window": "rate_limit_sliding_window",
+        "fixed_window": "rate_limit_fixed_window",
+        "gcra": "rate_limit_gcra"
+    }
+    
+    def __init__(
+        self,
+        max_requests: int = 10,
+        window_seconds: int = 60,
+        algorithm: str = "sliding_window",
+        local_bucket: Optional[LocalTokenBucket] = None
+    ):
         """
         初始化速率限制器
         
         Args:
             max_requests: 時間窗口內最大請求數
             window_seconds: 時間窗口（秒）
+            algorithm: 演算法：sliding_window（精確，每個請求一筆記錄）、
+                fixed_window 或 gcra（每個 key 固定 O(1) 記憶體）
+            local_bucket: 本地預先過濾的 token bucket（None 表示每個請求都查詢 Redis）
         """
+        if algorithm not in self.ALGORITHM_SCRIPTS:
+            raise ValueError(f"不支援的速率限制演算法: {algorithm}")
+        
         self.max_requests = max_requests
         self.window_seconds = window_seconds
+        self.algorithm = algorithm
+        self.local_bucket = local_bucket
+        self.stats = {
+            "local_rejected": 0,
+            "remote_allowed": 0,
+            "remote_rejected": 0
+        }
     
     def _get_client_ip(self, request: Request) -> str:
         """取得客戶端 IP"""
@@ -38,7 +131,32 @@ class RateLimiter:
     
     def _get_rate_limit_key(self, ip: str, endpoint: str) -> str:
         """取得速率限制 Redis key"""
-        return f"rate_limit:{ip}:{endpoint}"
+        if self.algorithm == "sliding_window":
+            return f"rate_limit:{ip}:{endpoint}"
+        return f"rate_limit:{ip}:{endpoint}:{self.algorithm}"
+    
+    async def hit(self, client_ip: str, endpoint: str = "default") -> Tuple[bool, int, int]:
+        """
+        檢查並記錄一次請求（單一 EVALSHA，一次往返）
+        
+        Args:
+            client_ip: 客戶端 IP
+            endpoint: 端點名稱（用於區分不同端點的速率限制）
+            
+        Returns:
+            Tuple[bool, int, int]: (是否允許, 剩餘次數, 需等待毫秒數)
+        """
+        rate_limit_key = self._get_rate_limit_key(client_ip, endpoint)
+        args = [self.window_seconds * 1000, self.max_requests]
+        if self.algorithm == "sliding_window":
+            args.append(uuid.uuid4().hex)
+        
+        allowed, remaining, retry_after_ms = await run_script(
+            self.ALGORITHM_SCRIPTS[self.algorithm],
+            keys=[rate_limit_key],
+            args=args
+        )
+        return bool(allowed), int(remaining), int(retry_after_ms)
     
     async def check_rate_limit(self, request: Request, endpoint: str = "default") -> bool:
         """
@@ -55,30 +173,68 @@ class RateLimiter:
             HTTPException: 超過速率限制時拋出 429 錯誤
         """
         client_ip = self._get_client_ip(request)
-        redis_client = get_redis_client()
-        rate_limit_key = self._get_rate_limit_key(client_ip, endpoint)
-        
-        current_time = int(time.time())
-        window_start = current_time - self.window_seconds
+        local_key = f"{client_ip}:{endpoint}"
         
-        redis_client.zremrangebyscore(rate_limit_key, 0, window_start)
-        current_count = redis_client.zcard(rate_limit_key)
+        if self.local_bucket is not None:
+            allowed, retry_after_seconds = self.local_bucket.consume(local_key)
+            if not allowed:
+                self.stats["local_rejected"] += 1
+                self._raise_rate_limited(math.ceil(retry_after_seconds * 1000), 0)
         
-        if current_count >= self.max_requests:
-            raise HTTPException(
-                status_code=429,
-                detail={
-                    "error": "RATE_LIMIT_EXCEEDED",
-                    "message": f"請求過於頻繁，請在 {self.window_seconds} 秒後再試",
-                    "retry_after": self.window_seconds
-                }
-            )
+        allowed, remaining, retry_after_ms = await self.hit(client_ip, endpoint)
         
-        redis_client.zadd(rate_limit_key, {str(current_time): current_time})
-        redis_client.expire(rate_limit_key, self.window_seconds)
+        if not allowed:
+            self.stats["remote_rejected"] += 1
+            if self.local_bucket is not None:
+                self.local_bucket.block(local_key, retry_after_ms / 1000)
+            self._raise_rate_limited(retry_after_ms, remaining)
         
+        self.stats["remote_allowed"] += 1
         return True
+    
+    def _raise_rate_limited(self, retry_after_ms: int, remaining: int):
+        """拋出 429 錯誤"""
+        retry_after = max(1, math.ceil(retry_after_ms / 1000))
+        raise HTTPException(
+            status_code=429,
+            detail={
+                "error": "RATE_LIMIT_EXCEEDED",
+                "message": f"請求過於頻繁，請在 {retry_after} 秒後再試",
+                "retry_after": retry_after,
+                "remaining": remaining
+            },
+            headers={"Retry-After": str(retry_after)}
+        )
+
+
+RATE_LIMIT_ALGORITHM = os.getenv("RATE_LIMIT_ALGORITHM", "sliding_window")
+
+RATE_LIMIT_LOCAL_MAX_IPS = int(os.getenv("RATE_LIMIT_LOCAL_MAX_IPS", "100000"))
+
+
+def create_local_bucket(max_requests: int, window_seconds: int) -> LocalTokenBucket:
+    """
+    建立本地 token bucket
+    
+    預設容量與補充速率等於共用的 Redis 限制，本地層只擋下單一行程內就已超量的客戶端；
+    可由 RATE_LIMIT_LOCAL_BURST / RATE_LIMIT_LOCAL_REFILL_PER_SECOND 調整。
+    """
+    return LocalTokenBucket(
+        capacity=float(os.getenv("RATE_LIMIT_LOCAL_BURST", max_requests)),
+        refill_per_second=float(os.getenv("RATE_LIMIT_LOCAL_REFILL_PER_SECOND", max_requests / window_seconds)),
+        max_entries=RATE_LIMIT_LOCAL_MAX_IPS
+    )
 
 
-default_rate_limiter = RateLimiter(max_requests=10, window_seconds=60)
-queue_rate_limiter = RateLimiter(max_requests=20, window_seconds=60)
+default_rate_limiter = RateLimiter(
+    max_requests=10,
+    window_seconds=60,
+    algorithm=RATE_LIMIT_ALGORITHM,
+    local_bucket=create_local_bucket(10, 60)
+)
+queue_rate_limiter = RateLimiter(
+    max_requests=20,
+    window_seconds=60,
+    algorithm=RATE_LIMIT_ALGORITHM,
+    local_bucket=create_local_bucket(20, 60)
+)
@@ -30,3 +30,12 @@ class Product(BaseModel):
 class ProductListResponse(BaseModel):
     """商品列表回應"""
     products: list[Product]
+
+
+class ProductUpsertRequest(BaseModel):
+    """新增或更新商品請求"""
+    name: str = Field(..., description="商品名稱")
+    image_url: str = Field(..., description="商品圖片 URL")
+    price: int = Field(..., ge=0, description="價格（分）")
+    total_stock: int = Field(..., ge=0, description="總庫存")
+    reset_stock: bool = Field(True, description="是否將剩餘庫存重設為總庫存")
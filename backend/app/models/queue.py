@@ -13,7 +13,7 @@ class QueueStatus(BaseModel):
     total_in_waiting: int = Field(..., description="排隊區總人數")
     total_in_active: int = Field(..., description="搖滾區總人數（最多 100 人）")
     estimated_wait_time: int = Field(..., description="預估等待時間（秒）")
-    status: str = Field(..., description="狀態：waiting, active, ready_to_purchase, purchased, expired")
+    status: str = Field(..., description="狀態：waiting, active, ready_to_purchase, purchased, expired, sold_out")
     product_id: str = Field(..., description="商品 ID")
     
     class Config:
@@ -13,7 +13,7 @@ class Session(BaseModel):
     verified_at: Optional[int] = Field(None, description="驗證時間戳（毫秒）")
     queue_position_waiting: Optional[int] = Field(None, description="在排隊區的位置")
     queue_position_active: Optional[int] = Field(-1, description="在搖滾區的位置（-1 表示不在搖滾區）")
-    queue_status: str = Field("waiting", description="佇列狀態：waiting, active, ready_to_purchase, purchased, expired")
+    queue_status: str = Field("waiting", description="佇列狀態：waiting, active, ready_to_purchase, purchased, expired, sold_out")
     product_id: Optional[str] = Field(None, description="加入的商品 ID")
     purchase_ready_at: Optional[int] = Field(None, description="可以購買的時間戳（毫秒）")
     purchase_timeout_at: Optional[int] = Field(None, description="購買時限過期時間戳（毫秒）")
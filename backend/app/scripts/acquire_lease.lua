@@ -0,0 +1,19 @@
+-- 取得或續約租約 Lua 腳本（原子操作）
+-- 租約不存在時取得，已由自己持有時續約，否則失敗
+local lease_key = KEYS[1]
+local owner_id = ARGV[1]
+local ttl_ms = tonumber(ARGV[2])
+
+local current_owner = redis.call('GET', lease_key)
+
+if not current_owner then
+    redis.call('SET', lease_key, owner_id, 'PX', ttl_ms)
+    return 1
+end
+
+if current_owner == owner_id then
+    redis.call('PEXPIRE', lease_key, ttl_ms)
+    return 2
+end
+
+return 0
@@ -0,0 +1,52 @@
+-- 庫存分片購買資格預先檢查 Lua 腳本（原子操作）
+-- 檢查順序與 purchase.lua 相同；有符合資格的購買時登記一筆進行中的預留，
+-- 在預留結算前，分片加總即使暫時為 0 也不會被其他購買判定為售完
+-- KEYS: 固定 4 個 key 之後，每個會話依序接上會話 key
+-- ARGV: 固定 2 個參數之後，每個會話依序接上會話 ID
+-- 回傳與會話對應的錯誤代碼列表（符合資格為 false）
+local active_key = KEYS[1]
+local deadline_key = KEYS[2]
+local purchases_key = KEYS[3]
+local reservations_key = KEYS[4]
+local current_timestamp = tonumber(ARGV[1])
+local reservation_ttl = tonumber(ARGV[2])
+
+local function check_one(session_key, session_id)
+    if redis.call('EXISTS', session_key) == 0 then
+        return 'SESSION_NOT_FOUND'
+    end
+
+    if redis.call('SISMEMBER', purchases_key, session_id) == 1 then
+        return 'ALREADY_PURCHASED'
+    end
+
+    if not redis.call('ZSCORE', active_key, session_id) then
+        return 'NOT_IN_ACTIVE_QUEUE'
+    end
+
+    local deadline = redis.call('ZSCORE', deadline_key, session_id)
+    if deadline and tonumber(deadline) <= current_timestamp then
+        return 'NOT_IN_ACTIVE_QUEUE'
+    end
+
+    return false
+end
+
+local errors = {}
+local eligible = false
+for i = 5, #KEYS do
+    local code = check_one(KEYS[i], ARGV[i - 2])
+    if not code then
+        eligible = true
+    end
+    table.insert(errors, code)
+end
+
+-- 預留紀錄設有 TTL，行程在結算前中止時不會永久阻擋售完判定
+if eligible then
+    redis.call('HINCRBY', reservations_key, 'pending', 1)
+    redis.call('HINCRBY', reservations_key, 'seq', 1)
+    redis.call('EXPIRE', reservations_key, reservation_ttl)
+end
+
+return errors
@@ -0,0 +1,35 @@
+-- 排隊區壓縮 Lua 腳本（原子操作）
+-- 移除排隊區前段會話已不存在（過期或放棄）的號碼，並將 head 推進到第一個有效號碼，
+-- 讓 號碼 - head 的位置推算不被已放棄的號碼墊高
+local waiting_key = KEYS[1]
+local head_key = KEYS[2]
+local ticket_key = KEYS[3]
+local session_prefix = ARGV[1]
+local limit = tonumber(ARGV[2])
+
+local removed = 0
+local front = redis.call('ZRANGE', waiting_key, 0, limit - 1)
+
+for _, session_id in ipairs(front) do
+    if redis.call('EXISTS', session_prefix .. session_id) == 1 then
+        break
+    end
+    redis.call('ZREM', waiting_key, session_id)
+    removed = removed + 1
+end
+
+local head = tonumber(redis.call('GET', head_key) or '0')
+local first = redis.call('ZRANGE', waiting_key, 0, 0, 'WITHSCORES')
+local new_head = head
+
+if #first > 0 then
+    new_head = tonumber(first[2])
+else
+    new_head = tonumber(redis.call('GET', ticket_key) or '0')
+end
+
+if new_head > head then
+    redis.call('SET', head_key, new_head)
+end
+
+return {removed, math.max(new_head, head)}
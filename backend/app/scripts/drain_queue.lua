@@ -0,0 +1,43 @@
+-- 售完後清空佇列 Lua 腳本（原子操作，每次只處理一批）
+-- 以 ZPOPMIN 從排隊區取出、再從搖滾區前段移除最多 limit 位使用者，會話標記為 sold_out
+-- 並縮短 TTL；每次呼叫的成本有上限，由佇列管理任務分多個週期呼叫直到清空，不會長時間阻塞 Redis。
+-- 回傳 {本次移除人數, 剩餘人數}
+local waiting_key = KEYS[1]
+local active_key = KEYS[2]
+local deadline_key = KEYS[3]
+local limit = tonumber(ARGV[1])
+local session_prefix = ARGV[2]
+local lock_prefix = ARGV[3]
+local session_ttl = tonumber(ARGV[4])
+
+local function mark_sold_out(session_id)
+    local session_key = session_prefix .. session_id
+    if redis.call('EXISTS', session_key) == 1 then
+        redis.call('HSET', session_key,
+            'queue_position_waiting', '',
+            'queue_position_active', '',
+            'queue_status', 'sold_out')
+        redis.call('EXPIRE', session_key, session_ttl)
+    end
+end
+
+local drained = 0
+
+local popped = redis.call('ZPOPMIN', waiting_key, limit)
+for i = 1, #popped, 2 do
+    mark_sold_out(popped[i])
+    drained = drained + 1
+end
+
+if drained < limit then
+    local active = redis.call('ZRANGE', active_key, 0, limit - drained - 1)
+    for _, session_id in ipairs(active) do
+        redis.call('ZREM', active_key, session_id)
+        redis.call('ZREM', deadline_key, session_id)
+        redis.call('DEL', lock_prefix .. session_id)
+        mark_sold_out(session_id)
+        drained = drained + 1
+    end
+end
+
+return {drained, redis.call('ZCARD', waiting_key) + redis.call('ZCARD', active_key)}
@@ -0,0 +1,18 @@
+-- 以既有會話加入排隊區 Lua 腳本（原子操作）
+-- 已在排隊區時沿用原號碼，否則發放新的排隊號碼；回傳 {排隊號碼, 排隊位置}
+local waiting_key = KEYS[1]
+local ticket_key = KEYS[2]
+local head_key = KEYS[3]
+local session_id = ARGV[1]
+
+local ticket = redis.call('ZSCORE', waiting_key, session_id)
+if ticket then
+    ticket = tonumber(ticket)
+    local head = tonumber(redis.call('GET', head_key) or '0')
+    return {ticket, ticket - head}
+end
+
+ticket = redis.call('INCR', ticket_key) - 1
+redis.call('ZADD', waiting_key, ticket, session_id)
+
+return {ticket, redis.call('ZCARD', waiting_key) - 1}
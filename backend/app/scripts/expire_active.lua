@@ -0,0 +1,29 @@
+-- 搖滾區逾時移除 Lua 腳本（原子操作）
+-- 以購買期限索引（ZRANGEBYSCORE 到目前時間）找出逾時的使用者，一次移出搖滾區、
+-- 刪除購買鎖並將會話標記為 expired，成本與逾時人數成正比而非搖滾區大小；
+-- 回傳 {逾時的會話 ID, 下一個購買期限（無則為 nil）}，供佇列管理任務排定下次喚醒
+local active_key = KEYS[1]
+local deadline_key = KEYS[2]
+local current_timestamp = ARGV[1]
+local limit = tonumber(ARGV[2])
+local session_prefix = ARGV[3]
+local lock_prefix = ARGV[4]
+
+local expired = redis.call('ZRANGEBYSCORE', deadline_key, '-inf', current_timestamp, 'LIMIT', 0, limit)
+
+for _, session_id in ipairs(expired) do
+    redis.call('ZREM', active_key, session_id)
+    redis.call('ZREM', deadline_key, session_id)
+    redis.call('DEL', lock_prefix .. session_id)
+
+    local session_key = session_prefix .. session_id
+    if redis.call('EXISTS', session_key) == 1 then
+        redis.call('HSET', session_key,
+            'queue_position_active', '',
+            'queue_status', 'expired')
+    end
+end
+
+local next_deadline = redis.call('ZRANGE', deadline_key, 0, 0, 'WITHSCORES')
+
+return {expired, next_deadline[2] or false}
@@ -0,0 +1,32 @@
+-- 加入排隊區 Lua 腳本（原子操作）
+-- 建立會話、設定 TTL、發放排隊號碼並加入排隊區，回傳排隊位置
+local session_key = KEYS[1]
+local waiting_key = KEYS[2]
+local ticket_key = KEYS[3]
+local session_id = ARGV[1]
+local product_id = ARGV[2]
+local current_timestamp = ARGV[3]
+local session_ttl = tonumber(ARGV[4])
+local turnstile_verified = ARGV[5]
+
+local verified_at = ''
+if turnstile_verified == 'true' then
+    verified_at = current_timestamp
+end
+
+-- 單調遞增的排隊號碼（0 起算）作為分數，同一毫秒加入的使用者也維持先後順序
+local ticket = redis.call('INCR', ticket_key) - 1
+redis.call('ZADD', waiting_key, ticket, session_id)
+-- 新號碼位於隊尾，前面的人數即排隊區人數 - 1
+local position = redis.call('ZCARD', waiting_key) - 1
+
+redis.call('HSET', session_key,
+    'turnstile_verified', turnstile_verified,
+    'verified_at', verified_at,
+    'product_id', product_id,
+    'queue_ticket', ticket,
+    'queue_position_waiting', position,
+    'queue_status', 'waiting')
+redis.call('EXPIRE', session_key, session_ttl)
+
+return position
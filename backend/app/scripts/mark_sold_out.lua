@@ -0,0 +1,21 @@
+-- 庫存分片時設定售完旗標 Lua 腳本（原子操作）
+-- 呼叫端在結算預留（取得預留序號）之後讀取分片加總為 0；只有此時仍沒有進行中的預留、
+-- 且預留序號未變（讀取期間沒有新的預留）才設定旗標並發布售完通知，
+-- 避免分片加總因預留尚未結算而暫時為 0 時誤設
+-- 回傳是否為首次設定（1/0）
+local sold_out_key = KEYS[1]
+local reservations_key = KEYS[2]
+local seq = ARGV[1]
+local sold_out_channel = ARGV[2]
+local product_id = ARGV[3]
+
+local reservations = redis.call('HMGET', reservations_key, 'pending', 'seq')
+if tonumber(reservations[1] or '0') > 0 or (reservations[2] or '0') ~= seq then
+    return 0
+end
+
+if not redis.call('SET', sold_out_key, 1, 'NX') then
+    return 0
+end
+redis.call('PUBLISH', sold_out_channel, product_id)
+return 1
@@ -0,0 +1,56 @@
+-- 排隊區移入搖滾區 Lua 腳本（原子操作）
+-- 以 ZPOPMIN 取出排隊號碼最小的使用者，並確保搖滾區人數不超過上限
+local waiting_key = KEYS[1]
+local active_key = KEYS[2]
+local head_key = KEYS[3]
+local deadline_key = KEYS[4]
+local max_active = tonumber(ARGV[1])
+local requested = tonumber(ARGV[2])
+local current_timestamp = tonumber(ARGV[3])
+local session_prefix = ARGV[4]
+local purchase_timeout = tonumber(ARGV[5])
+
+local available = max_active - redis.call('ZCARD', active_key)
+if requested >= 0 and requested < available then
+    available = requested
+end
+
+if available <= 0 then
+    return {}
+end
+
+local popped = redis.call('ZPOPMIN', waiting_key, available)
+local moved = {}
+local last_ticket = -1
+
+-- 同批次依序遞增 1 毫秒，保持排隊區的先後順序
+for i = 1, #popped, 2 do
+    local session_id = popped[i]
+    redis.call('ZADD', active_key, current_timestamp + #moved, session_id)
+    -- 購買期限索引：供逾時移除以 ZRANGEBYSCORE 只取出到期的使用者
+    redis.call('ZADD', deadline_key, current_timestamp + #moved + purchase_timeout, session_id)
+    table.insert(moved, session_id)
+    last_ticket = tonumber(popped[i + 1])
+end
+
+-- 已服務到的號碼（head）：號碼小於 head 的使用者都已離開排隊區，位置 = 號碼 - head
+if last_ticket >= 0 then
+    local head = tonumber(redis.call('GET', head_key) or '0')
+    if last_ticket + 1 > head then
+        redis.call('SET', head_key, last_ticket + 1)
+    end
+end
+
+for _, session_id in ipairs(moved) do
+    local session_key = session_prefix .. session_id
+    if redis.call('EXISTS', session_key) == 1 then
+        local position = redis.call('ZRANK', active_key, session_id)
+        redis.call('HSET', session_key,
+            'queue_position_active', position,
+            'queue_position_waiting', '',
+            'queue_status', 'active',
+            'purchase_timeout_at', redis.call('ZSCORE', deadline_key, session_id))
+    end
+end
+
+return moved
@@ -0,0 +1,137 @@
+-- 購買 Lua 腳本（原子操作，可一次處理同一商品的多筆購買）
+-- 依抵達順序逐筆完成搖滾區資格檢查、每人限購一次、庫存扣減、移出搖滾區與會話標記為 purchased，
+-- 最後由排隊區遞補空出的名額；單筆購買只需一次 Redis 往返，批次購買則讓多筆共用一次往返，
+-- 並行購買之間沒有競態空窗。
+-- KEYS: 固定 7 個 key 之後，每筆購買依序接上 {會話 key, 購買鎖 key}
+-- ARGV: 固定 8 個參數之後，每筆購買依序接上 {會話 ID, 數量}
+-- 庫存分片時由呼叫端先從各分片預留庫存，以 ARGV[7] 傳入預留件數（商品不存在為 -1），
+-- 腳本改從預留件數分配而不讀寫庫存 key；不分片時 ARGV[7] 為空字串
+-- 不分片時庫存歸零即設定售完旗標並發布售完通知，與扣減在同一個原子操作內完成
+-- 回傳 {每筆結果, 遞補的會話 ID, 剩餘庫存（分片時為未用完的預留件數）}；
+-- 每筆結果成功為 {'ok', 剩餘庫存}，失敗為 {'err', 錯誤代碼, 目前庫存}
+local active_key = KEYS[1]
+local deadline_key = KEYS[2]
+local stock_key = KEYS[3]
+local purchases_key = KEYS[4]
+local waiting_key = KEYS[5]
+local head_key = KEYS[6]
+local sold_out_key = KEYS[7]
+local current_timestamp = tonumber(ARGV[1])
+local max_active = tonumber(ARGV[2])
+local session_prefix = ARGV[3]
+local purchase_timeout = tonumber(ARGV[4])
+local wakeup_channel = ARGV[5]
+local product_id = ARGV[6]
+local reserved = ARGV[7]
+local sold_out_channel = ARGV[8]
+
+local current_stock
+if reserved == '' then
+    current_stock = redis.call('GET', stock_key)
+    if current_stock then
+        current_stock = tonumber(current_stock)
+    end
+elseif tonumber(reserved) >= 0 then
+    current_stock = tonumber(reserved)
+end
+
+local function purchase_one(session_key, lock_key, session_id, quantity)
+    if redis.call('EXISTS', session_key) == 0 then
+        return {'err', 'SESSION_NOT_FOUND', false}
+    end
+
+    if redis.call('SISMEMBER', purchases_key, session_id) == 1 then
+        return {'err', 'ALREADY_PURCHASED', false}
+    end
+
+    if not redis.call('ZSCORE', active_key, session_id) then
+        return {'err', 'NOT_IN_ACTIVE_QUEUE', false}
+    end
+
+    -- 購買期限已過但佇列管理任務尚未移除時同樣視為不在搖滾區
+    local deadline = redis.call('ZSCORE', deadline_key, session_id)
+    if deadline and tonumber(deadline) <= current_timestamp then
+        return {'err', 'NOT_IN_ACTIVE_QUEUE', false}
+    end
+
+    if not current_stock then
+        return {'err', 'PRODUCT_NOT_FOUND', false}
+    end
+
+    if current_stock < quantity then
+        return {'err', 'INSUFFICIENT_STOCK', current_stock}
+    end
+
+    current_stock = current_stock - quantity
+    redis.call('SADD', purchases_key, session_id)
+    redis.call('ZREM', active_key, session_id)
+    redis.call('ZREM', deadline_key, session_id)
+    redis.call('DEL', lock_key)
+    redis.call('HSET', session_key,
+        'queue_position_active', '',
+        'queue_status', 'purchased')
+    return {'ok', current_stock}
+end
+
+local results = {}
+local purchased = 0
+for i = 1, (#KEYS - 7) / 2 do
+    local result = purchase_one(KEYS[6 + 2 * i], KEYS[7 + 2 * i], ARGV[7 + 2 * i], tonumber(ARGV[8 + 2 * i]))
+    if result[1] == 'ok' then
+        purchased = purchased + 1
+    end
+    table.insert(results, result)
+end
+
+local sold_out = reserved == '' and current_stock == 0
+if sold_out and redis.call('SET', sold_out_key, 1, 'NX') then
+    redis.call('PUBLISH', sold_out_channel, product_id)
+end
+
+if purchased == 0 then
+    return {results, {}, current_stock or false}
+end
+
+-- 整批只寫一次庫存
+if reserved == '' then
+    redis.call('SET', stock_key, current_stock)
+end
+
+-- 遞補：與 promote.lua 相同，依排隊號碼由小到大移入搖滾區並記錄購買期限（售完時不再遞補）
+local moved = {}
+local available = max_active - redis.call('ZCARD', active_key)
+if available > 0 and not sold_out then
+    local popped = redis.call('ZPOPMIN', waiting_key, available)
+    local last_ticket = -1
+
+    for i = 1, #popped, 2 do
+        local promoted_id = popped[i]
+        redis.call('ZADD', active_key, current_timestamp + #moved, promoted_id)
+        redis.call('ZADD', deadline_key, current_timestamp + #moved + purchase_timeout, promoted_id)
+        table.insert(moved, promoted_id)
+        last_ticket = tonumber(popped[i + 1])
+    end
+
+    if last_ticket >= 0 then
+        local head = tonumber(redis.call('GET', head_key) or '0')
+        if last_ticket + 1 > head then
+            redis.call('SET', head_key, last_ticket + 1)
+        end
+    end
+
+    for _, promoted_id in ipairs(moved) do
+        local promoted_key = session_prefix .. promoted_id
+        if redis.call('EXISTS', promoted_key) == 1 then
+            redis.call('HSET', promoted_key,
+                'queue_position_active', redis.call('ZRANK', active_key, promoted_id),
+                'queue_position_waiting', '',
+                'queue_status', 'active',
+                'purchase_timeout_at', redis.call('ZSCORE', deadline_key, promoted_id))
+        end
+    end
+end
+
+-- 喚醒佇列管理任務廣播新的佇列狀態（在腳本內發布，不增加購買流程的往返）
+redis.call('PUBLISH', wakeup_channel, product_id)
+
+return {results, moved, current_stock}
@@ -0,0 +1,21 @@
+-- 固定視窗速率限制 Lua 腳本（原子操作，每個 key 只佔一個計數器）
+-- 回傳 {是否允許, 剩餘次數, 需等待毫秒數}
+local key = KEYS[1]
+local window_ms = tonumber(ARGV[1])
+local max_requests = tonumber(ARGV[2])
+
+local current_count = redis.call('INCR', key)
+if current_count == 1 then
+    redis.call('PEXPIRE', key, window_ms)
+end
+
+if current_count > max_requests then
+    local ttl = redis.call('PTTL', key)
+    if ttl < 0 then
+        redis.call('PEXPIRE', key, window_ms)
+        ttl = window_ms
+    end
+    return {0, 0, math.max(ttl, 1)}
+end
+
+return {1, max_requests - current_count, 0}
@@ -0,0 +1,28 @@
+-- GCRA 速率限制 Lua 腳本（原子操作，每個 key 只保存理論到達時間）
+-- 平均每 window_ms / max_requests 毫秒允許一次請求，最多累積 max_requests 次突發
+-- 回傳 {是否允許, 剩餘次數, 需等待毫秒數}
+local key = KEYS[1]
+local window_ms = tonumber(ARGV[1])
+local max_requests = tonumber(ARGV[2])
+
+local server_time = redis.call('TIME')
+local now = tonumber(server_time[1]) * 1000 + math.floor(tonumber(server_time[2]) / 1000)
+
+local emission_interval = window_ms / max_requests
+local burst_tolerance = emission_interval * max_requests
+
+local tat = tonumber(redis.call('GET', key) or now)
+if tat < now then
+    tat = now
+end
+
+local new_tat = tat + emission_interval
+local allow_at = new_tat - burst_tolerance
+
+if now < allow_at then
+    return {0, 0, math.ceil(allow_at - now)}
+end
+
+redis.call('SET', key, math.floor(new_tat), 'PX', math.max(math.ceil(new_tat - now), 1))
+
+return {1, math.floor((now - allow_at) / emission_interval), 0}
@@ -0,0 +1,27 @@
+-- 滑動視窗速率限制 Lua 腳本（原子操作）
+-- 以 Redis 伺服器時間（毫秒）為分數，每個請求使用唯一 member
+-- 回傳 {是否允許, 剩餘次數, 需等待毫秒數}
+local key = KEYS[1]
+local window_ms = tonumber(ARGV[1])
+local max_requests = tonumber(ARGV[2])
+local member = ARGV[3]
+
+local server_time = redis.call('TIME')
+local now = tonumber(server_time[1]) * 1000 + math.floor(tonumber(server_time[2]) / 1000)
+
+redis.call('ZREMRANGEBYSCORE', key, 0, now - window_ms)
+local current_count = redis.call('ZCARD', key)
+
+if current_count >= max_requests then
+    local oldest = redis.call('ZRANGE', key, 0, 0, 'WITHSCORES')
+    local retry_after = window_ms
+    if oldest[2] then
+        retry_after = tonumber(oldest[2]) + window_ms - now
+    end
+    return {0, 0, math.max(retry_after, 1)}
+end
+
+redis.call('ZADD', key, now, member)
+redis.call('PEXPIRE', key, window_ms)
+
+return {1, max_requests - current_count - 1, 0}
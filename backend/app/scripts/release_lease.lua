@@ -0,0 +1,10 @@
+-- 釋放租約 Lua 腳本（原子操作）
+-- 僅在租約仍由自己持有時刪除
+local lease_key = KEYS[1]
+local owner_id = ARGV[1]
+
+if redis.call('GET', lease_key) == owner_id then
+    return redis.call('DEL', lease_key)
+end
+
+return 0
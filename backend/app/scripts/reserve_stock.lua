@@ -0,0 +1,18 @@
+-- 庫存分片預留 Lua 腳本（原子操作）
+-- 從單一庫存分片取出最多 requested 件，分片不足時只取出剩餘的部分，庫存不會變成負數；
+-- 回傳 {取得件數, 分片剩餘庫存（分片不存在為 -1）}
+local shard_key = KEYS[1]
+local requested = tonumber(ARGV[1])
+
+local stock = redis.call('GET', shard_key)
+if not stock then
+    return {0, -1}
+end
+
+stock = tonumber(stock)
+local granted = math.min(stock, requested)
+if granted > 0 then
+    stock = redis.call('DECRBY', shard_key, granted)
+end
+
+return {granted, stock}
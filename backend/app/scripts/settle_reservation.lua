@@ -0,0 +1,14 @@
+-- 結算一筆進行中的庫存預留 Lua 腳本（原子操作）
+-- 預留的件數已成交或歸還分片後呼叫；進行中的預留數不會低於 0（預留紀錄過期後才結算時）
+-- 回傳 {結算後進行中的預留數, 預留序號}
+local reservations_key = KEYS[1]
+local reservation_ttl = tonumber(ARGV[1])
+
+local pending = redis.call('HINCRBY', reservations_key, 'pending', -1)
+if pending < 0 then
+    redis.call('HSET', reservations_key, 'pending', 0)
+    pending = 0
+end
+redis.call('EXPIRE', reservations_key, reservation_ttl)
+
+return {pending, tonumber(redis.call('HGET', reservations_key, 'seq') or '0')}
@@ -0,0 +1,43 @@
+-- 佇列吞吐率更新 Lua 腳本（原子操作）
+-- 由佇列管理任務每週期於晉升後呼叫，以指數加權移動平均（EWMA）追蹤每秒晉升數與搖滾區每秒離開數
+-- （購買完成或逾時），結果存成單一 hash，供預估等待時間以 O(1) 計算
+local rate_key = KEYS[1]
+local waiting_key = KEYS[2]
+local active_key = KEYS[3]
+local promoted = tonumber(ARGV[1])
+local current_timestamp = tonumber(ARGV[2])
+local window_seconds = tonumber(ARGV[3])
+
+local state = redis.call('HMGET', rate_key, 'promote_rate', 'exit_rate', 'active', 'updated_at')
+local promote_rate = tonumber(state[1]) or 0
+local exit_rate = tonumber(state[2]) or 0
+local previous_active = tonumber(state[3])
+local updated_at = tonumber(state[4])
+
+local active = redis.call('ZCARD', active_key)
+local waiting = redis.call('ZCARD', waiting_key)
+
+if previous_active and updated_at and current_timestamp > updated_at then
+    local elapsed = (current_timestamp - updated_at) / 1000
+    -- 依實際經過時間調整權重，週期不固定時仍維持相同的時間常數
+    local alpha = 1 - math.exp(-elapsed / window_seconds)
+    -- 晉升前的搖滾區人數與上週期結束時相比，減少的部分即為這段期間離開的人數
+    local exited = math.max(previous_active - (active - promoted), 0)
+
+    -- 沒有人排隊時晉升數為 0 只代表沒有需求，不更新晉升率以免閒置期間被拉低
+    if waiting > 0 or promoted > 0 then
+        promote_rate = promote_rate + alpha * (promoted / elapsed - promote_rate)
+    end
+    if previous_active > 0 or exited > 0 then
+        exit_rate = exit_rate + alpha * (exited / elapsed - exit_rate)
+    end
+end
+
+redis.call('HSET', rate_key,
+    'promote_rate', tostring(promote_rate),
+    'exit_rate', tostring(exit_rate),
+    'active', active,
+    'updated_at', current_timestamp)
+
+-- 浮點數回傳給 Redis 會被截斷為整數，因此以字串回傳
+return {tostring(promote_rate), tostring(exit_rate)}
@@ -1,113 +1,248 @@
 """
 庫存服務
+
+預設每個商品的庫存是單一計數器，與該商品的佇列同一個 slot，購買腳本可一併扣減。
+設定 INVENTORY_SHARDS > 1 時改為分片計數器：各分片以不同的 hash tag 分散到不同 Cluster slot，
+購買先依會話 ID 雜湊選定分片預留庫存（一次往返），分片不足時以一個 pipeline 讀取其他分片，
+再以一個 pipeline 依讀到的庫存向各分片取用（每輪兩次往返，不隨分片數增加）；
+每個分片的扣減都是原子且不會低於 0，因此分片數增加時不會超賣。
+變更分片數後需重設庫存（upsert_product 或 reset_stock）。
+
+分片只分散庫存計數器：資格檢查與購買腳本（限購、移出搖滾區、更新會話與遞補）仍在該商品佇列的
+slot 執行，每筆購買仍會存取該 slot 兩次（預先檢查與腳本），單一商品的購買吞吐量仍受該 slot 所在節點限制。
+分片適合庫存計數器本身是熱點的情境；瓶頸在佇列 slot 時應改用購買批次提交（PURCHASE_BATCH_ENABLED）。
+
+庫存歸零時設定售完旗標並以 pub/sub 通知所有副本（見 app.services.sold_out），
+重設庫存時一併清除。分片時加總為 0 可能只是其他購買的預留尚未結算，
+因此另以預留紀錄追蹤進行中的預留，沒有進行中的預留時才設定售完旗標。
 """
 import os
-from typing import Optional, Tuple
-from app.core.redis import get_redis_client
+import zlib
+from typing import Dict, List, Optional, Set, Tuple
+from app.core.metrics import instrument_redis
+from app.core.redis import get_async_redis_client, hash_tag
+from app.core.replicas import get_async_read_client
+from app.core.scripts import run_script, run_script_many
 
 
+@instrument_redis("InventoryService")
 class InventoryService:
     """庫存服務類別"""
     
+    SOLD_OUT_CHANNEL = "product:soldout"
+    RESERVATION_TTL_SECONDS = 60
+    
     @staticmethod
     def _get_stock_key(product_id: str) -> str:
-        """取得庫存 Redis key"""
-        return f"product:stock:{product_id}"
+        """取得庫存 Redis key（以商品 ID 為 hash tag，與該商品的佇列同一個 slot）"""
+        return f"product:stock:{hash_tag(product_id)}"
     
     @staticmethod
-    def _load_lua_script() -> str:
-        """載入庫存扣減 Lua 腳本"""
-        script_path = os.path.join(
-            os.path.dirname(__file__),
-            "..",
-            "scripts",
-            "decrement_stock.lua"
-        )
+    def _get_purchases_key(product_id: str) -> str:
+        """取得已購買會話集合 Redis key（與庫存同一個 slot）"""
+        return f"purchases:{InventoryService._get_stock_key(product_id)}"
+    
+    @staticmethod
+    def _get_sold_out_key(product_id: str) -> str:
+        """取得售完旗標 Redis key（與庫存同一個 slot，購買腳本可一併設定）"""
+        return f"product:soldout:{hash_tag(product_id)}"
+    
+    @staticmethod
+    def _get_reservations_key(product_id: str) -> str:
+        """取得庫存分片預留紀錄 Redis key（進行中的預留數與預留序號，與佇列同一個 slot）"""
+        return f"product:reservations:{hash_tag(product_id)}"
+    
+    @staticmethod
+    def get_stock_shards() -> int:
+        """取得每個商品的庫存分片數（1 表示不分片）"""
+        return max(1, int(os.getenv("INVENTORY_SHARDS", "1")))
+    
+    @staticmethod
+    def is_sharded() -> bool:
+        """庫存是否分片"""
+        return InventoryService.get_stock_shards() > 1
+    
+    @staticmethod
+    def _get_stock_shard_key(product_id: str, shard: int) -> str:
+        """取得庫存分片 Redis key（各分片使用不同的 hash tag，可落在不同的 Cluster slot）"""
+        return f"product:stock:{hash_tag(f'{product_id}:{shard}')}"
+    
+    @staticmethod
+    def _get_stock_keys(product_id: str) -> List[str]:
+        """取得商品所有庫存計數器的 key（不分片時只有一個）"""
+        if not InventoryService.is_sharded():
+            return [InventoryService._get_stock_key(product_id)]
+        return [
+            InventoryService._get_stock_shard_key(product_id, shard)
+            for shard in range(InventoryService.get_stock_shards())
+        ]
+    
+    @staticmethod
+    def get_stock_values(product_id: str, total_stock: int) -> Dict[str, int]:
+        """
+        將庫存平均分配到各計數器（餘數分給前面的分片）
         
-        try:
-            with open(script_path, "r", encoding="utf-8") as f:
-                return f.read()
-        except FileNotFoundError:
-            return """
-local product_key = KEYS[1]
-local quantity = tonumber(ARGV[1])
-local session_id = ARGV[2]
-
-local current_stock = redis.call('GET', product_key)
-if not current_stock then
-    return {'err', 'PRODUCT_NOT_FOUND', 0}
-end
-
-current_stock = tonumber(current_stock)
-
-if current_stock < quantity then
-    return {'err', 'INSUFFICIENT_STOCK', current_stock}
-end
-
-local new_stock = current_stock - quantity
-redis.call('SET', product_key, new_stock)
-
-redis.call('SADD', 'purchases:' .. product_key, session_id)
-
-return {'ok', true, new_stock}
-"""
+        Returns:
+            Dict[str, int]: 庫存 key 與對應的庫存
+        """
+        stock_keys = InventoryService._get_stock_keys(product_id)
+        base, extra = divmod(total_stock, len(stock_keys))
+        return {
+            key: base + (1 if index < extra else 0)
+            for index, key in enumerate(stock_keys)
+        }
+    
+    @staticmethod
+    def _pick_shard(session_id: str) -> int:
+        """依會話 ID 雜湊選定優先使用的庫存分片（各 worker 結果一致）"""
+        return zlib.crc32(session_id.encode()) % InventoryService.get_stock_shards()
     
     @staticmethod
-    def get_stock(product_id: str) -> int:
-        """查詢庫存"""
-        redis_client = get_redis_client()
-        stock_key = InventoryService._get_stock_key(product_id)
-        stock = redis_client.get(stock_key)
-        return int(stock) if stock else 0
+    async def get_stock(product_id: str, stale_ok: bool = False) -> int:
+        """查詢庫存（分片時以一個 pipeline 加總各分片；stale_ok 時可讀複本）"""
+        redis_client = get_async_read_client(stale_ok)
+        pipe = redis_client.pipeline(transaction=False)
+        for stock_key in InventoryService._get_stock_keys(product_id):
+            pipe.get(stock_key)
+        stocks = await pipe.execute()
+        return sum(int(stock or 0) for stock in stocks)
     
     @staticmethod
-    def decrement_stock(product_id: str, quantity: int, session_id: str) -> Tuple[bool, Optional[str], Optional[int]]:
+    async def reserve_stock(product_id: str, quantity: int, session_id: str) -> Optional[List[Tuple[int, int]]]:
         """
-        扣減庫存（使用 Lua 腳本確保原子性）
+        從庫存分片預留庫存：先取雜湊選定的分片，不足時依其他分片目前的庫存以一個 pipeline 向多個分片取用
+        
+        Args:
+            product_id: 商品 ID
+            quantity: 要預留的件數
+            session_id: 用於選定分片的會話 ID
         
         Returns:
-            Tuple[bool, Optional[str], Optional[int]]: (是否成功, 錯誤訊息, 剩餘庫存)
+            Optional[List[Tuple[int, int]]]: (分片, 取得件數) 列表，合計可能少於 quantity（庫存不足）；
+            商品不存在（所有分片都不存在）時為 None
         """
-        import logging
-        logger = logging.getLogger(__name__)
-        logger.info(f"使用者 {session_id} 嘗試購買商品 {product_id}，數量: {quantity}")
-        redis_client = get_redis_client()
-        stock_key = InventoryService._get_stock_key(product_id)
-        lua_script = InventoryService._load_lua_script()
+        shards = InventoryService.get_stock_shards()
+        first = InventoryService._pick_shard(session_id)
+        granted, shard_stock = await run_script(
+            "reserve_stock",
+            keys=[InventoryService._get_stock_shard_key(product_id, first)],
+            args=[quantity]
+        )
+        grants = [(first, granted)] if granted > 0 else []
+        remaining = quantity - granted
+        exists = shard_stock >= 0
         
-        try:
-            result = redis_client.eval(
-                lua_script,
-                1,
-                stock_key,
-                quantity,
-                session_id
-            )
+        # 只向讀到有庫存的分片取用讀到的件數，不多取而佔住其他購買可用的庫存；
+        # 讀取後被並行購買取走時取得件數較少，再以仍有庫存的分片重試（最多 shards 輪）
+        candidates = [(first + offset) % shards for offset in range(1, shards)]
+        for _ in range(shards):
+            if remaining <= 0 or not candidates:
+                break
             
-            if isinstance(result, list) and len(result) > 0:
-                first = result[0]
-                if isinstance(first, bytes):
-                    first = first.decode('utf-8')
-                
-                if first == "ok":
-                    if len(result) >= 3:
-                        remaining_stock = result[2] if isinstance(result[2], int) else int(result[2])
-                        return (True, None, remaining_stock)
-                    elif len(result) >= 2:
-                        remaining_stock = result[1] if isinstance(result[1], int) else int(result[1])
-                        return (True, None, remaining_stock)
-                elif first == "err":
-                    error_msg = result[1].decode('utf-8') if isinstance(result[1], bytes) else str(result[1])
-                    stock = result[2] if len(result) > 2 and result[2] is not None else None
-                    return (False, error_msg, stock)
-                elif first is True:
-                    if len(result) >= 2:
-                        remaining_stock = result[1] if isinstance(result[1], int) else int(result[1])
-                        return (True, None, remaining_stock)
+            redis_client = get_async_redis_client()
+            pipe = redis_client.pipeline(transaction=False)
+            for shard in candidates:
+                pipe.get(InventoryService._get_stock_shard_key(product_id, shard))
+            stocks = await pipe.execute()
+            exists = exists or any(stock is not None for stock in stocks)
             
-            logger.error(f"無法解析 Lua 腳本返回結果: {result}, 類型: {type(result)}")
-            return (False, "PARSE_ERROR", None)
+            plan = []
+            planned = remaining
+            for shard, stock in zip(candidates, stocks):
+                take = min(int(stock or 0), planned)
+                if take > 0:
+                    plan.append((shard, take))
+                    planned -= take
+            if not plan:
+                break
             
-        except Exception as e:
-            logger.error(f"執行 Lua 腳本時發生錯誤: {str(e)}", exc_info=True)
-            return (False, f"EXECUTION_ERROR: {str(e)}", None)
+            results = await run_script_many(
+                "reserve_stock",
+                [([InventoryService._get_stock_shard_key(product_id, shard)], [take]) for shard, take in plan]
+            )
+            for (shard, _), (granted, _) in zip(plan, results):
+                if granted > 0:
+                    grants.append((shard, granted))
+                    remaining -= granted
+            candidates = [shard for shard, stock in zip(candidates, stocks) if int(stock or 0) > 0]
+        
+        return grants if exists else None
+    
+    @staticmethod
+    async def release_stock(product_id: str, grants: List[Tuple[int, int]], amount: int):
+        """
+        將預留但未使用的庫存歸還分片（由最後取得的分片開始歸還，讓向其他分片取用的部分優先回到原分片）
+        
+        Args:
+            product_id: 商品 ID
+            grants: reserve_stock 回傳的 (分片, 取得件數) 列表
+            amount: 要歸還的件數
+        """
+        returns = []
+        for shard, granted in reversed(grants):
+            if amount <= 0:
+                break
+            returned = min(granted, amount)
+            returns.append((shard, returned))
+            amount -= returned
+        if not returns:
+            return
+        
+        redis_client = get_async_redis_client()
+        pipe = redis_client.pipeline(transaction=False)
+        for shard, returned in returns:
+            pipe.incrby(InventoryService._get_stock_shard_key(product_id, shard), returned)
+        await pipe.execute()
+    
+    @staticmethod
+    async def settle_reservation(product_id: str) -> Tuple[int, int]:
+        """
+        結算一筆進行中的預留（PurchaseService 預先檢查時登記，預留件數成交或歸還後呼叫）
+        
+        Returns:
+            Tuple[int, int]: (結算後進行中的預留數, 預留序號)
+        """
+        pending, seq = await run_script(
+            "settle_reservation",
+            keys=[InventoryService._get_reservations_key(product_id)],
+            args=[InventoryService.RESERVATION_TTL_SECONDS]
+        )
+        return int(pending), int(seq)
+    
+    @staticmethod
+    async def mark_sold_out(product_id: str, seq: int) -> bool:
+        """
+        庫存分片時設定售完旗標並通知所有副本（不分片時由購買腳本在扣減時原子地設定）
+        
+        呼叫端需先以 settle_reservation 取得沒有進行中預留時的預留序號，再確認分片加總為 0；
+        期間有新的預留或仍有進行中的預留時不設定。
+        
+        Args:
+            product_id: 商品 ID
+            seq: settle_reservation 回傳的預留序號
+        
+        Returns:
+            bool: 是否為首次設定
+        """
+        marked = await run_script(
+            "mark_sold_out",
+            keys=[
+                InventoryService._get_sold_out_key(product_id),
+                InventoryService._get_reservations_key(product_id)
+            ],
+            args=[seq, InventoryService.SOLD_OUT_CHANNEL, product_id]
+        )
+        return bool(marked)
+    
+    @staticmethod
+    async def get_sold_out(product_ids: List[str]) -> Set[str]:
+        """批次查詢已售完的商品（一次往返）"""
+        if not product_ids:
+            return set()
+        
+        redis_client = get_async_redis_client()
+        pipe = redis_client.pipeline(transaction=False)
+        for product_id in product_ids:
+            pipe.exists(InventoryService._get_sold_out_key(product_id))
+        flags = await pipe.execute()
+        return {product_id for product_id, flag in zip(product_ids, flags) if flag}
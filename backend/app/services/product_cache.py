@@ -0,0 +1,212 @@
+"""
+商品目錄快取
+
+每個行程各自快取商品的靜態欄位（名稱、價格、圖片），剩餘庫存則以極短 TTL
+快取；同時到期的重新整理會合併成一次 Redis 呼叫（single-flight）。
+reset_stock 或商品管理 API 更新時，ProductService 透過 pub/sub 通知所有副本清除快取。
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+from app.core.redis import get_async_pubsub_client
+from app.models.product import Product
+from app.services.product_service import ProductService
+
+logger = logging.getLogger(__name__)
+
+
+class ProductCatalogCache:
+    """商品目錄快取（read-through）"""
+    
+    def __init__(self, ttl_seconds: float = 60, stock_ttl_seconds: float = 0.5, max_size: int = 1000):
+        """
+        初始化商品目錄快取
+        
+        Args:
+            ttl_seconds: 靜態欄位與商品索引的快取時間（秒）
+            stock_ttl_seconds: 剩餘庫存與不存在商品的快取時間（秒）
+            max_size: 最多快取的商品數（超過時淘汰最久未使用者）
+        """
+        self.ttl_seconds = ttl_seconds
+        self.stock_ttl_seconds = stock_ttl_seconds
+        self.max_size = max_size
+        self._products: "OrderedDict[str, Tuple[float, Optional[Product]]]" = OrderedDict()
+        self._stocks: Dict[str, Tuple[float, int]] = {}
+        self._product_ids: Optional[Tuple[float, List[str]]] = None
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self._listener_task: Optional[asyncio.Task] = None
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "stock_refreshes": 0,
+            "invalidations": 0
+        }
+    
+    async def _single_flight(self, key: Hashable, loader: Callable[[], Awaitable]):
+        """相同 key 的並行載入只執行一次，其餘呼叫者共用結果"""
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(loader())
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(future)
+    
+    def _store_product(self, product_id: str, product: Optional[Product], now: float):
+        """寫入靜態欄位快取（不存在的商品以短 TTL 快取）"""
+        ttl = self.ttl_seconds if product is not None else self.stock_ttl_seconds
+        self._products[product_id] = (now + ttl, product)
+        self._products.move_to_end(product_id)
+        
+        while len(self._products) > self.max_size:
+            evicted_id, _ = self._products.popitem(last=False)
+            self._stocks.pop(evicted_id, None)
+    
+    async def _load_products(self, product_ids: List[str]) -> Dict[str, Product]:
+        """從 Redis 載入商品靜態欄位與庫存"""
+        products = {product.id: product for product in await ProductService.get_products(product_ids)}
+        now = time.monotonic()
+        
+        for product_id in product_ids:
+            product = products.get(product_id)
+            self._store_product(product_id, product, now)
+            if product is not None:
+                self._stocks[product_id] = (now + self.stock_ttl_seconds, product.remaining_stock)
+        
+        return products
+    
+    async def _refresh_stocks(self, product_ids: List[str]):
+        """
+        從 Redis 批次更新剩餘庫存
+        
+        庫存快取時間很短，可由複本讀取；靜態欄位與商品索引在失效通知後重新載入，
+        須讀主節點，避免把複本上尚未同步的舊資料快取整個 ttl_seconds。
+        """
+        stocks = await ProductService.get_stocks(product_ids, stale_ok=True)
+        now = time.monotonic()
+        self.stats["stock_refreshes"] += 1
+        
+        for product_id, stock in stocks.items():
+            self._stocks[product_id] = (now + self.stock_ttl_seconds, stock)
+    
+    async def _load_product_ids(self) -> List[str]:
+        """從 Redis 載入商品索引"""
+        product_ids = await ProductService.get_product_ids()
+        self._product_ids = (time.monotonic() + self.ttl_seconds, product_ids)
+        return product_ids
+    
+    async def get_products(self, product_ids: List[str]) -> List[Product]:
+        """批次取得商品（依傳入順序，略過不存在的商品）"""
+        now = time.monotonic()
+        
+        missing = [
+            product_id for product_id in product_ids
+            if product_id not in self._products or self._products[product_id][0] <= now
+        ]
+        loaded: Dict[str, Product] = {}
+        if missing:
+            self.stats["misses"] += len(missing)
+            loaded = await self._single_flight(("products", tuple(missing)), lambda: self._load_products(missing))
+        self.stats["hits"] += len(product_ids) - len(missing)
+        
+        now = time.monotonic()
+        stale = [
+            product_id for product_id in product_ids
+            if self._products.get(product_id, (0, None))[1] is not None
+            and (product_id not in self._stocks or self._stocks[product_id][0] <= now)
+        ]
+        if stale:
+            await self._single_flight(("stocks", tuple(stale)), lambda: self._refresh_stocks(stale))
+        
+        products = []
+        for product_id in product_ids:
+            entry = self._products.get(product_id)
+            if entry is None:
+                # 本次載入後已被淘汰（商品數超過快取上限）
+                if product_id in loaded:
+                    products.append(loaded[product_id])
+                continue
+            if entry[1] is None:
+                continue
+            self._products.move_to_end(product_id)
+            stock = self._stocks.get(product_id, (0, entry[1].remaining_stock))[1]
+            products.append(entry[1].model_copy(update={"remaining_stock": stock}))
+        
+        return products
+    
+    async def get_product(self, product_id: str) -> Optional[Product]:
+        """取得商品詳情"""
+        products = await self.get_products([product_id])
+        return products[0] if products else None
+    
+    async def get_all_products(self) -> List[Product]:
+        """取得所有商品列表"""
+        if self._product_ids is None or self._product_ids[0] <= time.monotonic():
+            product_ids = await self._single_flight("product_ids", self._load_product_ids)
+        else:
+            product_ids = self._product_ids[1]
+        return await self.get_products(product_ids)
+    
+    def invalidate(self, product_id: Optional[str] = None):
+        """清除本行程的商品快取（product_id 為 None 表示全部）"""
+        self.stats["invalidations"] += 1
+        self._product_ids = None
+        
+        if product_id is None:
+            self._products.clear()
+            self._stocks.clear()
+        else:
+            self._products.pop(product_id, None)
+            self._stocks.pop(product_id, None)
+    
+    async def _listen(self):
+        """訂閱商品快取失效通知（斷線時自動重連並清除快取）"""
+        while True:
+            pubsub = get_async_pubsub_client().pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(ProductService.CACHE_INVALIDATION_CHANNEL)
+                # 訂閱中斷期間可能錯過通知
+                self.invalidate()
+                async for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    try:
+                        self.invalidate(json.loads(message["data"]).get("product_id"))
+                    except (ValueError, AttributeError) as e:
+                        logger.warning(f"無法解析商品快取失效通知: {message['data']} ({e})")
+                        self.invalidate()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"商品快取失效訂閱錯誤: {str(e)}")
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()
+    
+    def start(self) -> asyncio.Task:
+        """啟動快取失效訂閱任務"""
+        if self._listener_task is None or self._listener_task.done():
+            self._listener_task = asyncio.create_task(self._listen())
+        return self._listener_task
+    
+    async def stop(self):
+        """停止快取失效訂閱任務"""
+        if self._listener_task is None:
+            return
+        
+        self._listener_task.cancel()
+        try:
+            await self._listener_task
+        except asyncio.CancelledError:
+            pass
+        self._listener_task = None
+
+
+product_catalog_cache = ProductCatalogCache(
+    ttl_seconds=float(os.getenv("PRODUCT_CACHE_TTL_SECONDS", "60")),
+    stock_ttl_seconds=float(os.getenv("PRODUCT_STOCK_CACHE_TTL_SECONDS", "0.5")),
+    max_size=int(os.getenv("PRODUCT_CACHE_MAX_SIZE", "1000"))
+)
@@ -1,137 +1,212 @@
 """
 商品服務
 """
-from typing import List, Optional
-from app.core.redis import get_redis_client
+import json
+import time
+from typing import Dict, List, Optional
+from app.core.metrics import instrument_redis
+from app.core.redis import get_async_pubsub_client, get_async_redis_client, hash_tag
+from app.core.replicas import get_async_read_client
 from app.models.product import Product
+from app.services.inventory_service import InventoryService
 
 
+@instrument_redis("ProductService")
 class ProductService:
     """商品服務類別"""
     
-    @staticmethod
-    def _get_stock_key(product_id: str) -> str:
-        """取得庫存 Redis key"""
-        return f"product:stock:{product_id}"
+    PRODUCT_REGISTRY_KEY = "product:registry"
+    CACHE_INVALIDATION_CHANNEL = "product:cache:invalidate"
+    
+    DEFAULT_PRODUCTS = [
+        {
+            "id": "1",
+            "name": "限量球鞋",
+            "image_url": "/images/shoes.png",
+            "price": 9999,
+            "total_stock": 5
+        }
+    ]
     
     @staticmethod
     def _get_product_key(product_id: str) -> str:
         """取得商品資訊 Redis key"""
-        return f"product:info:{product_id}"
+        return f"product:info:{hash_tag(product_id)}"
+    
+    @staticmethod
+    def _to_product_info(product_data: Dict) -> Dict[str, str]:
+        """轉換為商品資訊 Hash 欄位"""
+        return {
+            "id": product_data["id"],
+            "name": product_data["name"],
+            "image_url": product_data["image_url"],
+            "price": str(product_data["price"]),
+            "total_stock": str(product_data["total_stock"])
+        }
+    
+    @staticmethod
+    def _build_product(product_id: str, product_info: Dict[str, str], remaining_stock: int) -> Product:
+        """由 Redis 資料建立商品模型"""
+        return Product(
+            id=product_info.get("id", product_id),
+            name=product_info.get("name", ""),
+            image_url=product_info.get("image_url", ""),
+            price=int(product_info.get("price", 0)),
+            total_stock=int(product_info.get("total_stock", 0)),
+            remaining_stock=remaining_stock
+        )
+    
+    @staticmethod
+    async def _publish_invalidation(product_id: Optional[str] = None):
+        """寫入完成後通知所有副本清除商品快取（product_id 為 None 表示全部）"""
+        await get_async_pubsub_client().publish(
+            ProductService.CACHE_INVALIDATION_CHANNEL,
+            json.dumps({"product_id": product_id})
+        )
     
     @staticmethod
-    def initialize_products():
+    async def initialize_products():
         """初始化商品資料到 Redis"""
         import logging
         logger = logging.getLogger(__name__)
         logger.info("開始初始化商品資料")
         
-        redis_client = get_redis_client()
+        for product_data in ProductService.DEFAULT_PRODUCTS:
+            await ProductService.upsert_product(product_data)
+    
+    @staticmethod
+    async def upsert_product(product_data: Dict, reset_stock: bool = True):
+        """
+        新增或更新商品，並登錄到商品索引
         
-        products = [
-            {
-                "id": "1",
-                "name": "限量球鞋",
-                "image_url": "/images/shoes.png",
-                "price": 9999,
-                "total_stock": 5
-            }
-        ]
+        Args:
+            product_data: 商品資料（id, name, image_url, price, total_stock）
+            reset_stock: 是否將剩餘庫存重設為總庫存
+        """
+        redis_client = get_async_redis_client()
+        product_id = product_data["id"]
         
-        for product_data in products:
-            product_id = product_data["id"]
-            stock_key = ProductService._get_stock_key(product_id)
-            product_key = ProductService._get_product_key(product_id)
-            
-            redis_client.set(stock_key, product_data["total_stock"])
-            redis_client.hset(
-                product_key,
-                mapping={
-                    "id": product_data["id"],
-                    "name": product_data["name"],
-                    "image_url": product_data["image_url"],
-                    "price": str(product_data["price"]),
-                    "total_stock": str(product_data["total_stock"])
-                }
-            )
+        pipe = redis_client.pipeline(transaction=True)
+        if reset_stock:
+            for stock_key, stock in InventoryService.get_stock_values(product_id, product_data["total_stock"]).items():
+                pipe.set(stock_key, stock)
+            pipe.delete(InventoryService._get_sold_out_key(product_id))
+        pipe.hset(
+            ProductService._get_product_key(product_id),
+            mapping=ProductService._to_product_info(product_data)
+        )
+        pipe.zadd(ProductService.PRODUCT_REGISTRY_KEY, {product_id: int(time.time() * 1000)}, nx=True)
+        await pipe.execute()
+        await ProductService._publish_invalidation(product_id)
     
     @staticmethod
-    def get_all_products() -> List[Product]:
-        """取得所有商品列表"""
-        redis_client = get_redis_client()
-        products = []
-        keys = redis_client.keys("product:stock:*")
+    async def delete_product(product_id: str) -> bool:
+        """
+        刪除商品並自商品索引移除
         
-        for key in keys:
-            product_id = key.split(":")[-1]
-            product = ProductService.get_product(product_id)
-            if product:
-                products.append(product)
+        Returns:
+            bool: 商品是否存在
+        """
+        redis_client = get_async_redis_client()
         
-        return products
+        pipe = redis_client.pipeline(transaction=True)
+        pipe.zrem(ProductService.PRODUCT_REGISTRY_KEY, product_id)
+        # 庫存分片可能在不同 slot，逐一刪除
+        for key in [
+            ProductService._get_product_key(product_id),
+            InventoryService._get_sold_out_key(product_id),
+            InventoryService._get_reservations_key(product_id),
+            *InventoryService._get_stock_keys(product_id)
+        ]:
+            pipe.delete(key)
+        removed = (await pipe.execute())[0]
+        await ProductService._publish_invalidation(product_id)
+        return bool(removed)
     
     @staticmethod
-    def get_product(product_id: str) -> Optional[Product]:
-        """根據商品 ID 取得商品詳情"""
-        redis_client = get_redis_client()
+    async def get_product_ids(stale_ok: bool = False) -> List[str]:
+        """取得所有商品 ID（依建立順序，不掃描整個 keyspace；stale_ok 時可讀複本）"""
+        redis_client = get_async_read_client(stale_ok)
+        return await redis_client.zrange(ProductService.PRODUCT_REGISTRY_KEY, 0, -1)
+    
+    @staticmethod
+    async def get_products(product_ids: List[str], stale_ok: bool = False) -> List[Product]:
+        """批次取得商品（單一 pipeline，一次往返；stale_ok 時可讀複本）"""
+        if not product_ids:
+            return []
         
-        product_key = ProductService._get_product_key(product_id)
-        stock_key = ProductService._get_stock_key(product_id)
+        redis_client = get_async_read_client(stale_ok)
+        pipe = redis_client.pipeline(transaction=False)
+        stock_keys = {product_id: InventoryService._get_stock_keys(product_id) for product_id in product_ids}
+        for product_id in product_ids:
+            pipe.hgetall(ProductService._get_product_key(product_id))
+            for stock_key in stock_keys[product_id]:
+                pipe.get(stock_key)
+        results = iter(await pipe.execute())
         
-        if not redis_client.exists(product_key):
-            return None
+        products = []
+        for product_id in product_ids:
+            product_info = next(results)
+            # 庫存分片時加總各分片
+            remaining_stock = sum(int(next(results) or 0) for _ in stock_keys[product_id])
+            if product_info:
+                products.append(ProductService._build_product(product_id, product_info, remaining_stock))
         
-        product_info = redis_client.hgetall(product_key)
-        remaining_stock = int(redis_client.get(stock_key) or 0)
+        return products
+    
+    @staticmethod
+    async def get_stocks(product_ids: List[str], stale_ok: bool = False) -> Dict[str, int]:
+        """批次取得剩餘庫存（一次往返，庫存分片時加總各分片；各商品可能在不同 Cluster 節點，因此以 pipeline 取代 MGET；stale_ok 時可讀複本）"""
+        if not product_ids:
+            return {}
         
-        return Product(
-            id=product_info.get("id", product_id),
-            name=product_info.get("name", ""),
-            image_url=product_info.get("image_url", ""),
-            price=int(product_info.get("price", 0)),
-            total_stock=int(product_info.get("total_stock", 0)),
-            remaining_stock=remaining_stock
-        )
+        redis_client = get_async_read_client(stale_ok)
+        pipe = redis_client.pipeline(transaction=False)
+        stock_keys = {product_id: InventoryService._get_stock_keys(product_id) for product_id in product_ids}
+        for product_id in product_ids:
+            for stock_key in stock_keys[product_id]:
+                pipe.get(stock_key)
+        stocks = iter(await pipe.execute())
+        return {
+            product_id: sum(int(next(stocks) or 0) for _ in stock_keys[product_id])
+            for product_id in product_ids
+        }
+    
+    @staticmethod
+    async def get_all_products() -> List[Product]:
+        """取得所有商品列表"""
+        product_ids = await ProductService.get_product_ids()
+        return await ProductService.get_products(product_ids)
+    
+    @staticmethod
+    async def get_product(product_id: str) -> Optional[Product]:
+        """根據商品 ID 取得商品詳情"""
+        products = await ProductService.get_products([product_id])
+        return products[0] if products else None
     
     @staticmethod
-    def reset_stock():
+    async def reset_stock():
         """重置所有商品庫存為初始值"""
         import logging
         logger = logging.getLogger(__name__)
         logger.info("開始重置商品庫存")
         
-        redis_client = get_redis_client()
+        redis_client = get_async_redis_client()
         
-        products = [
-            {
-                "id": "1",
-                "name": "限量球鞋",
-                "image_url": "/images/shoes.png",
-                "price": 9999,
-                "total_stock": 5
-            }
-        ]
+        # 確保預設商品資訊存在
+        for product_data in ProductService.DEFAULT_PRODUCTS:
+            if not await redis_client.exists(ProductService._get_product_key(product_data["id"])):
+                await ProductService.upsert_product(product_data)
         
-        for product_data in products:
-            product_id = product_data["id"]
-            stock_key = ProductService._get_stock_key(product_id)
-            product_key = ProductService._get_product_key(product_id)
-            
-            # 重置庫存為初始值
-            redis_client.set(stock_key, product_data["total_stock"])
-            
-            # 確保商品資訊存在
-            if not redis_client.exists(product_key):
-                redis_client.hset(
-                    product_key,
-                    mapping={
-                        "id": product_data["id"],
-                        "name": product_data["name"],
-                        "image_url": product_data["image_url"],
-                        "price": str(product_data["price"]),
-                        "total_stock": str(product_data["total_stock"])
-                    }
-                )
+        # 將所有已登錄商品的剩餘庫存重置為總庫存
+        products = await ProductService.get_all_products()
+        pipe = redis_client.pipeline(transaction=True)
+        for product in products:
+            for stock_key, stock in InventoryService.get_stock_values(product.id, product.total_stock).items():
+                pipe.set(stock_key, stock)
+            pipe.delete(InventoryService._get_sold_out_key(product.id))
+        await pipe.execute()
+        await ProductService._publish_invalidation()
         
         logger.info("商品庫存重置完成")
         return True
@@ -0,0 +1,115 @@
+"""
+購買批次提交（group commit）
+
+庫存量大的搶購，每筆購買各自對同一個熱點庫存 key 執行腳本會讓 Redis 成為瓶頸。
+啟用後，同一商品在短時間窗內抵達的購買會合併成一次 purchase 腳本呼叫，
+庫存依抵達順序分配，各請求再取回自己的結果；以最多一個時間窗的延遲換取尖峰時大幅減少的 Redis 呼叫。
+預設停用，由 PURCHASE_BATCH_ENABLED 開啟。
+"""
+import asyncio
+import logging
+import os
+from typing import Dict, List, Set, Tuple
+from app.services.purchase_service import PurchaseOutcome, PurchaseService
+
+logger = logging.getLogger(__name__)
+
+PendingPurchase = Tuple[str, int, asyncio.Future]
+
+
+class PurchaseBatcher:
+    """購買批次提交器（每個行程一個）"""
+    
+    def __init__(self, enabled: bool = False, window_ms: int = 5, max_batch: int = 100):
+        """
+        初始化批次提交器
+        
+        Args:
+            enabled: 是否啟用批次提交；停用時每筆購買直接執行腳本
+            window_ms: 收集同一商品購買的時間窗（毫秒），亦為批次帶來的最大額外延遲
+            max_batch: 每批最多筆數，達到時不等時間窗立即提交
+        """
+        self.enabled = enabled
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._pending: Dict[str, List[PendingPurchase]] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._flush_tasks: Set[asyncio.Task] = set()
+        self.stats = {
+            "submitted": 0,
+            "batches": 0,
+            "largest_batch": 0
+        }
+    
+    async def purchase(self, product_id: str, session_id: str, quantity: int) -> PurchaseOutcome:
+        """
+        購買商品；啟用時排入該商品目前的批次並等待結果
+        
+        Returns:
+            Tuple[bool, Optional[str], Optional[int]]: 見 PurchaseService.purchase
+        """
+        if not self.enabled:
+            return await PurchaseService.purchase(product_id, session_id, quantity)
+        
+        self.stats["submitted"] += 1
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        batch = self._pending.setdefault(product_id, [])
+        batch.append((session_id, quantity, future))
+        
+        if len(batch) >= self.max_batch:
+            self._flush_soon(product_id)
+        elif len(batch) == 1:
+            self._timers[product_id] = loop.call_later(self.window, self._flush_soon, product_id)
+        
+        # 呼叫端取消（連線中斷）時同批的其他購買照常提交，購買結果仍以腳本為準
+        return await asyncio.shield(future)
+    
+    def _flush_soon(self, product_id: str):
+        """取出商品目前的批次並以背景任務提交"""
+        timer = self._timers.pop(product_id, None)
+        if timer is not None:
+            timer.cancel()
+        
+        batch = self._pending.pop(product_id, None)
+        if not batch:
+            return
+        
+        task = asyncio.create_task(self._flush(product_id, batch))
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
+    
+    async def _flush(self, product_id: str, batch: List[PendingPurchase]):
+        """以一次腳本呼叫提交整批購買並通知各等待者"""
+        self.stats["batches"] += 1
+        self.stats["largest_batch"] = max(self.stats["largest_batch"], len(batch))
+        
+        try:
+            outcomes = await PurchaseService.purchase_many(
+                product_id,
+                [(session_id, quantity) for session_id, quantity, _ in batch]
+            )
+        except Exception as e:
+            logger.error(f"商品 {product_id} 批次購買錯誤（{len(batch)} 筆）: {str(e)}")
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        
+        for (_, _, future), outcome in zip(batch, outcomes):
+            if not future.done():
+                future.set_result(outcome)
+    
+    async def stop(self):
+        """提交所有尚在收集中的批次並等待完成"""
+        for product_id in list(self._pending):
+            self._flush_soon(product_id)
+        if self._flush_tasks:
+            await asyncio.gather(*self._flush_tasks, return_exceptions=True)
+
+
+purchase_batcher = PurchaseBatcher(
+    enabled=os.getenv("PURCHASE_BATCH_ENABLED", "false").lower() == "true",
+    window_ms=int(os.getenv("PURCHASE_BATCH_WINDOW_MS", "5")),
+    max_batch=int(os.getenv("PURCHASE_BATCH_MAX_SIZE", "100"))
+)
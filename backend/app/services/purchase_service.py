@@ -0,0 +1,216 @@
+"""
+購買服務
+"""
+import logging
+import time
+from typing import Dict, List, Optional, Tuple, Union
+from app.core.metrics import QUEUE_PROMOTIONS, instrument_redis
+from app.core.redis import get_async_redis_client
+from app.core.scripts import run_script
+from app.services.inventory_service import InventoryService
+from app.services.queue_service import QueueService
+from app.services.session_service import SessionService
+
+logger = logging.getLogger(__name__)
+
+PurchaseOutcome = Tuple[bool, Optional[str], Optional[int]]
+
+
+@instrument_redis("PurchaseService")
+class PurchaseService:
+    """購買服務類別"""
+    
+    @staticmethod
+    async def purchase(product_id: str, session_id: str, quantity: int) -> PurchaseOutcome:
+        """
+        購買商品（單一 Lua 腳本：資格檢查、限購、扣庫存、移出搖滾區、更新會話並遞補空位）
+        
+        Args:
+            product_id: 商品 ID
+            session_id: 會話 ID
+            quantity: 購買數量
+        
+        Returns:
+            Tuple[bool, Optional[str], Optional[int]]: (是否成功, 錯誤代碼, 剩餘庫存)
+                錯誤代碼：SESSION_NOT_FOUND、ALREADY_PURCHASED、NOT_IN_ACTIVE_QUEUE、PRODUCT_NOT_FOUND、INSUFFICIENT_STOCK
+        """
+        outcomes = await PurchaseService.purchase_many(product_id, [(session_id, quantity)])
+        return outcomes[0]
+    
+    @staticmethod
+    async def purchase_many(product_id: str, purchases: List[Tuple[str, int]]) -> List[PurchaseOutcome]:
+        """
+        以同一次腳本呼叫處理同一商品的多筆購買，庫存依列表順序分配
+        
+        Args:
+            product_id: 商品 ID
+            purchases: (會話 ID, 數量) 列表，依抵達順序排列
+        
+        Returns:
+            List[Tuple[bool, Optional[str], Optional[int]]]: 與 purchases 對應的購買結果（見 purchase）
+        """
+        if not purchases:
+            return []
+        
+        for session_id, quantity in purchases:
+            logger.info(f"使用者 {session_id} 嘗試購買商品 {product_id}，數量: {quantity}")
+        
+        if InventoryService.is_sharded():
+            return await PurchaseService._purchase_sharded(product_id, purchases)
+        
+        outcomes, _ = await PurchaseService._run_purchase_script(product_id, purchases, "")
+        return outcomes
+    
+    @staticmethod
+    async def _purchase_sharded(product_id: str, purchases: List[Tuple[str, int]]) -> List[PurchaseOutcome]:
+        """
+        庫存分片時的購買：分片在其他 slot，無法與佇列在同一個腳本內扣減
+        
+        先以一個 pipeline 檢查資格，只為符合資格的購買預留庫存並執行腳本，未用完的件數再歸還；
+        資格不符的購買直接回傳錯誤，不佔用其他人可買的庫存。
+        """
+        errors = await PurchaseService._check_eligibility(product_id, purchases)
+        eligible = [purchase for purchase, error in zip(purchases, errors) if error is None]
+        if not eligible:
+            return [(False, error, None) for error in errors]
+        
+        # 同一會話在批次內重複時只會成交第一筆
+        quantities: Dict[str, int] = {}
+        for session_id, quantity in eligible:
+            quantities.setdefault(session_id, quantity)
+        
+        # 預先檢查已登記一筆進行中的預留，不論成功或失敗都在預留件數成交或歸還後結算
+        try:
+            grants = await InventoryService.reserve_stock(product_id, sum(quantities.values()), eligible[0][0])
+            reserved = sum(granted for _, granted in grants) if grants is not None else -1
+            
+            try:
+                results, unused = await PurchaseService._run_purchase_script(product_id, eligible, reserved)
+            except Exception:
+                if grants:
+                    await PurchaseService._release_after_error(product_id, quantities, grants)
+                raise
+            
+            await InventoryService.release_stock(product_id, grants or [], unused)
+        finally:
+            pending, seq = await InventoryService.settle_reservation(product_id)
+        
+        results = iter(results)
+        outcomes = [(False, error, None) if error else next(results) for error in errors]
+        
+        # 分片時腳本只看得到預留件數，剩餘庫存改為加總各分片；
+        # 加總為 0 且沒有其他進行中的預留時才是真的售完
+        if any(outcome[2] is not None for outcome in outcomes):
+            stock = await InventoryService.get_stock(product_id)
+            if stock == 0 and pending == 0:
+                await InventoryService.mark_sold_out(product_id, seq)
+            outcomes = [
+                (success, error, stock if remaining_stock is not None else None)
+                for success, error, remaining_stock in outcomes
+            ]
+        return outcomes
+    
+    @staticmethod
+    async def _check_eligibility(product_id: str, purchases: List[Tuple[str, int]]) -> List[Optional[str]]:
+        """
+        預先檢查購買資格（檢查順序與購買腳本相同，腳本仍會在原子操作內再檢查一次）
+        
+        有符合資格的購買時在同一個腳本內登記一筆進行中的預留，呼叫端需以 InventoryService.settle_reservation 結算。
+        
+        Returns:
+            List[Optional[str]]: 與 purchases 對應的錯誤代碼，符合資格為 None
+        """
+        session_ids = list(dict.fromkeys(session_id for session_id, _ in purchases))
+        keys = [
+            QueueService._get_active_key(product_id),
+            QueueService._get_deadline_key(product_id),
+            InventoryService._get_purchases_key(product_id),
+            InventoryService._get_reservations_key(product_id)
+        ]
+        keys.extend(SessionService._get_session_key(session_id, product_id) for session_id in session_ids)
+        
+        codes = await run_script(
+            "check_purchase",
+            keys=keys,
+            args=[int(time.time() * 1000), InventoryService.RESERVATION_TTL_SECONDS, *session_ids]
+        )
+        errors = dict(zip(session_ids, codes))
+        return [errors[session_id] for session_id, _ in purchases]
+    
+    @staticmethod
+    async def _release_after_error(product_id: str, quantities: Dict[str, int], grants: List[Tuple[int, int]]):
+        """
+        購買腳本錯誤時歸還預留的庫存
+        
+        腳本可能已執行（僅回應遺失），因此先查詢哪些會話已完成購買，只歸還其餘的件數；
+        無法確認時寧可少賣，不歸還。
+        """
+        reserved = sum(granted for _, granted in grants)
+        try:
+            redis_client = get_async_redis_client()
+            pipe = redis_client.pipeline(transaction=False)
+            for session_id in quantities:
+                pipe.sismember(InventoryService._get_purchases_key(product_id), session_id)
+            purchased = await pipe.execute()
+            consumed = sum(quantity for quantity, done in zip(quantities.values(), purchased) if done)
+            await InventoryService.release_stock(product_id, grants, reserved - consumed)
+        except Exception as e:
+            logger.error(f"商品 {product_id} 購買腳本錯誤後無法確認購買結果，未歸還預留的 {reserved} 件庫存: {str(e)}")
+    
+    @staticmethod
+    async def _run_purchase_script(
+        product_id: str,
+        purchases: List[Tuple[str, int]],
+        reserved: Union[str, int]
+    ) -> Tuple[List[PurchaseOutcome], int]:
+        """
+        執行購買腳本
+        
+        Args:
+            product_id: 商品 ID
+            purchases: (會話 ID, 數量) 列表
+            reserved: 分片時預留的件數（商品不存在為 -1），不分片時為空字串
+        
+        Returns:
+            Tuple[List[PurchaseOutcome], int]: (購買結果, 剩餘庫存；分片時為未用完的預留件數)
+        """
+        from app.tasks.queue_manager import QueueScheduler
+        
+        keys = [
+            QueueService._get_active_key(product_id),
+            QueueService._get_deadline_key(product_id),
+            InventoryService._get_stock_key(product_id),
+            InventoryService._get_purchases_key(product_id),
+            QueueService._get_waiting_key(product_id),
+            QueueService._get_head_key(product_id),
+            InventoryService._get_sold_out_key(product_id)
+        ]
+        args = [
+            int(time.time() * 1000),
+            QueueService.ACTIVE_QUEUE_MAX_SIZE,
+            SessionService._get_session_key("", product_id),
+            QueueService.PURCHASE_TIMEOUT_MS,
+            QueueScheduler.WAKEUP_CHANNEL,
+            product_id,
+            reserved,
+            InventoryService.SOLD_OUT_CHANNEL
+        ]
+        for session_id, quantity in purchases:
+            keys.extend([
+                SessionService._get_session_key(session_id, product_id),
+                QueueService._get_lock_key(product_id, session_id)
+            ])
+            args.extend([session_id, quantity])
+        
+        results, promoted, remaining = await run_script("purchase", keys=keys, args=args)
+        
+        if promoted:
+            QUEUE_PROMOTIONS.inc((product_id,), len(promoted))
+        
+        outcomes = []
+        for result in results:
+            if result[0] == "ok":
+                outcomes.append((True, None, int(result[1])))
+            else:
+                outcomes.append((False, result[1], int(result[2]) if result[2] is not None else None))
+        return outcomes, int(remaining or 0)
@@ -0,0 +1,122 @@
+"""
+佇列狀態廣播服務
+
+佇列管理任務每個週期對每個商品發布一次佇列狀態（Redis pub/sub），
+每個應用程式行程只訂閱一次，再於記憶體中喚醒本地的 SSE 連線，
+讓 Redis 負載與商品數成正比，而非與連線數成正比。
+"""
+import asyncio
+import json
+import logging
+import time
+from typing import Dict, Optional
+from app.core.redis import get_async_pubsub_client
+from app.services.queue_service import QueueService
+
+logger = logging.getLogger(__name__)
+
+
+class QueueBroadcaster:
+    """佇列狀態廣播器"""
+    
+    CHANNEL_PREFIX = "queue:events:product:"
+    
+    def __init__(self):
+        self._snapshots: Dict[str, dict] = {}
+        self._events: Dict[str, asyncio.Event] = {}
+        self._listener_task: Optional[asyncio.Task] = None
+    
+    def _get_channel(self, product_id: str) -> str:
+        """取得商品的廣播頻道"""
+        return f"{self.CHANNEL_PREFIX}{product_id}"
+    
+    def _get_event(self, product_id: str) -> asyncio.Event:
+        """取得商品目前的更新事件"""
+        if product_id not in self._events:
+            self._events[product_id] = asyncio.Event()
+        return self._events[product_id]
+    
+    async def publish_queue_state(self, product_id: str) -> dict:
+        """
+        讀取並發布商品的佇列狀態（由佇列管理任務每週期呼叫一次）
+        
+        Returns:
+            dict: 發布的佇列狀態
+        """
+        # 廣播的總覽可容忍短暫延遲，可由複本讀取；SSE 連線的定位仍讀主節點
+        snapshot = await QueueService.get_queue_totals(product_id, stale_ok=True)
+        snapshot["product_id"] = product_id
+        snapshot["published_at"] = int(time.time() * 1000)
+        
+        redis_client = get_async_pubsub_client()
+        await redis_client.publish(self._get_channel(product_id), json.dumps(snapshot))
+        return snapshot
+    
+    def dispatch(self, snapshot: dict):
+        """將佇列狀態分送給本行程等待中的 SSE 連線"""
+        product_id = snapshot["product_id"]
+        self._snapshots[product_id] = snapshot
+        
+        event = self._get_event(product_id)
+        self._events[product_id] = asyncio.Event()
+        event.set()
+    
+    def get_snapshot(self, product_id: str) -> Optional[dict]:
+        """取得本行程最近收到的佇列狀態"""
+        return self._snapshots.get(product_id)
+    
+    async def wait_for_update(self, product_id: str, timeout: float) -> Optional[dict]:
+        """
+        等待下一次佇列狀態廣播
+        
+        Returns:
+            Optional[dict]: 新的佇列狀態，逾時則為 None
+        """
+        event = self._get_event(product_id)
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        return self._snapshots.get(product_id)
+    
+    async def _listen(self):
+        """訂閱所有商品的廣播頻道（斷線時自動重連）"""
+        while True:
+            pubsub = get_async_pubsub_client().pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.psubscribe(f"{self.CHANNEL_PREFIX}*")
+                async for message in pubsub.listen():
+                    if message.get("type") != "pmessage":
+                        continue
+                    try:
+                        self.dispatch(json.loads(message["data"]))
+                    except (ValueError, KeyError) as e:
+                        logger.warning(f"無法解析佇列廣播訊息: {message['data']} ({e})")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"佇列廣播訂閱錯誤: {str(e)}")
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()
+    
+    def start(self) -> asyncio.Task:
+        """啟動廣播訂閱任務"""
+        if self._listener_task is None or self._listener_task.done():
+            self._listener_task = asyncio.create_task(self._listen())
+        return self._listener_task
+    
+    async def stop(self):
+        """停止廣播訂閱任務"""
+        if self._listener_task is None:
+            return
+        
+        self._listener_task.cancel()
+        try:
+            await self._listener_task
+        except asyncio.CancelledError:
+            pass
+        self._listener_task = None
+
+
+queue_broadcaster = QueueBroadcaster()
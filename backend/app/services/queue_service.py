@@ -1,30 +1,80 @@
 """
 佇列服務
 """
+import math
 import time
-from typing import Optional, Tuple
-from app.core.redis import get_redis_client
+from typing import Dict, List, Optional, Tuple
+from app.core.metrics import QUEUE_PROMOTIONS, instrument_redis
+from app.core.redis import get_async_redis_client, hash_tag
+from app.core.replicas import get_async_read_client
+from app.core.scripts import run_script
 
 
+@instrument_redis("QueueService")
 class QueueService:
     """佇列服務類別"""
     
     ACTIVE_QUEUE_MAX_SIZE = 10
+    PURCHASE_TIMEOUT_MS = 2 * 60 * 1000  # 搖滾區購買時限
+    EXPIRE_BATCH_SIZE = 500  # 每次逾時移除最多處理的人數
+    COMPACT_LIMIT = 100  # 每次壓縮最多檢查的排隊號碼數
+    RATE_WINDOW_SECONDS = 30  # 吞吐率 EWMA 的時間常數
+    DRAIN_BATCH_SIZE = 500  # 售完後每次清空佇列最多處理的人數
+    SOLD_OUT_SESSION_TTL_SECONDS = 300  # 售完後會話保留時間（讓用戶端仍能查到 sold_out 狀態）
     
     @staticmethod
     def _get_waiting_key(product_id: str) -> str:
         """取得排隊區 Redis key"""
-        return f"queue:waiting:product:{product_id}"
+        return f"queue:waiting:product:{hash_tag(product_id)}"
     
     @staticmethod
     def _get_active_key(product_id: str) -> str:
         """取得搖滾區 Redis key"""
-        return f"queue:active:product:{product_id}"
+        return f"queue:active:product:{hash_tag(product_id)}"
     
     @staticmethod
-    def join_waiting_queue(product_id: str, session_id: str) -> int:
+    def _get_deadline_key(product_id: str) -> str:
+        """取得搖滾區購買期限索引 Redis key（分數為購買期限時間戳）"""
+        return f"queue:deadline:product:{hash_tag(product_id)}"
+    
+    @staticmethod
+    def _get_head_key(product_id: str) -> str:
+        """取得已服務號碼 Redis key（號碼小於 head 的使用者都已離開排隊區）"""
+        return f"queue:head:product:{hash_tag(product_id)}"
+    
+    @staticmethod
+    def _get_ticket_key(product_id: str) -> str:
+        """取得已發放排隊號碼數 Redis key（下一個號碼）"""
+        return f"queue:ticket:product:{hash_tag(product_id)}"
+    
+    @staticmethod
+    def _get_lock_key(product_id: str, session_id: str) -> str:
+        """取得購買鎖 Redis key（與該商品的佇列同一個 slot）"""
+        return f"purchase:lock:{hash_tag(product_id)}:{session_id}"
+    
+    @staticmethod
+    def _get_rate_key(product_id: str) -> str:
+        """取得佇列吞吐率 Redis key"""
+        return f"queue:rate:product:{hash_tag(product_id)}"
+    
+    @staticmethod
+    def calculate_position(ticket: int, head: int, tail: int, total_waiting: int) -> int:
+        """
+        由排隊號碼推算排隊位置（0-based），不存取排隊區
+        
+        號碼介於 head 與 tail 之間但已放棄的使用者會讓 號碼 - head 偏高，
+        因此依排隊區實際人數佔未服務號碼的比例換算；沒有放棄者時即為 號碼 - head。
         """
-        加入排隊區
+        ahead = max(ticket - head, 0)
+        outstanding = tail - head
+        if 0 < total_waiting < outstanding:
+            return ahead * total_waiting // outstanding
+        return ahead
+    
+    @staticmethod
+    async def join_waiting_queue(product_id: str, session_id: str) -> int:
+        """
+        加入排隊區（已在排隊區時沿用原號碼）
         
         Returns:
             int: 在排隊區的位置（0-based）
@@ -33,134 +83,375 @@ class QueueService:
         logger = logging.getLogger(__name__)
         logger.info(f"使用者 {session_id} 加入商品 {product_id} 的排隊區")
         
-        redis_client = get_redis_client()
-        waiting_key = QueueService._get_waiting_key(product_id)
+        _, position = await run_script(
+            "enqueue_ticket",
+            keys=[
+                QueueService._get_waiting_key(product_id),
+                QueueService._get_ticket_key(product_id),
+                QueueService._get_head_key(product_id)
+            ],
+            args=[session_id]
+        )
+        return int(position)
+    
+    @staticmethod
+    async def join_with_new_session(product_id: str, turnstile_verified: bool = True) -> Tuple[str, int]:
+        """
+        建立會話並加入排隊區（單一 Lua 腳本，一次往返）
+        
+        Returns:
+            Tuple[str, int]: (會話 ID, 在排隊區的位置（0-based）)
+        """
+        from app.services.session_service import SessionService
+        
+        session_id = SessionService.generate_session_id()
+        redis_client = get_async_redis_client()
         current_timestamp = int(time.time() * 1000)
         
-        redis_client.zadd(waiting_key, {session_id: current_timestamp})
-        position = redis_client.zrank(waiting_key, session_id)
-        return position if position is not None else -1
+        position = await run_script(
+            "join_queue",
+            keys=[
+                SessionService._get_session_key(session_id, product_id),
+                QueueService._get_waiting_key(product_id),
+                QueueService._get_ticket_key(product_id)
+            ],
+            args=[
+                session_id,
+                product_id,
+                current_timestamp,
+                SessionService.SESSION_TTL_SECONDS,
+                "true" if turnstile_verified else "false"
+            ],
+            client=redis_client
+        )
+        return session_id, int(position)
     
     @staticmethod
-    def get_waiting_position(product_id: str, session_id: str) -> Optional[int]:
-        """查詢在排隊區的位置"""
-        redis_client = get_redis_client()
-        waiting_key = QueueService._get_waiting_key(product_id)
+    async def get_waiting_position(product_id: str, session_id: str) -> Optional[int]:
+        """查詢在排隊區的位置（由排隊號碼與 head 推算，不使用 ZRANK）"""
+        redis_client = get_async_redis_client()
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.zscore(QueueService._get_waiting_key(product_id), session_id)
+        pipe.get(QueueService._get_head_key(product_id))
+        pipe.get(QueueService._get_ticket_key(product_id))
+        pipe.zcard(QueueService._get_waiting_key(product_id))
+        ticket, head, tail, total_waiting = await pipe.execute()
         
-        position = redis_client.zrank(waiting_key, session_id)
-        return position if position is not None else None
+        if ticket is None:
+            return None
+        return QueueService.calculate_position(int(ticket), int(head or 0), int(tail or 0), total_waiting)
     
     @staticmethod
-    def get_active_position(product_id: str, session_id: str) -> Optional[int]:
+    async def get_active_position(product_id: str, session_id: str) -> Optional[int]:
         """查詢在搖滾區的位置"""
-        redis_client = get_redis_client()
+        redis_client = get_async_redis_client()
         active_key = QueueService._get_active_key(product_id)
         
-        position = redis_client.zrank(active_key, session_id)
+        position = await redis_client.zrank(active_key, session_id)
         return position if position is not None else None
     
     @staticmethod
-    def get_waiting_count(product_id: str) -> int:
-        """取得排隊區總人數"""
-        redis_client = get_redis_client()
+    async def get_waiting_count(product_id: str, stale_ok: bool = False) -> int:
+        """取得排隊區總人數（stale_ok 時可讀複本）"""
+        redis_client = get_async_read_client(stale_ok)
         waiting_key = QueueService._get_waiting_key(product_id)
-        return redis_client.zcard(waiting_key)
+        return await redis_client.zcard(waiting_key)
     
     @staticmethod
-    def get_active_count(product_id: str) -> int:
-        """取得搖滾區總人數"""
-        redis_client = get_redis_client()
+    async def get_active_count(product_id: str, stale_ok: bool = False) -> int:
+        """取得搖滾區總人數（stale_ok 時可讀複本）"""
+        redis_client = get_async_read_client(stale_ok)
         active_key = QueueService._get_active_key(product_id)
-        return redis_client.zcard(active_key)
+        return await redis_client.zcard(active_key)
+    
+    @staticmethod
+    async def get_queue_totals(product_id: str, stale_ok: bool = False) -> Dict[str, int]:
+        """
+        取得佇列總覽（一次往返；stale_ok 時可讀複本）
+        
+        Returns:
+            Dict[str, int]: head（已服務號碼）、tail（已發放號碼數）、total_in_waiting、total_in_active、
+                promote_rate（每秒晉升數）、exit_rate（搖滾區每秒離開數）
+        """
+        redis_client = get_async_read_client(stale_ok)
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.get(QueueService._get_head_key(product_id))
+        pipe.get(QueueService._get_ticket_key(product_id))
+        pipe.zcard(QueueService._get_waiting_key(product_id))
+        pipe.zcard(QueueService._get_active_key(product_id))
+        pipe.hmget(QueueService._get_rate_key(product_id), "promote_rate", "exit_rate")
+        head, tail, total_waiting, total_active, (promote_rate, exit_rate) = await pipe.execute()
+        
+        return {
+            "head": int(head or 0),
+            "tail": int(tail or 0),
+            "promote_rate": float(promote_rate or 0),
+            "exit_rate": float(exit_rate or 0),
+            "total_in_waiting": total_waiting,
+            "total_in_active": total_active
+        }
+    
+    @staticmethod
+    async def get_queue_depths(product_ids: List[str], stale_ok: bool = False) -> Dict[str, Dict[str, int]]:
+        """
+        批次取得多個商品的排隊區與搖滾區人數（一次往返；stale_ok 時可讀複本）
+        
+        Returns:
+            Dict[str, Dict[str, int]]: 商品 ID -> {total_in_waiting, total_in_active}
+        """
+        if not product_ids:
+            return {}
+        
+        redis_client = get_async_read_client(stale_ok)
+        pipe = redis_client.pipeline(transaction=False)
+        for product_id in product_ids:
+            pipe.zcard(QueueService._get_waiting_key(product_id))
+            pipe.zcard(QueueService._get_active_key(product_id))
+        results = await pipe.execute()
+        
+        return {
+            product_id: {
+                "total_in_waiting": results[index * 2],
+                "total_in_active": results[index * 2 + 1]
+            }
+            for index, product_id in enumerate(product_ids)
+        }
+    
+    @staticmethod
+    async def get_status_snapshot(product_id: str, session_id: str) -> Dict[str, Optional[int]]:
+        """
+        取得會話的佇列狀態快照（單一 pipeline，一次往返），供 /queue/status 與 SSE 使用
+        
+        排隊號碼在使用者離開排隊區前保持不變，SSE 之後只需廣播的 head 即可推算位置。
+        
+        Returns:
+            Dict[str, Optional[int]]: session_exists、queue_index（排隊號碼，不在排隊區為 None）、
+                queue_position_waiting、queue_position_active（不在該區為 None）、head、tail、
+                total_in_waiting、total_in_active、promote_rate、exit_rate
+        """
+        from app.services.session_service import SessionService
+        
+        redis_client = get_async_redis_client()
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.exists(SessionService._get_session_key(session_id, product_id))
+        pipe.zscore(QueueService._get_waiting_key(product_id), session_id)
+        pipe.zrank(QueueService._get_active_key(product_id), session_id)
+        pipe.get(QueueService._get_head_key(product_id))
+        pipe.get(QueueService._get_ticket_key(product_id))
+        pipe.zcard(QueueService._get_waiting_key(product_id))
+        pipe.zcard(QueueService._get_active_key(product_id))
+        pipe.hmget(QueueService._get_rate_key(product_id), "promote_rate", "exit_rate")
+        (
+            session_exists, ticket, position_active, head, tail, total_waiting, total_active,
+            (promote_rate, exit_rate)
+        ) = await pipe.execute()
+        
+        head, tail = int(head or 0), int(tail or 0)
+        return {
+            "session_exists": bool(session_exists),
+            "queue_index": int(ticket) if ticket is not None else None,
+            "queue_position_waiting": (
+                QueueService.calculate_position(int(ticket), head, tail, total_waiting)
+                if ticket is not None else None
+            ),
+            "queue_position_active": position_active,
+            "head": head,
+            "tail": tail,
+            "total_in_waiting": total_waiting,
+            "total_in_active": total_active,
+            "promote_rate": float(promote_rate or 0),
+            "exit_rate": float(exit_rate or 0)
+        }
     
     @staticmethod
-    def move_to_active(product_id: str, count: int = None) -> int:
+    async def move_to_active(product_id: str, count: int = None) -> int:
         """
-        從排隊區移入搖滾區
+        從排隊區移入搖滾區（單一 Lua 腳本，原子地確保搖滾區上限）
         
         Args:
             product_id: 商品 ID
             count: 要移入的人數（預設為填滿搖滾區）
-            
+        
         Returns:
             int: 實際移入的人數
         """
-        redis_client = get_redis_client()
-        waiting_key = QueueService._get_waiting_key(product_id)
-        active_key = QueueService._get_active_key(product_id)
-        
-        current_active_count = QueueService.get_active_count(product_id)
-        available_slots = QueueService.ACTIVE_QUEUE_MAX_SIZE - current_active_count
+        moved_sessions = await QueueService.promote(product_id, count)
+        return len(moved_sessions)
+    
+    @staticmethod
+    async def promote(product_id: str, count: int = None) -> List[str]:
+        """
+        從排隊區移入搖滾區並更新會話狀態
         
-        if available_slots <= 0:
-            return 0
+        Args:
+            product_id: 商品 ID
+            count: 要移入的人數（預設為填滿搖滾區）
         
-        move_count = count if count is not None else available_slots
-        move_count = min(move_count, available_slots)
+        Returns:
+            List[str]: 移入搖滾區的會話 ID
+        """
+        from app.services.session_service import SessionService
         
-        if move_count <= 0:
-            return 0
+        if count is not None and count <= 0:
+            return []
         
-        members = redis_client.zrange(waiting_key, 0, move_count - 1, withscores=True)
+        moved_sessions = await run_script(
+            "promote",
+            keys=[
+                QueueService._get_waiting_key(product_id),
+                QueueService._get_active_key(product_id),
+                QueueService._get_head_key(product_id),
+                QueueService._get_deadline_key(product_id)
+            ],
+            args=[
+                QueueService.ACTIVE_QUEUE_MAX_SIZE,
+                count if count is not None else -1,
+                int(time.time() * 1000),
+                SessionService._get_session_key("", product_id),
+                QueueService.PURCHASE_TIMEOUT_MS
+            ]
+        )
+        if moved_sessions:
+            QUEUE_PROMOTIONS.inc((product_id,), len(moved_sessions))
+        return list(moved_sessions or [])
+    
+    @staticmethod
+    async def compact(product_id: str, limit: Optional[int] = None) -> int:
+        """
+        移除排隊區前段會話已不存在的號碼，並將 head 推進到第一個有效號碼
         
-        if not members:
-            return 0
+        Args:
+            product_id: 商品 ID
+            limit: 單次最多檢查的號碼數
         
-        current_timestamp = int(time.time() * 1000)
-        moved_count = 0
-        pipe = redis_client.pipeline()
-        moved_sessions = []
+        Returns:
+            int: 移除的號碼數
+        """
+        from app.services.session_service import SessionService
         
-        for member, score in members:
-            session_id = member
-            pipe.zadd(active_key, {session_id: current_timestamp})
-            pipe.zrem(waiting_key, session_id)
-            moved_sessions.append(session_id)
-            moved_count += 1
+        removed, _ = await run_script(
+            "compact_queue",
+            keys=[
+                QueueService._get_waiting_key(product_id),
+                QueueService._get_head_key(product_id),
+                QueueService._get_ticket_key(product_id)
+            ],
+            args=[SessionService._get_session_key("", product_id), limit or QueueService.COMPACT_LIMIT]
+        )
+        return int(removed)
+    
+    @staticmethod
+    async def remove_from_active(product_id: str, session_id: str):
+        """從搖滾區移除"""
+        redis_client = get_async_redis_client()
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.zrem(QueueService._get_active_key(product_id), session_id)
+        pipe.zrem(QueueService._get_deadline_key(product_id), session_id)
+        pipe.delete(QueueService._get_lock_key(product_id, session_id))
+        await pipe.execute()
+    
+    @staticmethod
+    async def expire_active(product_id: str, limit: Optional[int] = None) -> Tuple[List[str], Optional[int]]:
+        """
+        移除超過購買期限的搖滾區使用者（單一 Lua 腳本）
         
-        pipe.execute()
+        Args:
+            product_id: 商品 ID
+            limit: 單次最多處理的人數
         
-        if moved_sessions:
-            from app.services.session_service import SessionService
-            for session_id in moved_sessions:
-                position = redis_client.zrank(active_key, session_id)
-                SessionService.update_session(
-                    session_id,
-                    queue_position_active=position if position is not None else -1,
-                    queue_position_waiting=None,
-                    queue_status="active"
-                )
+        Returns:
+            Tuple[List[str], Optional[int]]: (逾時移除的會話 ID, 下一個購買期限時間戳（無則為 None）)
+        """
+        from app.services.session_service import SessionService
         
-        return moved_count
+        expired_sessions, next_deadline = await run_script(
+            "expire_active",
+            keys=[
+                QueueService._get_active_key(product_id),
+                QueueService._get_deadline_key(product_id)
+            ],
+            args=[
+                int(time.time() * 1000),
+                limit or QueueService.EXPIRE_BATCH_SIZE,
+                SessionService._get_session_key("", product_id),
+                QueueService._get_lock_key(product_id, "")
+            ]
+        )
+        return list(expired_sessions or []), int(float(next_deadline)) if next_deadline else None
     
     @staticmethod
-    def remove_from_active(product_id: str, session_id: str):
-        """從搖滾區移除"""
-        redis_client = get_redis_client()
-        active_key = QueueService._get_active_key(product_id)
-        redis_client.zrem(active_key, session_id)
+    async def drain(product_id: str, limit: Optional[int] = None) -> Tuple[int, int]:
+        """
+        售完後分批清空排隊區與搖滾區（單一 Lua 腳本，每次最多處理 limit 人）
         
-        lock_key = f"purchase:lock:{session_id}"
-        redis_client.delete(lock_key)
+        Args:
+            product_id: 商品 ID
+            limit: 單次最多移除的人數
+        
+        Returns:
+            Tuple[int, int]: (本次移除人數, 佇列剩餘人數)
+        """
+        from app.services.session_service import SessionService
+        
+        drained, remaining = await run_script(
+            "drain_queue",
+            keys=[
+                QueueService._get_waiting_key(product_id),
+                QueueService._get_active_key(product_id),
+                QueueService._get_deadline_key(product_id)
+            ],
+            args=[
+                limit or QueueService.DRAIN_BATCH_SIZE,
+                SessionService._get_session_key("", product_id),
+                QueueService._get_lock_key(product_id, ""),
+                QueueService.SOLD_OUT_SESSION_TTL_SECONDS
+            ]
+        )
+        return int(drained), int(remaining)
     
     @staticmethod
-    def estimate_wait_time(product_id: str, position_waiting: int, position_active: int) -> int:
+    async def update_rates(product_id: str, promoted: int) -> Tuple[float, float]:
         """
-        預估等待時間（秒）
+        以本週期的晉升數更新吞吐率（由佇列管理任務於晉升後呼叫）
         
         Args:
             product_id: 商品 ID
-            position_waiting: 在排隊區的位置
-            position_active: 在搖滾區的位置
-            
+            promoted: 本週期從排隊區移入搖滾區的人數
+        
         Returns:
-            int: 預估等待時間（秒）
+            Tuple[float, float]: (每秒晉升數, 搖滾區每秒離開數)
+        """
+        promote_rate, exit_rate = await run_script(
+            "update_rates",
+            keys=[
+                QueueService._get_rate_key(product_id),
+                QueueService._get_waiting_key(product_id),
+                QueueService._get_active_key(product_id)
+            ],
+            args=[promoted, int(time.time() * 1000), QueueService.RATE_WINDOW_SECONDS]
+        )
+        return float(promote_rate), float(exit_rate)
+    
+    @staticmethod
+    def calculate_wait_time(
+        position_waiting: int,
+        position_active: int,
+        promote_rate: float = 0.0,
+        exit_rate: float = 0.0
+    ) -> int:
+        """
+        依位置與觀測到的吞吐率計算預估等待時間（秒），不存取 Redis
+        
+        吞吐率來自佇列廣播的狀態；尚未觀測到吞吐量時改用固定估計值。
         """
         if position_active >= 0:
+            if exit_rate > 0:
+                return math.ceil(position_active / exit_rate)
             return position_active * 30
         
         if position_waiting >= 0:
-            active_count = QueueService.get_active_count(product_id)
+            if promote_rate > 0:
+                return math.ceil((position_waiting + 1) / promote_rate)
             waiting_ahead = position_waiting
             time_to_active = (waiting_ahead // QueueService.ACTIVE_QUEUE_MAX_SIZE) * 10
             time_in_active = QueueService.ACTIVE_QUEUE_MAX_SIZE * 30
@@ -3,29 +3,49 @@
 """
 import uuid
 from typing import Optional
-from app.core.redis import get_redis_client
+from app.core.metrics import instrument_redis
+from app.core.redis import get_async_redis_client, hash_tag
 from app.models.session import Session
 
 
+@instrument_redis("SessionService")
 class SessionService:
     """會話服務類別"""
     
+    SESSION_TTL_SECONDS = 86400
+    
     @staticmethod
-    def _get_session_key(session_id: str) -> str:
-        """取得會話 Redis key"""
-        return f"session:{session_id}"
+    def _get_session_key(session_id: str, product_id: Optional[str] = None) -> str:
+        """
+        取得會話 Redis key
+        
+        已綁定商品的會話以商品 ID 為 hash tag，與該商品的佇列同一個 slot，
+        讓佇列的 Lua 腳本可以在 Redis Cluster 上一併更新會話。
+        """
+        if product_id is None:
+            return f"session:{session_id}"
+        return f"session:{hash_tag(product_id)}:{session_id}"
     
     @staticmethod
-    def create_session(turnstile_verified: bool = False) -> str:
+    def generate_session_id() -> str:
+        """產生新的會話 ID"""
+        return str(uuid.uuid4())
+    
+    @staticmethod
+    async def create_session(turnstile_verified: bool = False, product_id: Optional[str] = None) -> str:
         """
         建立新會話
         
+        Args:
+            turnstile_verified: 是否已通過 Turnstile 驗證
+            product_id: 會話所屬商品（決定會話 key 的 slot）
+        
         Returns:
             str: 會話 ID
         """
-        session_id = str(uuid.uuid4())
-        redis_client = get_redis_client()
-        session_key = SessionService._get_session_key(session_id)
+        session_id = SessionService.generate_session_id()
+        redis_client = get_async_redis_client()
+        session_key = SessionService._get_session_key(session_id, product_id)
         
         import time
         current_timestamp = int(time.time() * 1000)
@@ -35,22 +55,24 @@ class SessionService:
             "verified_at": str(current_timestamp) if turnstile_verified else "",
             "queue_status": "waiting"
         }
+        if product_id is not None:
+            session_data["product_id"] = product_id
         
-        redis_client.hset(session_key, mapping=session_data)
-        redis_client.expire(session_key, 86400)
+        await redis_client.hset(session_key, mapping=session_data)
+        await redis_client.expire(session_key, SessionService.SESSION_TTL_SECONDS)
         
         return session_id
     
     @staticmethod
-    def get_session(session_id: str) -> Optional[Session]:
-        """取得會話資訊"""
-        redis_client = get_redis_client()
-        session_key = SessionService._get_session_key(session_id)
+    async def get_session(session_id: str, product_id: Optional[str] = None) -> Optional[Session]:
+        """取得會話資訊（product_id 為會話所屬商品）"""
+        redis_client = get_async_redis_client()
+        session_key = SessionService._get_session_key(session_id, product_id)
         
-        if not redis_client.exists(session_key):
+        if not await redis_client.exists(session_key):
             return None
         
-        session_data = redis_client.hgetall(session_key)
+        session_data = await redis_client.hgetall(session_key)
         
         return Session(
             session_id=session_id,
@@ -65,13 +87,19 @@ class SessionService:
         )
     
     @staticmethod
-    def update_session(session_id: str, **kwargs):
-        """更新會話資訊"""
-        redis_client = get_redis_client()
-        session_key = SessionService._get_session_key(session_id)
+    async def get_queue_status(session_id: str, product_id: Optional[str] = None) -> Optional[str]:
+        """取得會話的佇列狀態（單一指令；會話不存在時為 None）"""
+        redis_client = get_async_redis_client()
+        return await redis_client.hget(SessionService._get_session_key(session_id, product_id), "queue_status")
+    
+    @staticmethod
+    async def update_session(session_id: str, product_id: Optional[str] = None, **kwargs):
+        """更新會話資訊（product_id 為會話所屬商品）"""
+        redis_client = get_async_redis_client()
+        session_key = SessionService._get_session_key(session_id, product_id)
         
-        if not redis_client.exists(session_key):
+        if not await redis_client.exists(session_key):
             return
         
         update_data = {k: str(v) if v is not None else "" for k, v in kwargs.items()}
-        redis_client.hset(session_key, mapping=update_data)
+        await redis_client.hset(session_key, mapping=update_data)
@@ -0,0 +1,107 @@
+"""
+售完狀態
+
+每個行程在記憶體中保存已售完的商品，加入佇列、查詢狀態、SSE 與購買可直接回應售完，
+不再驗證 Turnstile 或存取 Redis。
+售完旗標由購買腳本在庫存歸零時原子地設定並發布到 InventoryService.SOLD_OUT_CHANNEL；
+重設庫存時 ProductService 發布商品快取失效通知，各副本收到後重新讀取旗標。
+訂閱（重新）建立時一律從 Redis 同步，避免錯過通知。
+"""
+import asyncio
+import json
+import logging
+from typing import List, Optional, Set
+from app.core.redis import get_async_pubsub_client
+from app.services.inventory_service import InventoryService
+from app.services.product_service import ProductService
+
+logger = logging.getLogger(__name__)
+
+
+class SoldOutRegistry:
+    """售完狀態（記憶體旗標，由 pub/sub 同步）"""
+    
+    def __init__(self):
+        """初始化售完狀態"""
+        self._sold_out: Set[str] = set()
+        self._listener_task: Optional[asyncio.Task] = None
+        self.stats = {
+            "sold_out_events": 0,
+            "syncs": 0
+        }
+    
+    def is_sold_out(self, product_id: str) -> bool:
+        """商品是否已售完"""
+        return product_id in self._sold_out
+    
+    def get_sold_out(self) -> List[str]:
+        """取得已售完的商品 ID"""
+        return sorted(self._sold_out)
+    
+    def mark(self, product_id: str):
+        """標記商品已售完"""
+        if product_id not in self._sold_out:
+            logger.info(f"商品 {product_id} 已售完")
+        self._sold_out.add(product_id)
+    
+    async def sync(self, product_id: Optional[str] = None):
+        """從 Redis 重新讀取售完旗標（product_id 為 None 表示全部商品）"""
+        product_ids = [product_id] if product_id is not None else await ProductService.get_product_ids()
+        sold_out = await InventoryService.get_sold_out(product_ids)
+        
+        if product_id is None:
+            self._sold_out = sold_out
+        elif sold_out:
+            self._sold_out.add(product_id)
+        else:
+            self._sold_out.discard(product_id)
+        self.stats["syncs"] += 1
+    
+    async def _listen(self):
+        """訂閱售完與商品快取失效通知（斷線時自動重連並重新同步）"""
+        while True:
+            pubsub = get_async_pubsub_client().pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(InventoryService.SOLD_OUT_CHANNEL, ProductService.CACHE_INVALIDATION_CHANNEL)
+                await self.sync()
+                async for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    if message["channel"] == InventoryService.SOLD_OUT_CHANNEL:
+                        self.stats["sold_out_events"] += 1
+                        self.mark(message["data"])
+                        continue
+                    try:
+                        product_id = json.loads(message["data"]).get("product_id")
+                    except (ValueError, AttributeError):
+                        product_id = None
+                    await self.sync(product_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"售完狀態訂閱錯誤: {str(e)}")
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()
+    
+    def start(self) -> asyncio.Task:
+        """啟動售完狀態訂閱任務"""
+        if self._listener_task is None or self._listener_task.done():
+            self._listener_task = asyncio.create_task(self._listen())
+        return self._listener_task
+    
+    async def stop(self):
+        """停止售完狀態訂閱任務並清除記憶體旗標"""
+        self._sold_out.clear()
+        if self._listener_task is None:
+            return
+        
+        self._listener_task.cancel()
+        try:
+            await self._listener_task
+        except asyncio.CancelledError:
+            pass
+        self._listener_task = None
+
+
+sold_out_registry = SoldOutRegistry()
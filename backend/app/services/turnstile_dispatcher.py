@@ -0,0 +1,171 @@
+"""
+Turnstile 驗證調度器
+
+搶購開始時大量加入佇列請求同時到達，每個請求不再各自等待 siteverify，
+而是排入驗證佇列，由固定數量的 worker 分批處理並限制同時進行的驗證數；
+相同 token（與 IP）的並行請求共用同一次驗證；token 為一次性，驗證成功時只有第一個請求取得成功，
+其餘視為重複送出。
+待驗證數超過門檻時立即拒絕（503 + Retry-After），讓加入佇列的延遲維持有上限。
+"""
+import asyncio
+import logging
+import math
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+from app.services.turnstile_service import TurnstileService, Verdict
+
+logger = logging.getLogger(__name__)
+
+OVERLOADED_ERROR = "VERIFICATION_OVERLOADED"
+DUPLICATE_ERROR = "DUPLICATE_TOKEN"
+
+
+class TurnstileDispatcher:
+    """Turnstile 驗證調度器"""
+    
+    def __init__(self, workers: int = 8, max_in_flight: int = 100, max_backlog: int = 5000):
+        """
+        初始化驗證調度器
+        
+        Args:
+            workers: worker 數量
+            max_in_flight: 同時進行的驗證數上限（各 worker 每批最多取 max_in_flight / workers 筆）
+            max_backlog: 待驗證數上限，超過時拒絕新的驗證請求
+        """
+        self.workers = workers
+        self.max_in_flight = max_in_flight
+        self.max_backlog = max_backlog
+        self.batch_size = max(1, math.ceil(max_in_flight / workers))
+        self._queue: Optional[asyncio.Queue] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._pending: Dict[Tuple[str, Optional[str]], asyncio.Future] = {}
+        self._worker_tasks: List[asyncio.Task] = []
+        self._avg_latency_s = 0.0
+        self.stats = {
+            "submitted": 0,
+            "coalesced": 0,
+            "duplicates": 0,
+            "rejected": 0,
+            "verified": 0,
+            "batches": 0
+        }
+    
+    def get_backlog(self) -> int:
+        """取得尚未開始驗證的請求數"""
+        return self._queue.qsize() if self._queue is not None else 0
+    
+    def get_retry_after(self) -> int:
+        """依目前待驗證數與平均驗證延遲估算建議的重試秒數"""
+        latency = self._avg_latency_s or 1.0
+        return max(1, math.ceil(self.get_backlog() * latency / self.max_in_flight))
+    
+    async def verify(self, token: str, remote_ip: Optional[str] = None) -> Verdict:
+        """
+        排入驗證佇列並等待結果
+        
+        Returns:
+            Tuple[bool, Optional[str]]: (是否驗證成功, 錯誤訊息)；
+            待驗證數超過上限時為 (False, VERIFICATION_OVERLOADED)；
+            共用他人驗證且驗證成功時為 (False, DUPLICATE_TOKEN)
+        """
+        if not token:
+            return (False, "MISSING_TOKEN")
+        
+        verdict = TurnstileService.get_cached_verdict(token, remote_ip)
+        if verdict is not None:
+            return verdict
+        
+        self.stats["submitted"] += 1
+        key = (token, remote_ip)
+        future = self._pending.get(key)
+        
+        if future is not None:
+            self.stats["coalesced"] += 1
+            # 成功只屬於第一個送出的請求，同一 token 的其他請求不能再各自加入佇列
+            verdict = await asyncio.shield(future)
+            if verdict[0]:
+                self.stats["duplicates"] += 1
+                return (False, DUPLICATE_ERROR)
+            return verdict
+        
+        self.start()
+        if self._queue.qsize() >= self.max_backlog:
+            self.stats["rejected"] += 1
+            return (False, OVERLOADED_ERROR)
+        
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        self._queue.put_nowait(key)
+        
+        # 呼叫端取消（連線中斷）時不影響共用同一驗證的其他請求
+        return await asyncio.shield(future)
+    
+    async def _verify_one(self, key: Tuple[str, Optional[str]]):
+        """驗證單一 token 並通知所有等待者"""
+        future = self._pending.get(key)
+        started = time.perf_counter()
+        
+        try:
+            async with self._semaphore:
+                verdict = await TurnstileService.verify_token(*key)
+        except Exception as e:
+            logger.error(f"Turnstile 驗證錯誤: {str(e)}")
+            verdict = (False, f"UNKNOWN_ERROR: {str(e)}")
+        finally:
+            self._pending.pop(key, None)
+        
+        elapsed = time.perf_counter() - started
+        self._avg_latency_s = elapsed if not self._avg_latency_s else 0.9 * self._avg_latency_s + 0.1 * elapsed
+        self.stats["verified"] += 1
+        
+        if future is not None and not future.done():
+            future.set_result(verdict)
+    
+    async def _worker(self):
+        """取出一批待驗證 token 並行驗證"""
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            
+            self.stats["batches"] += 1
+            try:
+                await asyncio.gather(*(self._verify_one(key) for key in batch))
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+    
+    def start(self) -> List[asyncio.Task]:
+        """啟動驗證 worker（已啟動時不重複建立）"""
+        if self._worker_tasks and not all(task.done() for task in self._worker_tasks):
+            return self._worker_tasks
+        
+        self._queue = asyncio.Queue()
+        self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        return self._worker_tasks
+    
+    async def stop(self):
+        """停止驗證 worker，尚未完成的驗證回傳 OVERLOADED 讓用戶端重試"""
+        for task in self._worker_tasks:
+            task.cancel()
+        for task in self._worker_tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._worker_tasks = []
+        
+        for future in self._pending.values():
+            if not future.done():
+                future.set_result((False, OVERLOADED_ERROR))
+        self._pending.clear()
+        self._queue = None
+
+
+turnstile_dispatcher = TurnstileDispatcher(
+    workers=int(os.getenv("TURNSTILE_DISPATCH_WORKERS", "8")),
+    max_in_flight=int(os.getenv("TURNSTILE_DISPATCH_MAX_IN_FLIGHT", "100")),
+    max_backlog=int(os.getenv("TURNSTILE_DISPATCH_MAX_BACKLOG", "5000"))
+)
@@ -1,9 +1,41 @@
 """
 Turnstile 驗證服務
+
+所有驗證共用一個於應用程式生命週期建立的長連線 HTTP 客戶端（keep-alive，
+安裝 h2 套件時使用 HTTP/2），並以 semaphore 限制同時進行的驗證數。
+同一 token 與 IP 驗證失敗的結果會短暫快取，重複送出時不再呼叫 siteverify；
+成功的結果不快取，token 為一次性，快取會讓同一次驗證在快取期間被重複使用。
+設定 TURNSTILE_VERIFIER=stub 可改用本地驗證器，以便離線進行壓力測試。
 """
+import asyncio
+import hashlib
+import importlib.util
+import logging
 import os
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
 import httpx
-from typing import Optional, Tuple
+from app.core.metrics import TURNSTILE_VERIFY_DURATION
+
+logger = logging.getLogger(__name__)
+
+Verdict = Tuple[bool, Optional[str]]
+Verifier = Callable[[str, Optional[str]], Awaitable[Verdict]]
+
+# 連線或逾時等暫時性錯誤不快取，讓使用者可立即重試
+TRANSIENT_ERRORS = ("TIMEOUT", "REQUEST_ERROR", "UNKNOWN_ERROR")
+
+_http_client: Optional[httpx.AsyncClient] = None
+_semaphore: Optional[asyncio.Semaphore] = None
+_verifier: Optional[Verifier] = None
+_verdict_cache: "OrderedDict[str, Tuple[float, Verdict]]" = OrderedDict()
+_stats: Dict[str, int] = {
+    "verifications": 0,
+    "cache_hits": 0,
+    "failures": 0,
+    "in_flight": 0
+}
 
 
 class TurnstileService:
@@ -20,16 +52,122 @@ class TurnstileService:
         )
     
     @staticmethod
-    async def verify_token(token: str, remote_ip: Optional[str] = None) -> Tuple[bool, Optional[str]]:
+    def get_max_concurrency() -> int:
+        """取得同時進行的 siteverify 請求上限"""
+        return int(os.getenv("TURNSTILE_MAX_CONCURRENCY", "100"))
+    
+    @staticmethod
+    def get_verdict_cache_seconds() -> float:
+        """取得驗證失敗結果的快取時間（秒），0 表示不快取"""
+        return float(os.getenv("TURNSTILE_VERDICT_CACHE_SECONDS", "10"))
+    
+    @staticmethod
+    def get_verdict_cache_size() -> int:
+        """取得驗證結果快取的最大筆數"""
+        return int(os.getenv("TURNSTILE_VERDICT_CACHE_SIZE", "10000"))
+    
+    @staticmethod
+    def is_http2_enabled() -> bool:
+        """是否使用 HTTP/2（需安裝 h2 套件，否則使用 HTTP/1.1 keep-alive）"""
+        return (
+            os.getenv("TURNSTILE_HTTP2", "true").lower() == "true"
+            and importlib.util.find_spec("h2") is not None
+        )
+    
+    @staticmethod
+    def _create_http_client() -> httpx.AsyncClient:
+        """建立共用的 HTTP 客戶端（連線池大小與並行上限一致）"""
+        max_connections = TurnstileService.get_max_concurrency()
+        
+        return httpx.AsyncClient(
+            timeout=httpx.Timeout(
+                float(os.getenv("TURNSTILE_TIMEOUT_SECONDS", "5")),
+                connect=float(os.getenv("TURNSTILE_CONNECT_TIMEOUT_SECONDS", "2"))
+            ),
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+                keepalive_expiry=float(os.getenv("TURNSTILE_KEEPALIVE_SECONDS", "30"))
+            ),
+            http2=TurnstileService.is_http2_enabled()
+        )
+    
+    @staticmethod
+    def _get_http_client() -> httpx.AsyncClient:
+        """取得共用的 HTTP 客戶端（未於生命週期建立時延遲建立）"""
+        global _http_client
+        if _http_client is None or _http_client.is_closed:
+            _http_client = TurnstileService._create_http_client()
+        return _http_client
+    
+    @staticmethod
+    def _get_semaphore() -> asyncio.Semaphore:
+        """取得限制並行驗證數的 semaphore"""
+        global _semaphore
+        if _semaphore is None:
+            _semaphore = asyncio.Semaphore(TurnstileService.get_max_concurrency())
+        return _semaphore
+    
+    @staticmethod
+    async def start():
+        """建立共用的 HTTP 客戶端（於應用程式啟動時呼叫）"""
+        TurnstileService._get_http_client()
+        TurnstileService._get_semaphore()
+        logger.info(
+            f"Turnstile 驗證器: {os.getenv('TURNSTILE_VERIFIER', 'cloudflare')}，"
+            f"HTTP/2: {TurnstileService.is_http2_enabled()}"
+        )
+    
+    @staticmethod
+    async def close():
+        """關閉共用的 HTTP 客戶端並清除快取（於應用程式關閉時呼叫）"""
+        global _http_client, _semaphore
+        if _http_client is not None:
+            await _http_client.aclose()
+        _http_client = None
+        _semaphore = None
+        _verdict_cache.clear()
+    
+    @staticmethod
+    def set_verifier(verifier: Optional[Verifier]):
         """
-        驗證 Turnstile token
+        替換驗證器（壓力測試或測試用）
         
-        Returns:
-            Tuple[bool, Optional[str]]: (是否驗證成功, 錯誤訊息)
+        Args:
+            verifier: 非同步函式 (token, remote_ip) -> (是否驗證成功, 錯誤訊息)；None 表示依設定選擇
         """
-        if not token:
-            return (False, "MISSING_TOKEN")
+        global _verifier
+        _verifier = verifier
+        _verdict_cache.clear()
+    
+    @staticmethod
+    def get_verifier() -> Verifier:
+        """取得目前使用的驗證器"""
+        if _verifier is not None:
+            return _verifier
+        if os.getenv("TURNSTILE_VERIFIER", "cloudflare").lower() == "stub":
+            return TurnstileService.stub_verify
+        return TurnstileService._siteverify
+    
+    @staticmethod
+    async def stub_verify(token: str, remote_ip: Optional[str] = None) -> Verdict:
+        """
+        本地驗證器（不連線 Cloudflare）
+        
+        以 fail 開頭的 token 視為驗證失敗，其餘皆通過；
+        可用 TURNSTILE_STUB_LATENCY_MS 模擬 siteverify 的延遲。
+        """
+        latency_ms = float(os.getenv("TURNSTILE_STUB_LATENCY_MS", "0"))
+        if latency_ms > 0:
+            await asyncio.sleep(latency_ms / 1000)
         
+        if token.startswith("fail"):
+            return (False, "invalid-input-response")
+        return (True, None)
+    
+    @staticmethod
+    async def _siteverify(token: str, remote_ip: Optional[str] = None) -> Verdict:
+        """呼叫 Cloudflare siteverify 驗證 token"""
         secret_key = TurnstileService.get_secret_key()
         data = {
             "secret": secret_key,
@@ -40,24 +178,99 @@ class TurnstileService:
             data["remoteip"] = remote_ip
         
         try:
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                response = await client.post(
+            async with TurnstileService._get_semaphore():
+                response = await TurnstileService._get_http_client().post(
                     TurnstileService.TURNSTILE_VERIFY_URL,
                     data=data
                 )
-                response.raise_for_status()
-                result = response.json()
-                
-                if result.get("success"):
-                    return (True, None)
-                else:
-                    error_codes = result.get("error-codes", [])
-                    error_msg = ", ".join(error_codes) if error_codes else "VERIFICATION_FAILED"
-                    return (False, error_msg)
-                    
+            response.raise_for_status()
+            result = response.json()
+            
+            if result.get("success"):
+                return (True, None)
+            else:
+                error_codes = result.get("error-codes", [])
+                error_msg = ", ".join(error_codes) if error_codes else "VERIFICATION_FAILED"
+                return (False, error_msg)
+        
         except httpx.TimeoutException:
             return (False, "TIMEOUT")
         except httpx.RequestError as e:
             return (False, f"REQUEST_ERROR: {str(e)}")
         except Exception as e:
             return (False, f"UNKNOWN_ERROR: {str(e)}")
+    
+    @staticmethod
+    def _get_cache_key(token: str, remote_ip: Optional[str]) -> str:
+        """取得驗證結果快取 key（token 雜湊與 IP，token 換 IP 使用時需重新驗證）"""
+        return hashlib.sha256(f"{token}|{remote_ip or ''}".encode("utf-8")).hexdigest()
+    
+    @staticmethod
+    def _get_cached_verdict(cache_key: str) -> Optional[Verdict]:
+        """取得尚未過期的驗證結果"""
+        entry = _verdict_cache.get(cache_key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del _verdict_cache[cache_key]
+            return None
+        return entry[1]
+    
+    @staticmethod
+    def get_cached_verdict(token: str, remote_ip: Optional[str] = None) -> Optional[Verdict]:
+        """取得同一 token 與 IP 已快取的驗證失敗結果（無快取時為 None）"""
+        verdict = TurnstileService._get_cached_verdict(TurnstileService._get_cache_key(token, remote_ip))
+        if verdict is not None:
+            _stats["cache_hits"] += 1
+        return verdict
+    
+    @staticmethod
+    def _store_verdict(cache_key: str, verdict: Verdict):
+        """快取驗證失敗結果（成功與暫時性錯誤不快取）"""
+        ttl = TurnstileService.get_verdict_cache_seconds()
+        if ttl <= 0 or verdict[0] or (verdict[1] is not None and verdict[1].startswith(TRANSIENT_ERRORS)):
+            return
+        
+        _verdict_cache[cache_key] = (time.monotonic() + ttl, verdict)
+        _verdict_cache.move_to_end(cache_key)
+        while len(_verdict_cache) > TurnstileService.get_verdict_cache_size():
+            _verdict_cache.popitem(last=False)
+    
+    @staticmethod
+    async def verify_token(token: str, remote_ip: Optional[str] = None) -> Tuple[bool, Optional[str]]:
+        """
+        驗證 Turnstile token
+        
+        Returns:
+            Tuple[bool, Optional[str]]: (是否驗證成功, 錯誤訊息)
+        """
+        if not token:
+            return (False, "MISSING_TOKEN")
+        
+        verdict = TurnstileService.get_cached_verdict(token, remote_ip)
+        if verdict is not None:
+            return verdict
+        cache_key = TurnstileService._get_cache_key(token, remote_ip)
+        
+        _stats["verifications"] += 1
+        _stats["in_flight"] += 1
+        started = time.perf_counter()
+        verdict = (False, "UNKNOWN_ERROR")
+        try:
+            verdict = await TurnstileService.get_verifier()(token, remote_ip)
+        finally:
+            _stats["in_flight"] -= 1
+            TURNSTILE_VERIFY_DURATION.observe(
+                time.perf_counter() - started,
+                ("success" if verdict[0] else "failure",)
+            )
+        
+        if not verdict[0]:
+            _stats["failures"] += 1
+        TurnstileService._store_verdict(cache_key, verdict)
+        return verdict
+    
+    @staticmethod
+    def get_stats() -> Dict[str, int]:
+        """取得驗證次數、快取命中與進行中的驗證數"""
+        return {**_stats, "cached_verdicts": len(_verdict_cache)}
@@ -0,0 +1,122 @@
+"""
+商品佇列租約
+
+多個應用程式副本（或 uvicorn worker）同時執行佇列管理任務時，
+每個商品的佇列只由持有該商品 Redis 租約的 worker 管理；
+持有者停止續約後，其他 worker 最多在一個租約週期內接手。
+"""
+import logging
+import os
+import socket
+import uuid
+from typing import Dict, List, Optional, Set
+from app.core.redis import get_async_redis_client, hash_tag
+from app.core.scripts import run_script
+
+logger = logging.getLogger(__name__)
+
+
+class ProductLeaseManager:
+    """商品佇列租約管理器"""
+    
+    def __init__(self, ttl_ms: int = 10000):
+        """
+        初始化租約管理器
+        
+        Args:
+            ttl_ms: 租約有效時間（毫秒），需大於佇列管理任務的執行週期
+        """
+        self.ttl_ms = ttl_ms
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._owned: Set[str] = set()
+        self.stats = {
+            "acquired": 0,
+            "renewed": 0,
+            "lost": 0,
+            "released": 0
+        }
+    
+    @staticmethod
+    def _get_lease_key(product_id: str) -> str:
+        """取得商品租約 Redis key"""
+        return f"queue:lease:product:{hash_tag(product_id)}"
+    
+    async def acquire(self, product_id: str) -> bool:
+        """
+        取得或續約商品租約
+        
+        Returns:
+            bool: True 表示本 worker 負責管理此商品
+        """
+        result = await run_script(
+            "acquire_lease",
+            keys=[self._get_lease_key(product_id)],
+            args=[self.worker_id, self.ttl_ms]
+        )
+        
+        if result == 1:
+            self.stats["acquired"] += 1
+            self._owned.add(product_id)
+            logger.info(f"worker {self.worker_id} 取得商品 {product_id} 的佇列管理租約")
+            return True
+        
+        if result == 2:
+            self.stats["renewed"] += 1
+            self._owned.add(product_id)
+            return True
+        
+        if product_id in self._owned:
+            self.stats["lost"] += 1
+            self._owned.discard(product_id)
+            logger.warning(f"worker {self.worker_id} 失去商品 {product_id} 的佇列管理租約")
+        
+        return False
+    
+    async def release(self, product_id: str):
+        """釋放商品租約（僅在仍由本 worker 持有時）"""
+        await run_script(
+            "release_lease",
+            keys=[self._get_lease_key(product_id)],
+            args=[self.worker_id]
+        )
+        if product_id in self._owned:
+            self.stats["released"] += 1
+            self._owned.discard(product_id)
+    
+    async def release_all(self):
+        """釋放本 worker 持有的所有租約，讓其他 worker 立即接手"""
+        for product_id in list(self._owned):
+            await self.release(product_id)
+    
+    def get_owned_products(self) -> List[str]:
+        """取得本 worker 目前管理的商品"""
+        return sorted(self._owned)
+    
+    async def get_lease_owners(self, product_ids: List[str]) -> Dict[str, Dict[str, Optional[object]]]:
+        """
+        查詢各商品租約的持有者與剩餘時間（一次往返）
+        
+        Returns:
+            Dict[str, Dict[str, Optional[object]]]: 商品 ID -> {owner, ttl_ms}
+        """
+        redis_client = get_async_redis_client()
+        pipe = redis_client.pipeline(transaction=False)
+        for product_id in product_ids:
+            lease_key = self._get_lease_key(product_id)
+            pipe.get(lease_key)
+            pipe.pttl(lease_key)
+        results = await pipe.execute()
+        
+        owners = {}
+        for index, product_id in enumerate(product_ids):
+            owner, ttl_ms = results[index * 2], results[index * 2 + 1]
+            owners[product_id] = {
+                "owner": owner,
+                "ttl_ms": ttl_ms if owner else None
+            }
+        return owners
+
+
+product_lease_manager = ProductLeaseManager(
+    ttl_ms=int(os.getenv("QUEUE_MANAGER_LEASE_MS", "10000"))
+)
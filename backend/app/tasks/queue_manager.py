@@ -1,63 +1,266 @@
 """
 佇列管理後台任務
-定期從 queue:waiting 移入 queue:active
+從 queue:waiting 移入 queue:active，移除超過購買時限的使用者；商品售完後改為分批清空佇列
+
+購買完成、搖滾區有空位時的加入等事件以 Redis pub/sub 喚醒所有 worker 的佇列管理任務
+（只有持有租約的 worker 會處理該商品），空出的名額立即遞補並廣播佇列狀態（購買腳本已在
+同一次往返內遞補，喚醒後只需廣播）；沒有事件時改以自適應間隔輪詢，並在最近的購買期限到期時醒來。
 """
 import asyncio
 import logging
+import os
+import time
+from typing import Dict, Optional, Set
+from app.core.metrics import QUEUE_MANAGER_BACKLOG, QUEUE_MANAGER_TICK_DURATION
+from app.core.redis import get_async_pubsub_client
 from app.services.queue_service import QueueService
 from app.services.product_service import ProductService
+from app.services.queue_broadcaster import queue_broadcaster
+from app.services.sold_out import sold_out_registry
+from app.tasks.product_lease import product_lease_manager
 
 logger = logging.getLogger(__name__)
 
+_queue_manager_task: Optional[asyncio.Task] = None
 
-async def queue_manager_task():
-    """佇列管理任務：定期從排隊區移入搖滾區，移除超時使用者"""
-    import time
-    from app.core.redis import get_redis_client
-    from app.services.session_service import SessionService
+
+class QueueScheduler:
+    """佇列管理任務排程器：事件喚醒與自適應閒置間隔"""
     
-    while True:
+    WAKEUP_CHANNEL = "queue:wakeup"
+    
+    def __init__(self, min_interval_ms: int = 50, max_interval_ms: int = 3000):
+        """
+        初始化排程器
+        
+        Args:
+            min_interval_ms: 兩次週期的最短間隔（合併密集事件）
+            max_interval_ms: 閒置時的最長間隔（亦為佇列狀態廣播的最長間隔），需小於租約有效時間
+        """
+        self.min_interval = min_interval_ms / 1000
+        self.max_interval = max_interval_ms / 1000
+        self.interval = self.min_interval
+        self._wakeup: Optional[asyncio.Event] = None
+        self._last_published: Dict[str, float] = {}
+        self._dirty: Set[str] = set()
+        self._listener_task: Optional[asyncio.Task] = None
+        self.stats = {
+            "ticks": 0,
+            "wakeups": 0,
+            "last_tick_ms": 0.0,
+            "backlog": 0
+        }
+    
+    def _get_wakeup_event(self) -> asyncio.Event:
+        """取得喚醒事件（延遲建立，綁定目前的事件迴圈）"""
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        return self._wakeup
+    
+    def wake(self, product_id: str):
+        """喚醒本行程的佇列管理任務（該商品下個週期必定廣播，例如購買腳本已自行遞補空位）"""
+        self.stats["wakeups"] += 1
+        self._dirty.add(product_id)
+        self._get_wakeup_event().set()
+    
+    async def wait(self, timeout: float):
+        """等待事件喚醒或逾時"""
+        event = self._get_wakeup_event()
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        event.clear()
+    
+    def next_interval(self, busy: bool, next_deadline: Optional[int] = None) -> float:
+        """
+        計算下次週期前的等待時間
+        
+        有處理到使用者時回到最短間隔，閒置時逐次加倍至最長間隔；
+        有購買期限即將到期時不晚於該期限醒來。
+        """
+        if busy:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * 2, self.max_interval)
+        
+        interval = self.interval
+        if next_deadline is not None:
+            until_deadline = (next_deadline - time.time() * 1000) / 1000
+            interval = min(interval, max(until_deadline, self.min_interval))
+        return interval
+    
+    def should_publish(self, product_id: str, changed: bool) -> bool:
+        """佇列有變動時立即廣播，否則每個最長間隔廣播一次"""
+        now = time.monotonic()
+        if changed or now - self._last_published.get(product_id, 0) >= self.max_interval:
+            self._last_published[product_id] = now
+            return True
+        return False
+    
+    async def notify(self, product_id: str):
+        """發布佇列變動事件，喚醒持有該商品租約的佇列管理任務（失敗時由閒置輪詢補上）"""
         try:
-            products = ProductService.get_all_products()
-            redis_client = get_redis_client()
-            current_time = int(time.time() * 1000)
+            await get_async_pubsub_client().publish(self.WAKEUP_CHANNEL, product_id)
+        except Exception as e:
+            logger.warning(f"佇列喚醒事件發布失敗: {str(e)}")
+    
+    async def tick(self) -> float:
+        """
+        處理本 worker 持有租約的所有商品一次
+        
+        Returns:
+            float: 下次週期前的等待時間（秒）
+        """
+        started = time.perf_counter()
+        busy = False
+        backlog = 0
+        next_deadline: Optional[int] = None
+        dirty, self._dirty = self._dirty, set()
+        
+        for product_id in await ProductService.get_product_ids():
+            if not await product_lease_manager.acquire(product_id):
+                continue
+            
+            if sold_out_registry.is_sold_out(product_id):
+                # 售完：不再晉升，分批清空佇列，每週期一批
+                drained, remaining = await QueueService.drain(product_id)
+                if drained > 0:
+                    logger.info(f"商品 {product_id} 已售完: 移除 {drained} 位排隊中的使用者，剩餘 {remaining} 位")
+                busy = busy or remaining > 0
+                if self.should_publish(product_id, drained > 0 or product_id in dirty):
+                    await queue_broadcaster.publish_queue_state(product_id)
+                backlog += remaining
+                continue
             
-            for product in products:
-                active_key = f"queue:active:product:{product.id}"
-                active_members = redis_client.zrange(active_key, 0, -1, withscores=True)
-                removed_count = 0
-                
-                for member, score in active_members:
-                    session_id = member
-                    time_in_active = current_time - int(score)
-                    max_time_in_active = 2 * 60 * 1000
-                    
-                    if time_in_active > max_time_in_active:
-                        logger.info(f"商品 {product.id}: 使用者 {session_id} 在搖滾區超過 2 分鐘未購買，自動移除")
-                        QueueService.remove_from_active(product.id, session_id)
-                        SessionService.update_session(
-                            session_id,
-                            queue_status="expired"
-                        )
-                        removed_count += 1
-                
-                if removed_count > 0:
-                    logger.info(f"商品 {product.id}: 移除了 {removed_count} 位超過時限的使用者")
-                
-                moved_count = QueueService.move_to_active(product.id)
-                
-                if moved_count > 0:
-                    logger.info(f"商品 {product.id}: 從排隊區移入 {moved_count} 人到搖滾區")
+            expired_sessions, product_deadline = await QueueService.expire_active(product_id)
+            if expired_sessions:
+                logger.info(f"商品 {product_id}: 移除了 {len(expired_sessions)} 位超過購買時限的使用者")
             
-            await asyncio.sleep(3)
+            compacted_count = await QueueService.compact(product_id)
+            if compacted_count > 0:
+                logger.info(f"商品 {product_id}: 移除排隊區前段 {compacted_count} 個已失效的排隊號碼")
             
+            moved_count = await QueueService.move_to_active(product_id)
+            if moved_count > 0:
+                logger.info(f"商品 {product_id}: 從排隊區移入 {moved_count} 人到搖滾區")
+            
+            await QueueService.update_rates(product_id, moved_count)
+            
+            changed = bool(expired_sessions or compacted_count or moved_count)
+            busy = busy or changed
+            if self.should_publish(product_id, changed or product_id in dirty):
+                snapshot = await queue_broadcaster.publish_queue_state(product_id)
+                backlog += snapshot["total_in_waiting"]
+            else:
+                backlog += await QueueService.get_waiting_count(product_id, stale_ok=True)
+            
+            if product_deadline is not None and (next_deadline is None or product_deadline < next_deadline):
+                next_deadline = product_deadline
+        
+        elapsed = time.perf_counter() - started
+        QUEUE_MANAGER_TICK_DURATION.observe(elapsed)
+        QUEUE_MANAGER_BACKLOG.set(backlog)
+        self.stats["ticks"] += 1
+        self.stats["last_tick_ms"] = round(elapsed * 1000, 3)
+        self.stats["backlog"] = backlog
+        
+        return self.next_interval(busy, next_deadline)
+    
+    async def _listen(self):
+        """訂閱佇列喚醒頻道（斷線時自動重連）"""
+        while True:
+            pubsub = get_async_pubsub_client().pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(self.WAKEUP_CHANNEL)
+                async for message in pubsub.listen():
+                    if message.get("type") == "message":
+                        self.wake(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"佇列喚醒訂閱錯誤: {str(e)}")
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()
+    
+    def start(self) -> asyncio.Task:
+        """啟動喚醒事件訂閱任務"""
+        if self._listener_task is None or self._listener_task.done():
+            self._listener_task = asyncio.create_task(self._listen())
+        return self._listener_task
+    
+    async def stop(self):
+        """停止喚醒事件訂閱任務"""
+        if self._listener_task is None:
+            return
+        
+        self._listener_task.cancel()
+        try:
+            await self._listener_task
+        except asyncio.CancelledError:
+            pass
+        self._listener_task = None
+        self._wakeup = None
+
+
+queue_scheduler = QueueScheduler(
+    min_interval_ms=int(os.getenv("QUEUE_MANAGER_MIN_INTERVAL_MS", "50")),
+    max_interval_ms=min(
+        int(os.getenv("QUEUE_MANAGER_MAX_INTERVAL_MS", "3000")),
+        product_lease_manager.ttl_ms // 3
+    )
+)
+
+
+async def notify_queue_change(product_id: str):
+    """通知佇列管理任務商品佇列有變動（購買完成、加入時搖滾區可能有空位）"""
+    await queue_scheduler.notify(product_id)
+
+
+async def queue_manager_task():
+    """佇列管理任務：事件喚醒或自適應間隔執行，移入搖滾區並移除超時使用者（僅處理本 worker 持有租約的商品）"""
+    while True:
+        try:
+            interval = await queue_scheduler.tick()
+            await asyncio.sleep(queue_scheduler.min_interval)
+            await queue_scheduler.wait(max(interval - queue_scheduler.min_interval, 0))
+        
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
             logger.error(f"佇列管理任務錯誤: {str(e)}")
-            await asyncio.sleep(3)
+            await asyncio.sleep(queue_scheduler.max_interval)
 
 
-def start_queue_manager():
+def start_queue_manager() -> asyncio.Task:
     """啟動佇列管理任務"""
-    import asyncio
-    loop = asyncio.get_event_loop()
-    loop.create_task(queue_manager_task())
+    global _queue_manager_task
+    
+    queue_scheduler.start()
+    if _queue_manager_task is None or _queue_manager_task.done():
+        _queue_manager_task = asyncio.create_task(queue_manager_task())
+    
+    return _queue_manager_task
+
+
+async def stop_queue_manager():
+    """停止佇列管理任務"""
+    global _queue_manager_task
+    
+    await queue_scheduler.stop()
+    
+    if _queue_manager_task is None:
+        return
+    
+    _queue_manager_task.cancel()
+    try:
+        await _queue_manager_task
+    except asyncio.CancelledError:
+        pass
+    _queue_manager_task = None
+    
+    try:
+        await product_lease_manager.release_all()
+    except Exception as e:
+        logger.error(f"釋放佇列管理租約失敗: {str(e)}")
@@ -0,0 +1,10 @@
+"""
+搶購流程壓力測試套件
+
+以 stub Turnstile 驗證器對本機 Redis（或 fakeredis）模擬完整的搶購：
+依到達曲線加入佇列、以 SSE 或輪詢等待、進入搖滾區後購買，
+並將各端點延遲、Redis 指令速率、晉升吞吐量與超賣檢查存成 JSON 供不同 commit 比較。
+    
+    python -m benchmarks drop --users 10000 --curve spike
+    python -m benchmarks compare results/before.json results/after.json
+"""
@@ -0,0 +1,95 @@
+"""
+壓力測試命令列
+    
+    python -m benchmarks drop [選項]             執行搶購模擬並將結果存成 JSON
+    python -m benchmarks compare 基準.json 結果.json  比較兩次結果
+"""
+import argparse
+import asyncio
+import json
+import subprocess
+import sys
+import time
+from pathlib import Path
+from benchmarks.arrivals import CURVES
+from benchmarks.drop import DropConfig, DropSimulation
+from benchmarks.metrics import compare_results
+
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+
+def _git_commit() -> str:
+    """取得目前 commit（非 git 目錄時為 unknown）"""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def _build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="E-Shield 搶購流程壓力測試")
+    commands = parser.add_subparsers(dest="command", required=True)
+    
+    drop = commands.add_parser("drop", help="執行搶購模擬")
+    defaults = DropConfig()
+    drop.add_argument("--users", type=int, default=defaults.users)
+    drop.add_argument("--arrival-seconds", type=float, default=defaults.arrival_seconds)
+    drop.add_argument("--curve", choices=CURVES, default=defaults.curve)
+    drop.add_argument("--stock", type=int, default=defaults.stock)
+    drop.add_argument("--product-id")
+    drop.add_argument("--sse-ratio", type=float, default=defaults.sse_ratio)
+    drop.add_argument("--purchase-ratio", type=float, default=defaults.purchase_ratio)
+    drop.add_argument("--poll-interval", type=float, default=defaults.poll_interval)
+    drop.add_argument("--max-wait-seconds", type=float, default=defaults.max_wait_seconds)
+    drop.add_argument("--sellout-grace-seconds", type=float, default=defaults.sellout_grace_seconds)
+    drop.add_argument("--turnstile-latency-ms", type=float, default=defaults.turnstile_latency_ms)
+    drop.add_argument("--base-url", help="已啟動的 API 位址（需設定 TURNSTILE_VERIFIER=stub）")
+    drop.add_argument("--redis-url", default=defaults.redis_url)
+    drop.add_argument("--server-workers", type=int, default=defaults.server_workers)
+    drop.add_argument("--max-connections", type=int)
+    drop.add_argument("--keep-data", action="store_true")
+    drop.add_argument("--seed", type=int, default=defaults.seed)
+    drop.add_argument("--output", type=Path, help="結果 JSON 路徑（預設 benchmarks/results/<時間>-<commit>.json）")
+    drop.add_argument("--baseline", type=Path, help="與此結果比較")
+    
+    compare = commands.add_parser("compare", help="比較兩次結果")
+    compare.add_argument("baseline", type=Path)
+    compare.add_argument("current", type=Path)
+    return parser
+
+
+def main(argv=None) -> int:
+    args = _build_parser().parse_args(argv)
+    
+    if args.command == "compare":
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+        current = json.loads(args.current.read_text(encoding="utf-8"))
+        print("\n".join(compare_results(baseline, current)))
+        return 0 if current["oversell"]["ok"] else 1
+    
+    options = {
+        key: value for key, value in vars(args).items()
+        if key in DropConfig.model_fields and value is not None
+    }
+    result = asyncio.run(DropSimulation(DropConfig(**options)).run())
+    result["git_commit"] = _git_commit()
+    result["started_at"] = int(time.time())
+    
+    output = args.output or RESULTS_DIR / f"{time.strftime('%Y%m%d-%H%M%S')}-{result['git_commit']}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+    
+    print(json.dumps({key: result[key] for key in ("users", "endpoints", "redis", "promotion", "oversell")}, ensure_ascii=False, indent=2))
+    print(f"結果已儲存: {output}")
+    
+    if args.baseline:
+        print("\n".join(compare_results(json.loads(args.baseline.read_text(encoding="utf-8")), result)))
+    
+    return 0 if result["oversell"]["ok"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,51 @@
+"""
+到達曲線
+
+產生每位模擬使用者相對於搶購開始的到達時間（秒）。
+"""
+import math
+import random
+from typing import List
+
+CURVES = ("burst", "uniform", "ramp", "spike", "poisson")
+
+
+def arrival_offsets(users: int, duration: float, curve: str = "spike", seed: int = 0) -> List[float]:
+    """
+    產生到達時間
+    
+    Args:
+        users: 使用者數
+        duration: 到達期間（秒）
+        curve: burst（全部同時）、uniform（均勻）、ramp（線性遞增）、
+            spike（八成集中在前一成時間）、poisson（固定速率的隨機到達）
+        seed: 亂數種子（相同參數產生相同結果，方便比較）
+    
+    Returns:
+        List[float]: 排序後的到達時間
+    """
+    if curve not in CURVES:
+        raise ValueError(f"未知的到達曲線: {curve}（可用: {', '.join(CURVES)}）")
+    
+    rng = random.Random(seed)
+    
+    if curve == "burst" or duration <= 0:
+        return [0.0] * users
+    
+    if curve == "uniform":
+        offsets = [duration * index / users for index in range(users)]
+    elif curve == "ramp":
+        # 到達速率由 0 線性增加，累積分布為 (t / duration)^2
+        offsets = [duration * math.sqrt(index / users) for index in range(users)]
+    elif curve == "spike":
+        head = int(users * 0.8)
+        offsets = [rng.uniform(0, duration * 0.1) for _ in range(head)]
+        offsets += [rng.uniform(duration * 0.1, duration) for _ in range(users - head)]
+    else:
+        rate = users / duration
+        offsets, elapsed = [], 0.0
+        for _ in range(users):
+            elapsed += rng.expovariate(rate)
+            offsets.append(min(elapsed, duration))
+    
+    return sorted(offsets)
@@ -0,0 +1,371 @@
+"""
+搶購流程模擬
+
+每位模擬使用者依到達曲線加入佇列（不同的 X-Real-IP，stub Turnstile token），
+以 SSE 或輪詢等待進入搖滾區後購買；庫存售完後等待一段時間即結束模擬。
+未指定 base_url 時會以 TURNSTILE_VERIFIER=stub 啟動本機 uvicorn。
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, List, Optional
+import httpx
+import redis.asyncio as aioredis
+from redis.exceptions import ResponseError
+from pydantic import BaseModel, Field
+from benchmarks.arrivals import arrival_offsets
+from benchmarks.metrics import LatencyRecorder
+
+logger = logging.getLogger(__name__)
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+class DropConfig(BaseModel):
+    """搶購模擬設定"""
+    users: int = Field(1000, ge=1, description="模擬使用者數")
+    arrival_seconds: float = Field(10, ge=0, description="到達期間（秒）")
+    curve: str = Field("spike", description="到達曲線：burst, uniform, ramp, spike, poisson")
+    stock: int = Field(100, ge=0, description="模擬商品的庫存")
+    product_id: Optional[str] = Field(None, description="模擬商品 ID（預設每次產生新的 ID）")
+    sse_ratio: float = Field(0.5, ge=0, le=1, description="以 SSE 等待的使用者比例（其餘輪詢 /queue/status）")
+    purchase_ratio: float = Field(1.0, ge=0, le=1, description="進入搖滾區後購買的使用者比例")
+    poll_interval: float = Field(1.0, gt=0, description="輪詢間隔（秒）")
+    max_wait_seconds: float = Field(120, gt=0, description="每位使用者最長等待時間（秒）")
+    sellout_grace_seconds: float = Field(2, ge=0, description="售完後結束模擬前的等待時間（秒）")
+    turnstile_latency_ms: float = Field(0, ge=0, description="stub Turnstile 模擬延遲（毫秒）")
+    base_url: Optional[str] = Field(None, description="已啟動的 API 位址（未指定時啟動本機 uvicorn）")
+    redis_url: str = Field(default_factory=lambda: os.getenv("REDIS_URL", "redis://localhost:6379"))
+    server_workers: int = Field(1, ge=1, description="本機 uvicorn worker 數")
+    max_connections: Optional[int] = Field(None, description="HTTP 連線數上限（None 表示不限制）")
+    keep_data: bool = Field(False, description="結束後保留模擬商品與佇列資料")
+    seed: int = Field(0, description="亂數種子")
+
+
+class DropSimulation:
+    """搶購流程模擬"""
+    
+    def __init__(self, config: DropConfig):
+        self.config = config
+        self.product_id = config.product_id or f"bench-{int(time.time())}"
+        self.latency = LatencyRecorder()
+        self.counters = {
+            "joined": 0,
+            "join_rejected": 0,
+            "join_overloaded": 0,
+            "activated": 0,
+            "purchased": 0,
+            "purchase_failed": 0,
+            "sold_out_rejections": 0,
+            "timed_out": 0,
+            "not_in_queue": 0,
+            "cancelled_after_sellout": 0
+        }
+        self.sse = {"open": 0, "max_concurrent": 0, "events": 0}
+        self._activated_at: List[float] = []
+        self._sold_out: Optional[asyncio.Event] = None
+        self._rng = random.Random(config.seed)
+    
+    async def _timed(
+        self,
+        endpoint: str,
+        send: Callable[[], Awaitable[httpx.Response]]
+    ) -> Optional[httpx.Response]:
+        """送出請求並記錄延遲（連線錯誤記為失敗並回傳 None）"""
+        started = time.perf_counter()
+        try:
+            response = await send()
+        except httpx.HTTPError:
+            self.latency.record(endpoint, (time.perf_counter() - started) * 1000, ok=False)
+            return None
+        self.latency.record(endpoint, (time.perf_counter() - started) * 1000, ok=response.status_code < 400)
+        return response
+    
+    async def _listen(self, client: httpx.AsyncClient, session_id: str) -> bool:
+        """以 SSE 等待進入搖滾區"""
+        self.sse["open"] += 1
+        self.sse["max_concurrent"] = max(self.sse["max_concurrent"], self.sse["open"])
+        started = time.perf_counter()
+        first_event = True
+        
+        try:
+            async with client.stream(
+                "GET",
+                "/api/queue/stream",
+                params={"session_id": session_id, "product_id": self.product_id}
+            ) as response:
+                async for line in response.aiter_lines():
+                    if not line.startswith("data: "):
+                        continue
+                    if first_event:
+                        self.latency.record("GET /api/queue/stream (first event)", (time.perf_counter() - started) * 1000)
+                        first_event = False
+                    self.sse["events"] += 1
+                    
+                    data = json.loads(line[len("data: "):])
+                    if data.get("status") in ("active", "ready_to_purchase"):
+                        return True
+                    if "error" in data or data.get("status") in ("purchased", "expired"):
+                        self.counters["not_in_queue"] += 1
+                        return False
+        except httpx.HTTPError:
+            self.latency.record("GET /api/queue/stream (first event)", (time.perf_counter() - started) * 1000, ok=False)
+        finally:
+            self.sse["open"] -= 1
+        return False
+    
+    async def _poll(self, client: httpx.AsyncClient, session_id: str) -> bool:
+        """輪詢 /queue/status 等待進入搖滾區"""
+        while True:
+            response = await self._timed(
+                "GET /api/queue/status",
+                lambda: client.get(
+                    "/api/queue/status",
+                    params={"session_id": session_id, "product_id": self.product_id}
+                )
+            )
+            if response is not None:
+                if response.status_code == 404:
+                    self.counters["not_in_queue"] += 1
+                    return False
+                if response.status_code == 200 and response.json().get("status") in ("active", "ready_to_purchase"):
+                    return True
+            await asyncio.sleep(self.config.poll_interval)
+    
+    async def _purchase(self, client: httpx.AsyncClient, session_id: str):
+        """購買並記錄是否售完"""
+        response = await self._timed(
+            "POST /api/purchase",
+            lambda: client.post(
+                "/api/purchase",
+                json={"product_id": self.product_id, "quantity": 1, "session_id": session_id}
+            )
+        )
+        data = response.json() if response is not None and response.status_code == 200 else {}
+        
+        if data.get("success"):
+            self.counters["purchased"] += 1
+            if data.get("remaining_stock") == 0:
+                self._sold_out.set()
+        elif data.get("error") == "INSUFFICIENT_STOCK":
+            self.counters["sold_out_rejections"] += 1
+            self._sold_out.set()
+        else:
+            self.counters["purchase_failed"] += 1
+    
+    async def _user(self, client: httpx.AsyncClient, index: int, arrive_at: float):
+        """單一使用者：加入佇列、等待、購買"""
+        await asyncio.sleep(max(0.0, arrive_at - time.monotonic()))
+        headers = {"X-Real-IP": f"10.{(index >> 16) & 255}.{(index >> 8) & 255}.{index & 255}"}
+        
+        response = await self._timed(
+            "POST /api/queue/join",
+            lambda: client.post(
+                "/api/queue/join",
+                json={"product_id": self.product_id, "turnstile_token": f"bench-{index}"},
+                headers=headers
+            )
+        )
+        if response is not None and response.status_code == 503:
+            self.counters["join_overloaded"] += 1
+            return
+        data = response.json() if response is not None and response.status_code == 200 else {}
+        if not data.get("success"):
+            self.counters["join_rejected"] += 1
+            return
+        self.counters["joined"] += 1
+        
+        wait = self._listen if self._rng.random() < self.config.sse_ratio else self._poll
+        try:
+            activated = await asyncio.wait_for(wait(client, data["session_id"]), self.config.max_wait_seconds)
+        except asyncio.TimeoutError:
+            self.counters["timed_out"] += 1
+            return
+        if not activated:
+            return
+        
+        self.counters["activated"] += 1
+        self._activated_at.append(time.monotonic())
+        
+        if self._rng.random() < self.config.purchase_ratio:
+            await self._purchase(client, data["session_id"])
+    
+    def _start_server(self) -> subprocess.Popen:
+        """以 stub Turnstile 啟動本機 uvicorn"""
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        
+        self.config.base_url = f"http://127.0.0.1:{port}"
+        env = {
+            **os.environ,
+            "REDIS_URL": self.config.redis_url,
+            "TURNSTILE_VERIFIER": "stub",
+            "TURNSTILE_STUB_LATENCY_MS": str(self.config.turnstile_latency_ms),
+            "LOG_LEVEL": os.getenv("LOG_LEVEL", "WARNING")
+        }
+        return subprocess.Popen(
+            [
+                sys.executable, "-m", "uvicorn", "app.main:app",
+                "--host", "127.0.0.1",
+                "--port", str(port),
+                "--workers", str(self.config.server_workers),
+                "--log-level", "warning"
+            ],
+            cwd=BACKEND_DIR,
+            env=env
+        )
+    
+    async def _wait_until_healthy(self, client: httpx.AsyncClient, timeout: float = 30):
+        """等待 API 可用"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get("/api/health")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+        raise RuntimeError(f"API 未在 {timeout} 秒內啟動: {self.config.base_url}")
+    
+    @staticmethod
+    async def _get_total_commands(redis_client: aioredis.Redis) -> Optional[int]:
+        """取得 Redis 已處理的指令數（不支援 INFO 時為 None，例如 fakeredis）"""
+        try:
+            return int((await redis_client.info("stats"))["total_commands_processed"])
+        except (ResponseError, KeyError):
+            return None
+    
+    async def _run_users(self, client: httpx.AsyncClient, started: float):
+        """依到達時間啟動所有使用者，售完後等待 sellout_grace_seconds 即取消其餘使用者"""
+        offsets = arrival_offsets(self.config.users, self.config.arrival_seconds, self.config.curve, self.config.seed)
+        tasks = [
+            asyncio.create_task(self._user(client, index, started + offset))
+            for index, offset in enumerate(offsets)
+        ]
+        all_done = asyncio.gather(*tasks, return_exceptions=True)
+        sold_out = asyncio.create_task(self._sold_out.wait())
+        
+        await asyncio.wait({all_done, sold_out}, return_when=asyncio.FIRST_COMPLETED)
+        if not all_done.done():
+            await asyncio.sleep(self.config.sellout_grace_seconds)
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                    self.counters["cancelled_after_sellout"] += 1
+        await all_done
+        sold_out.cancel()
+        
+        for result in all_done.result():
+            if isinstance(result, Exception) and not isinstance(result, asyncio.CancelledError):
+                logger.error(f"模擬使用者錯誤: {result!r}")
+    
+    async def _check_oversell(self, client: httpx.AsyncClient) -> Dict[str, object]:
+        """比對售出數量與成功購買數，確認沒有超賣"""
+        # 商品 API 的庫存快取時間很短，等待過期後再讀取
+        await asyncio.sleep(1)
+        product = (await client.get(f"/api/products/{self.product_id}")).json()
+        remaining_stock = product["remaining_stock"]
+        sold = product["total_stock"] - remaining_stock
+        
+        return {
+            "total_stock": product["total_stock"],
+            "remaining_stock": remaining_stock,
+            "sold": sold,
+            "successful_purchases": self.counters["purchased"],
+            "ok": (
+                remaining_stock >= 0
+                and sold == self.counters["purchased"]
+                and sold <= product["total_stock"]
+            )
+        }
+    
+    async def _cleanup(self, client: httpx.AsyncClient, redis_client: aioredis.Redis):
+        """刪除模擬商品與其佇列資料"""
+        await client.delete(f"/api/products/{self.product_id}")
+        keys = [key async for key in redis_client.scan_iter(match=f"*{self.product_id}*", count=1000)]
+        if keys:
+            await redis_client.delete(*keys)
+    
+    async def run(self) -> dict:
+        """
+        執行搶購模擬
+        
+        Returns:
+            dict: 模擬設定與結果（可直接存成 JSON）
+        """
+        server = self._start_server() if self.config.base_url is None else None
+        redis_client = aioredis.from_url(self.config.redis_url, decode_responses=True)
+        self._sold_out = asyncio.Event()
+        limits = httpx.Limits(max_connections=self.config.max_connections, max_keepalive_connections=None)
+        
+        try:
+            async with httpx.AsyncClient(
+                base_url=self.config.base_url,
+                timeout=httpx.Timeout(30.0),
+                limits=limits
+            ) as client:
+                await self._wait_until_healthy(client)
+                await client.put(
+                    f"/api/products/{self.product_id}",
+                    json={
+                        "name": "壓力測試商品",
+                        "image_url": "/images/shoes.png",
+                        "price": 9999,
+                        "total_stock": self.config.stock,
+                        "reset_stock": True
+                    }
+                )
+                
+                commands_before = await self._get_total_commands(redis_client)
+                started = time.monotonic()
+                await self._run_users(client, started)
+                duration = time.monotonic() - started
+                commands_after = await self._get_total_commands(redis_client)
+                
+                oversell = await self._check_oversell(client)
+                if not self.config.keep_data:
+                    await self._cleanup(client, redis_client)
+        finally:
+            await redis_client.aclose()
+            if server is not None:
+                server.terminate()
+                server.wait(timeout=10)
+        
+        activation_span = (
+            self._activated_at[-1] - self._activated_at[0]
+            if len(self._activated_at) > 1 else 0.0
+        )
+        commands = (
+            commands_after - commands_before
+            if commands_before is not None and commands_after is not None else None
+        )
+        
+        return {
+            "benchmark": "drop",
+            "product_id": self.product_id,
+            "config": self.config.model_dump(),
+            "duration_s": round(duration, 3),
+            "users": self.counters,
+            "endpoints": self.latency.summary(),
+            "redis": {
+                "commands": commands,
+                "ops_per_sec": round(commands / duration, 1) if commands is not None and duration else None
+            },
+            "promotion": {
+                "activated": len(self._activated_at),
+                "per_sec": round(len(self._activated_at) / activation_span, 2) if activation_span else None
+            },
+            "sse": {
+                "max_concurrent": self.sse["max_concurrent"],
+                "events": self.sse["events"]
+            },
+            "oversell": oversell
+        }
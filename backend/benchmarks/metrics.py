@@ -0,0 +1,72 @@
+"""
+延遲統計與結果比較
+"""
+import math
+from collections import defaultdict
+from typing import Dict, List
+
+
+def percentile(samples: List[float], ratio: float) -> float:
+    """計算百分位數（nearest-rank，samples 需已排序）"""
+    if not samples:
+        return 0.0
+    rank = max(1, math.ceil(ratio * len(samples)))
+    return samples[rank - 1]
+
+
+class LatencyRecorder:
+    """依端點記錄請求延遲與錯誤數"""
+    
+    def __init__(self):
+        self._samples: Dict[str, List[float]] = defaultdict(list)
+        self._errors: Dict[str, int] = defaultdict(int)
+    
+    def record(self, endpoint: str, elapsed_ms: float, ok: bool = True):
+        """記錄一次請求"""
+        self._samples[endpoint].append(elapsed_ms)
+        if not ok:
+            self._errors[endpoint] += 1
+    
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """各端點的請求數、錯誤數與 p50 / p90 / p99 / max 延遲（毫秒）"""
+        result = {}
+        for endpoint, samples in sorted(self._samples.items()):
+            ordered = sorted(samples)
+            result[endpoint] = {
+                "count": len(ordered),
+                "errors": self._errors[endpoint],
+                "p50_ms": round(percentile(ordered, 0.50), 3),
+                "p90_ms": round(percentile(ordered, 0.90), 3),
+                "p99_ms": round(percentile(ordered, 0.99), 3),
+                "max_ms": round(ordered[-1], 3)
+            }
+        return result
+
+
+def compare_results(baseline: dict, current: dict) -> List[str]:
+    """
+    比較兩次壓力測試結果
+    
+    Returns:
+        List[str]: 各端點延遲與整體吞吐量的變化（可直接輸出）
+    """
+    lines = []
+    for endpoint, stats in current["endpoints"].items():
+        before = baseline["endpoints"].get(endpoint)
+        if before is None:
+            lines.append(f"{endpoint}: 新增端點 p50={stats['p50_ms']}ms p99={stats['p99_ms']}ms")
+            continue
+        for key in ("p50_ms", "p99_ms"):
+            delta = stats[key] - before[key]
+            ratio = f" ({delta / before[key] * 100:+.1f}%)" if before[key] else ""
+            lines.append(f"{endpoint} {key}: {before[key]} -> {stats[key]}{ratio}")
+    
+    for section, key in (("redis", "ops_per_sec"), ("promotion", "per_sec")):
+        before = baseline.get(section, {}).get(key)
+        after = current.get(section, {}).get(key)
+        if before is not None and after is not None:
+            lines.append(f"{section} {key}: {before} -> {after}")
+    
+    if not current["oversell"]["ok"]:
+        lines.append("超賣檢查失敗: " + str(current["oversell"]))
+    return lines
@@ -2,16 +2,20 @@
 Pytest 配置和共用 fixtures
 """
 import pytest
-from fastapi.testclient import TestClient
+import pytest_asyncio
+from httpx import AsyncClient
 from app.main import app
-from app.core.redis import get_redis_client
+from app.core.redis import get_redis_client, close_async_redis
+from app.services.product_cache import product_catalog_cache
+from app.services.sold_out import sold_out_registry
 import redis
 
 
-@pytest.fixture
-def client():
+@pytest_asyncio.fixture
+async def client():
     """測試客戶端"""
-    return TestClient(app)
+    async with AsyncClient(app=app, base_url="http://test") as async_client:
+        yield async_client
 
 
 @pytest.fixture
@@ -20,6 +24,15 @@ def redis_client():
     return get_redis_client()
 
 
+@pytest_asyncio.fixture(autouse=True)
+async def async_redis():
+    """每個測試使用獨立的非同步連線池（連線池綁定於測試的 event loop）"""
+    yield
+    product_catalog_cache.invalidate()
+    await sold_out_registry.stop()
+    await close_async_redis()
+
+
 @pytest.fixture(autouse=True)
 def cleanup_redis(redis_client):
     """每個測試後清理 Redis"""
@@ -36,3 +49,12 @@ def cleanup_redis(redis_client):
     keys = redis_client.keys("session:*")
     if keys:
         redis_client.delete(*keys)
+    keys = redis_client.keys("purchase*")
+    if keys:
+        redis_client.delete(*keys)
+    keys = redis_client.keys("rate_limit:*")
+    if keys:
+        redis_client.delete(*keys)
+    keys = redis_client.keys("metrics:*")
+    if keys:
+        redis_client.delete(*keys)
@@ -2,47 +2,86 @@
 API 整合測試
 """
 import pytest
+from app.core.metrics import REDIS_COMMANDS, REDIS_ROUNDTRIP_DURATION
+from app.services.inventory_service import InventoryService
 from app.services.product_service import ProductService
+from app.services.queue_service import QueueService
 from app.services.session_service import SessionService
+from app.services.sold_out import sold_out_registry
+from app.tasks.product_lease import product_lease_manager
+from app.tasks.queue_manager import QueueScheduler
+
+
+def _count_round_trips() -> int:
+    """目前記錄的 Redis 往返次數（所有服務合計）"""
+    return sum(sum(counts) for counts, _ in REDIS_ROUNDTRIP_DURATION._values.values())
 
 
 class TestProductsAPI:
     """商品 API 測試"""
     
-    def test_get_products(self, client):
+    @pytest.mark.asyncio
+    async def test_get_products(self, client):
         """測試取得商品列表"""
-        ProductService.initialize_products()
+        await ProductService.initialize_products()
         
-        response = client.get("/api/products")
+        response = await client.get("/api/products")
         assert response.status_code == 200
         data = response.json()
         assert "products" in data
         assert len(data["products"]) == 3
     
-    def test_get_product(self, client):
+    @pytest.mark.asyncio
+    async def test_get_product(self, client):
         """測試取得商品詳情"""
-        ProductService.initialize_products()
+        await ProductService.initialize_products()
         
-        response = client.get("/api/products/1")
+        response = await client.get("/api/products/1")
         assert response.status_code == 200
         data = response.json()
         assert data["id"] == "1"
         assert data["total_stock"] == 5
     
-    def test_get_product_not_found(self, client):
+    @pytest.mark.asyncio
+    async def test_get_product_not_found(self, client):
         """測試取得不存在的商品"""
-        response = client.get("/api/products/999")
+        response = await client.get("/api/products/999")
+        assert response.status_code == 404
+    
+    @pytest.mark.asyncio
+    async def test_upsert_and_delete_product(self, client):
+        """測試新增與刪除商品"""
+        response = await client.put(
+            "/api/products/2",
+            json={
+                "name": "限量球鞋 B",
+                "image_url": "/images/shoes-b.png",
+                "price": 5000,
+                "total_stock": 7
+            }
+        )
+        assert response.status_code == 200
+        assert response.json()["remaining_stock"] == 7
+        
+        response = await client.get("/api/products")
+        assert [p["id"] for p in response.json()["products"]] == ["2"]
+        
+        response = await client.delete("/api/products/2")
+        assert response.status_code == 200
+        
+        response = await client.delete("/api/products/2")
         assert response.status_code == 404
 
 
 class TestQueueAPI:
     """佇列 API 測試"""
     
-    def test_join_queue_without_token(self, client):
+    @pytest.mark.asyncio
+    async def test_join_queue_without_token(self, client):
         """測試沒有 token 加入佇列"""
-        ProductService.initialize_products()
+        await ProductService.initialize_products()
         
-        response = client.post(
+        response = await client.post(
             "/api/queue/join",
             json={
                 "product_id": "1",
@@ -54,9 +93,10 @@ class TestQueueAPI:
         assert data["success"] == False
         assert data["error"] == "INVALID_TURNSTILE_TOKEN"
     
-    def test_get_queue_status_not_found(self, client):
+    @pytest.mark.asyncio
+    async def test_get_queue_status_not_found(self, client):
         """測試查詢不存在的佇列狀態"""
-        response = client.get(
+        response = await client.get(
             "/api/queue/status",
             params={
                 "session_id": "nonexistent",
@@ -64,17 +104,69 @@ class TestQueueAPI:
             }
         )
         assert response.status_code == 404
+    
+    @pytest.mark.asyncio
+    async def test_get_queue_status_single_round_trip(self, client):
+        """測試查詢佇列狀態只使用一次 Redis 往返"""
+        session_id, _ = await QueueService.join_with_new_session("1")
+        round_trips_before = _count_round_trips()
+        commands_before = sum(REDIS_COMMANDS._values.values())
+        
+        response = await client.get(
+            "/api/queue/status",
+            params={
+                "session_id": session_id,
+                "product_id": "1"
+            }
+        )
+        
+        assert response.status_code == 200
+        assert response.json()["queue_position_waiting"] == 0
+        assert _count_round_trips() - round_trips_before == 1
+        assert sum(REDIS_COMMANDS._values.values()) - commands_before <= 8
+    
+    @pytest.mark.asyncio
+    async def test_sold_out_short_circuits_without_redis(self, client):
+        """測試售完時加入佇列與購買直接回應，不驗證 Turnstile 也不存取 Redis"""
+        sold_out_registry.mark("1")
+        round_trips_before = _count_round_trips()
+        
+        join = await client.post("/api/queue/join", json={"product_id": "1", "turnstile_token": ""})
+        purchase = await client.post("/api/purchase", json={"product_id": "1", "quantity": 1, "session_id": "abc"})
+        
+        assert join.json()["error"] == "SOLD_OUT"
+        assert purchase.json()["error"] == "SOLD_OUT"
+        assert _count_round_trips() == round_trips_before
+    
+    @pytest.mark.asyncio
+    async def test_sold_out_status_keeps_purchased_sessions(self, client, redis_client):
+        """測試售完時查詢狀態只讀取會話狀態：已購買維持 purchased，會話不存在回傳 404"""
+        waiting_id, _ = await QueueService.join_with_new_session("1")
+        buyer_id, _ = await QueueService.join_with_new_session("1")
+        redis_client.hset(SessionService._get_session_key(buyer_id, "1"), "queue_status", "purchased")
+        sold_out_registry.mark("1")
+        round_trips_before = _count_round_trips()
+        
+        waiting = await client.get("/api/queue/status", params={"session_id": waiting_id, "product_id": "1"})
+        buyer = await client.get("/api/queue/status", params={"session_id": buyer_id, "product_id": "1"})
+        missing = await client.get("/api/queue/status", params={"session_id": "abc", "product_id": "1"})
+        
+        assert waiting.json()["status"] == "sold_out"
+        assert buyer.json()["status"] == "purchased"
+        assert missing.status_code == 404
+        assert _count_round_trips() - round_trips_before == 3
 
 
 class TestPurchaseAPI:
     """購買 API 測試"""
     
-    def test_purchase_not_in_queue(self, client):
+    @pytest.mark.asyncio
+    async def test_purchase_not_in_queue(self, client):
         """測試不在佇列中的人嘗試購買"""
-        ProductService.initialize_products()
-        session_id = SessionService.create_session(turnstile_verified=True)
+        await ProductService.initialize_products()
+        session_id = await SessionService.create_session(turnstile_verified=True)
         
-        response = client.post(
+        response = await client.post(
             "/api/purchase",
             json={
                 "product_id": "1",
@@ -86,3 +178,80 @@ class TestPurchaseAPI:
         data = response.json()
         assert data["success"] == False
         assert data["error"] == "NOT_READY"
+    
+    @pytest.mark.asyncio
+    async def test_purchase_single_round_trip(self, client, redis_client):
+        """測試購買只使用一次 Redis 往返"""
+        redis_client.set(InventoryService._get_stock_key("1"), 5)
+        session_id, _ = await QueueService.join_with_new_session("1")
+        await QueueService.move_to_active("1")
+        round_trips_before = _count_round_trips()
+        
+        response = await client.post(
+            "/api/purchase",
+            json={
+                "product_id": "1",
+                "quantity": 1,
+                "session_id": session_id
+            }
+        )
+        
+        assert response.status_code == 200
+        assert response.json()["success"] == True
+        assert response.json()["remaining_stock"] == 4
+        assert _count_round_trips() - round_trips_before == 1
+
+
+class TestMetricsAPI:
+    """指標 API 測試"""
+    
+    @pytest.mark.asyncio
+    async def test_metrics(self, client):
+        """測試 /metrics 輸出路由延遲、Redis 指令與佇列人數"""
+        await ProductService.initialize_products()
+        await client.get("/api/products/1")
+        
+        response = await client.get("/metrics")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+        body = response.text
+        assert 'eshield_http_request_duration_seconds_count{method="GET",route="/api/products/{product_id}",status="200"}' in body
+        assert 'eshield_redis_commands_total{service="ProductService"' in body
+        assert 'eshield_queue_depth{product_id="1",queue="waiting"} 0' in body
+    
+    @pytest.mark.asyncio
+    async def test_sharded_transient_zero_does_not_mark_sold_out(self, client, redis_client, monkeypatch):
+        """測試庫存分片時剩餘庫存因其他預留未結算而暫時為 0，不會標記售完也不會清空佇列"""
+        monkeypatch.setenv("INVENTORY_SHARDS", "2")
+        monkeypatch.setattr(QueueService, "ACTIVE_QUEUE_MAX_SIZE", 2)
+        redis_client.zadd(ProductService.PRODUCT_REGISTRY_KEY, {"1": 1})
+        redis_client.set(InventoryService._get_stock_shard_key("1", 0), 1)
+        redis_client.set(InventoryService._get_stock_shard_key("1", 1), 0)
+        first_id, _ = await QueueService.join_with_new_session("1")
+        second_id, _ = await QueueService.join_with_new_session("1")
+        waiting_id, _ = await QueueService.join_with_new_session("1")
+        await QueueService.move_to_active("1")
+        # 另一筆購買已預留一件但尚未結算
+        redis_client.hset(InventoryService._get_reservations_key("1"), mapping={"pending": 1, "seq": 1})
+        
+        first = await client.post("/api/purchase", json={"product_id": "1", "quantity": 1, "session_id": first_id})
+        
+        assert first.json()["remaining_stock"] == 0
+        assert not sold_out_registry.is_sold_out("1")
+        assert not redis_client.exists(InventoryService._get_sold_out_key("1"))
+        
+        # 另一筆購買失敗，歸還預留並結算
+        redis_client.incrby(InventoryService._get_stock_shard_key("1", 1), 1)
+        await InventoryService.settle_reservation("1")
+        scheduler = QueueScheduler(min_interval_ms=50, max_interval_ms=3000)
+        try:
+            await scheduler.tick()
+        finally:
+            await product_lease_manager.release_all()
+        
+        second = await client.post("/api/purchase", json={"product_id": "1", "quantity": 1, "session_id": second_id})
+        
+        assert second.json()["success"]
+        assert second.json()["remaining_stock"] == 0
+        session = await SessionService.get_session(waiting_id, "1")
+        assert session.queue_status == "active"
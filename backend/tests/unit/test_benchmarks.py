@@ -0,0 +1,48 @@
+"""
+壓力測試工具單元測試
+"""
+import pytest
+from benchmarks.arrivals import CURVES, arrival_offsets
+from benchmarks.metrics import LatencyRecorder, compare_results, percentile
+
+
+class TestBenchmarks:
+    """壓力測試工具測試"""
+    
+    @pytest.mark.parametrize("curve", CURVES)
+    def test_arrival_offsets_within_duration(self, curve):
+        """測試到達時間數量正確、已排序且落在到達期間內"""
+        offsets = arrival_offsets(1000, 10, curve, seed=1)
+        
+        assert len(offsets) == 1000
+        assert offsets == sorted(offsets)
+        assert 0 <= offsets[0] and offsets[-1] <= 10
+        assert offsets == arrival_offsets(1000, 10, curve, seed=1)
+    
+    def test_spike_front_loads_arrivals(self):
+        """測試 spike 曲線八成使用者集中在前一成時間"""
+        offsets = arrival_offsets(1000, 10, "spike")
+        
+        assert sum(1 for offset in offsets if offset <= 1) >= 800
+    
+    def test_latency_summary(self):
+        """測試百分位數與錯誤數統計"""
+        recorder = LatencyRecorder()
+        for elapsed_ms in range(1, 101):
+            recorder.record("POST /api/queue/join", elapsed_ms, ok=elapsed_ms != 100)
+        
+        summary = recorder.summary()["POST /api/queue/join"]
+        
+        assert summary == {"count": 100, "errors": 1, "p50_ms": 50, "p90_ms": 90, "p99_ms": 99, "max_ms": 100}
+        assert percentile([], 0.5) == 0.0
+    
+    def test_compare_results(self):
+        """測試結果比較輸出延遲變化與超賣警告"""
+        baseline = {"endpoints": {"POST /api/purchase": {"p50_ms": 10, "p99_ms": 20}}, "oversell": {"ok": True}}
+        current = {"endpoints": {"POST /api/purchase": {"p50_ms": 5, "p99_ms": 30}}, "oversell": {"ok": False}}
+        
+        lines = compare_results(baseline, current)
+        
+        assert "POST /api/purchase p50_ms: 10 -> 5 (-50.0%)" in lines
+        assert "POST /api/purchase p99_ms: 20 -> 30 (+50.0%)" in lines
+        assert lines[-1].startswith("超賣檢查失敗")
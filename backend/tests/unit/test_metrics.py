@@ -0,0 +1,69 @@
+"""
+指標單元測試
+"""
+import pytest
+from app.core.metrics import (
+    REDIS_COMMANDS,
+    MetricsRegistry,
+    merge_snapshots,
+    render_metrics,
+    metrics_publisher
+)
+from app.services.queue_service import QueueService
+
+
+class TestMetrics:
+    """指標測試"""
+    
+    def test_histogram_rendering_is_cumulative(self):
+        """測試 histogram 輸出累計 bucket、sum 與 count"""
+        registry = MetricsRegistry()
+        histogram = registry.histogram("test_duration_seconds", "測試", ("route",), buckets=(0.1, 1.0))
+        histogram.observe(0.05, ("/a",))
+        histogram.observe(0.5, ("/a",))
+        histogram.observe(5, ("/a",))
+        
+        output = render_metrics(registry.snapshot())
+        
+        assert 'test_duration_seconds_bucket{route="/a",le="0.1"} 1' in output
+        assert 'test_duration_seconds_bucket{route="/a",le="1"} 2' in output
+        assert 'test_duration_seconds_bucket{route="/a",le="+Inf"} 3' in output
+        assert 'test_duration_seconds_sum{route="/a"} 5.55' in output
+        assert 'test_duration_seconds_count{route="/a"} 3' in output
+    
+    def test_merge_sums_workers(self):
+        """測試多個 worker 的快照逐項加總"""
+        worker_a, worker_b = MetricsRegistry(), MetricsRegistry()
+        for registry, amount in ((worker_a, 2), (worker_b, 3)):
+            registry.counter("test_total", "測試", ("service",)).inc(("QueueService",), amount)
+            registry.histogram("test_seconds", "測試", buckets=(1.0,)).observe(0.5)
+        
+        merged = merge_snapshots([worker_a.snapshot(), worker_b.snapshot()])
+        
+        assert merged["test_total"]["samples"] == [[["QueueService"], 5]]
+        assert merged["test_seconds"]["samples"] == [[[], [[2, 0], 1.0]]]
+    
+    @pytest.mark.asyncio
+    async def test_redis_commands_labelled_by_service(self, redis_client):
+        """測試 Redis 指令依呼叫的服務分類"""
+        before = REDIS_COMMANDS._values.get(("QueueService", "ZCARD"), 0)
+        
+        await QueueService.get_waiting_count("1")
+        await QueueService.get_queue_depths(["1", "2"])
+        
+        assert REDIS_COMMANDS._values[("QueueService", "ZCARD")] == before + 5
+    
+    @pytest.mark.asyncio
+    async def test_collect_includes_published_workers(self, redis_client):
+        """測試 /metrics 加總所有已發布快照的 worker"""
+        await metrics_publisher.publish()
+        redis_client.zadd(metrics_publisher.WORKERS_KEY, {"other-worker": int(redis_client.time()[0] * 1000)})
+        redis_client.set(
+            metrics_publisher._get_snapshot_key("other-worker"),
+            '{"eshield_sse_connections": {"type": "gauge", "help": "", "labelnames": [], "buckets": [], "samples": [[[], 4]]}}'
+        )
+        
+        merged = await metrics_publisher.collect()
+        
+        assert merged["eshield_metrics_workers"]["samples"] == [[[], 2]]
+        assert merged["eshield_sse_connections"]["samples"][0][1] >= 4
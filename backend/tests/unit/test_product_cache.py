@@ -0,0 +1,78 @@
+"""
+商品目錄快取單元測試
+"""
+import asyncio
+import pytest
+from app.services.product_cache import ProductCatalogCache
+from app.services.product_service import ProductService
+
+
+class TestProductCatalogCache:
+    """商品目錄快取測試"""
+    
+    @pytest.mark.asyncio
+    async def test_static_fields_cached_and_stock_refreshed(self, redis_client):
+        """測試靜態欄位走快取，剩餘庫存依短 TTL 更新"""
+        await ProductService.initialize_products()
+        cache = ProductCatalogCache(ttl_seconds=60, stock_ttl_seconds=0)
+        
+        product = await cache.get_product("1")
+        assert product.name == "限量球鞋"
+        
+        redis_client.hset("product:info:{1}", "name", "已修改")
+        redis_client.set("product:stock:{1}", 2)
+        
+        product = await cache.get_product("1")
+        assert product.name == "限量球鞋"
+        assert product.remaining_stock == 2
+        
+        cache.invalidate("1")
+        product = await cache.get_product("1")
+        assert product.name == "已修改"
+    
+    @pytest.mark.asyncio
+    async def test_concurrent_misses_single_flight(self, redis_client, monkeypatch):
+        """測試同時發生的快取未命中只向 Redis 載入一次"""
+        await ProductService.initialize_products()
+        cache = ProductCatalogCache()
+        calls = []
+        original = ProductService.get_products
+        
+        async def counting_get_products(product_ids):
+            calls.append(product_ids)
+            return await original(product_ids)
+        
+        monkeypatch.setattr(ProductService, "get_products", counting_get_products)
+        
+        products = await asyncio.gather(*[cache.get_product("1") for _ in range(50)])
+        
+        assert all(product.id == "1" for product in products)
+        assert len(calls) == 1
+    
+    @pytest.mark.asyncio
+    async def test_invalidation_across_replicas(self, redis_client):
+        """測試商品更新透過 pub/sub 清除其他副本的快取"""
+        await ProductService.initialize_products()
+        cache = ProductCatalogCache(ttl_seconds=60)
+        cache.start()
+        await asyncio.sleep(0.2)
+        
+        try:
+            assert [p.id for p in await cache.get_all_products()] == ["1"]
+            
+            await ProductService.upsert_product({
+                "id": "2",
+                "name": "限量球鞋 B",
+                "image_url": "/images/shoes-b.png",
+                "price": 5000,
+                "total_stock": 7
+            })
+            
+            for _ in range(50):
+                if cache.stats["invalidations"] >= 2:
+                    break
+                await asyncio.sleep(0.05)
+            
+            assert [p.id for p in await cache.get_all_products()] == ["1", "2"]
+        finally:
+            await cache.stop()
@@ -0,0 +1,43 @@
+"""
+商品佇列租約單元測試
+"""
+import pytest
+from app.tasks.product_lease import ProductLeaseManager
+
+
+class TestProductLease:
+    """商品佇列租約測試"""
+    
+    @pytest.mark.asyncio
+    async def test_single_owner_per_product(self, redis_client):
+        """測試同一商品同時只有一個 worker 持有租約"""
+        worker_a = ProductLeaseManager(ttl_ms=10000)
+        worker_b = ProductLeaseManager(ttl_ms=10000)
+        
+        assert await worker_a.acquire("1") is True
+        assert await worker_b.acquire("1") is False
+        assert await worker_a.acquire("1") is True
+        assert await worker_b.acquire("2") is True
+        
+        assert worker_a.get_owned_products() == ["1"]
+        assert worker_b.get_owned_products() == ["2"]
+        assert worker_a.stats["renewed"] == 1
+    
+    @pytest.mark.asyncio
+    async def test_failover_after_release(self, redis_client):
+        """測試持有者釋放或租約過期後由其他 worker 接手"""
+        worker_a = ProductLeaseManager(ttl_ms=10000)
+        worker_b = ProductLeaseManager(ttl_ms=10000)
+        
+        await worker_a.acquire("1")
+        await worker_a.release_all()
+        assert await worker_b.acquire("1") is True
+        
+        redis_client.delete("queue:lease:product:{1}")
+        assert await worker_a.acquire("1") is True
+        assert await worker_b.acquire("1") is False
+        assert worker_b.stats["lost"] == 1
+        
+        owners = await worker_a.get_lease_owners(["1"])
+        assert owners["1"]["owner"] == worker_a.worker_id
+        assert owners["1"]["ttl_ms"] > 0
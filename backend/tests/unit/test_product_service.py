@@ -9,35 +9,87 @@ from app.core.redis import get_redis_client
 class TestProductService:
     """商品服務測試"""
     
-    def test_initialize_products(self, redis_client):
+    @pytest.mark.asyncio
+    async def test_initialize_products(self, redis_client):
         """測試初始化商品"""
-        ProductService.initialize_products()
+        await ProductService.initialize_products()
         
-        products = ProductService.get_all_products()
+        products = await ProductService.get_all_products()
         assert len(products) == 3
         
-        stock = redis_client.get("product:stock:1")
+        stock = redis_client.get("product:stock:{1}")
         assert stock == "5"
     
-    def test_get_product(self, redis_client):
+    @pytest.mark.asyncio
+    async def test_get_product(self, redis_client):
         """測試取得商品"""
-        ProductService.initialize_products()
+        await ProductService.initialize_products()
         
-        product = ProductService.get_product("1")
+        product = await ProductService.get_product("1")
         assert product is not None
         assert product.id == "1"
         assert product.total_stock == 5
         assert product.remaining_stock == 5
     
-    def test_get_product_not_found(self):
+    @pytest.mark.asyncio
+    async def test_get_product_not_found(self):
         """測試取得不存在的商品"""
-        product = ProductService.get_product("999")
+        product = await ProductService.get_product("999")
         assert product is None
     
-    def test_get_all_products(self, redis_client):
+    @pytest.mark.asyncio
+    async def test_get_all_products(self, redis_client):
         """測試取得所有商品"""
-        ProductService.initialize_products()
+        await ProductService.initialize_products()
         
-        products = ProductService.get_all_products()
+        products = await ProductService.get_all_products()
         assert len(products) == 3
         assert all(p.total_stock == 5 for p in products)
+    
+    @pytest.mark.asyncio
+    async def test_product_registry(self, redis_client):
+        """測試商品列表只來自商品索引，不掃描 keyspace"""
+        await ProductService.initialize_products()
+        redis_client.set("product:stock:{orphan}", 3)
+        
+        await ProductService.upsert_product({
+            "id": "2",
+            "name": "限量球鞋 B",
+            "image_url": "/images/shoes-b.png",
+            "price": 5000,
+            "total_stock": 7
+        })
+        
+        assert await ProductService.get_product_ids() == ["1", "2"]
+        products = await ProductService.get_all_products()
+        assert [p.id for p in products] == ["1", "2"]
+        assert products[1].remaining_stock == 7
+        
+        assert await ProductService.delete_product("2") is True
+        assert await ProductService.get_product_ids() == ["1"]
+        assert await ProductService.get_product("2") is None
+    
+    @pytest.mark.asyncio
+    async def test_reset_stock(self, redis_client):
+        """測試重置所有已登錄商品的庫存"""
+        await ProductService.initialize_products()
+        redis_client.set("product:stock:{1}", 0)
+        
+        await ProductService.reset_stock()
+        
+        assert redis_client.get("product:stock:{1}") == "5"
+    
+    @pytest.mark.asyncio
+    async def test_sharded_stock_is_aggregated(self, redis_client, monkeypatch):
+        """測試庫存分片時寫入各分片，查詢時加總"""
+        monkeypatch.setenv("INVENTORY_SHARDS", "3")
+        await ProductService.initialize_products()
+        
+        assert [redis_client.get(f"product:stock:{{1:{shard}}}") for shard in range(3)] == ["2", "2", "1"]
+        redis_client.decr("product:stock:{1:1}")
+        
+        assert (await ProductService.get_product("1")).remaining_stock == 4
+        assert await ProductService.get_stocks(["1"]) == {"1": 4}
+        
+        assert await ProductService.delete_product("1") is True
+        assert not redis_client.exists("product:stock:{1:0}")
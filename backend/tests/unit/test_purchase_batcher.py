@@ -0,0 +1,65 @@
+"""
+購買批次提交單元測試
+"""
+import asyncio
+import pytest
+from app.services.inventory_service import InventoryService
+from app.services.purchase_batcher import PurchaseBatcher
+from app.services.queue_service import QueueService
+from app.services.session_service import SessionService
+
+
+async def _join_active(product_id: str, count: int) -> list:
+    """建立多個會話並移入搖滾區"""
+    session_ids = []
+    for _ in range(count):
+        session_id, _ = await QueueService.join_with_new_session(product_id)
+        session_ids.append(session_id)
+    await QueueService.move_to_active(product_id)
+    return session_ids
+
+
+class TestPurchaseBatcher:
+    """購買批次提交測試"""
+    
+    @pytest.mark.asyncio
+    async def test_window_merges_purchases_into_one_call(self, redis_client):
+        """測試時間窗內的購買合併為一次腳本呼叫，庫存依抵達順序分配"""
+        redis_client.set(InventoryService._get_stock_key("1"), 3)
+        session_ids = await _join_active("1", 5)
+        batcher = PurchaseBatcher(enabled=True, window_ms=20, max_batch=100)
+        
+        outcomes = await asyncio.gather(*(batcher.purchase("1", session_id, 1) for session_id in session_ids))
+        
+        assert [outcome[0] for outcome in outcomes] == [True, True, True, False, False]
+        assert [outcome[2] for outcome in outcomes[:3]] == [2, 1, 0]
+        assert outcomes[3][1] == "INSUFFICIENT_STOCK"
+        assert batcher.stats["batches"] == 1
+        session = await SessionService.get_session(session_ids[0], "1")
+        assert session.queue_status == "purchased"
+    
+    @pytest.mark.asyncio
+    async def test_max_batch_flushes_without_waiting(self, redis_client):
+        """測試達到每批上限時不等時間窗立即提交"""
+        redis_client.set(InventoryService._get_stock_key("1"), 10)
+        session_ids = await _join_active("1", 4)
+        batcher = PurchaseBatcher(enabled=True, window_ms=10000, max_batch=2)
+        
+        outcomes = await asyncio.wait_for(
+            asyncio.gather(*(batcher.purchase("1", session_id, 1) for session_id in session_ids)),
+            timeout=1
+        )
+        
+        assert all(outcome[0] for outcome in outcomes)
+        assert batcher.stats["batches"] == 2
+        assert batcher.stats["largest_batch"] == 2
+    
+    @pytest.mark.asyncio
+    async def test_disabled_purchases_directly(self, redis_client):
+        """測試停用時每筆購買直接執行腳本"""
+        redis_client.set(InventoryService._get_stock_key("1"), 1)
+        session_ids = await _join_active("1", 1)
+        batcher = PurchaseBatcher(enabled=False)
+        
+        assert await batcher.purchase("1", session_ids[0], 1) == (True, None, 0)
+        assert batcher.stats["batches"] == 0
@@ -0,0 +1,278 @@
+"""
+購買服務單元測試
+"""
+import asyncio
+import pytest
+from app.core.metrics import REDIS_ROUNDTRIP_DURATION
+from app.services.inventory_service import InventoryService
+from app.services.purchase_service import PurchaseService
+from app.services.queue_service import QueueService
+from app.services.session_service import SessionService
+
+
+def _count_round_trips(service: str) -> int:
+    """目前記錄的指定服務 Redis 往返次數"""
+    counts, _ = REDIS_ROUNDTRIP_DURATION._values.get((service,), ([], 0))
+    return sum(counts)
+
+
+async def _join_active(product_id: str) -> str:
+    """建立會話並移入搖滾區"""
+    session_id, _ = await QueueService.join_with_new_session(product_id)
+    await QueueService.move_to_active(product_id)
+    return session_id
+
+
+class TestPurchaseService:
+    """購買服務測試"""
+    
+    @pytest.mark.asyncio
+    async def test_purchase_updates_stock_queue_and_session(self, redis_client):
+        """測試購買一次完成扣庫存、移出搖滾區與更新會話"""
+        redis_client.set(InventoryService._get_stock_key("1"), 5)
+        session_id = await _join_active("1")
+        
+        success, error, remaining_stock = await PurchaseService.purchase("1", session_id, 1)
+        
+        assert (success, error, remaining_stock) == (True, None, 4)
+        assert redis_client.zscore(QueueService._get_active_key("1"), session_id) is None
+        assert redis_client.zscore(QueueService._get_deadline_key("1"), session_id) is None
+        assert redis_client.sismember(InventoryService._get_purchases_key("1"), session_id)
+        session = await SessionService.get_session(session_id, "1")
+        assert session.queue_status == "purchased"
+    
+    @pytest.mark.asyncio
+    async def test_purchase_once_per_session(self, redis_client):
+        """測試同一會話只能購買一次"""
+        redis_client.set(InventoryService._get_stock_key("1"), 5)
+        session_id = await _join_active("1")
+        await PurchaseService.purchase("1", session_id, 1)
+        
+        success, error, _ = await PurchaseService.purchase("1", session_id, 1)
+        
+        assert (success, error) == (False, "ALREADY_PURCHASED")
+        assert redis_client.get(InventoryService._get_stock_key("1")) == "4"
+    
+    @pytest.mark.asyncio
+    async def test_purchase_rejects_waiting_and_overdue(self, redis_client):
+        """測試排隊區與已超過購買期限的使用者無法購買"""
+        redis_client.set(InventoryService._get_stock_key("1"), 5)
+        overdue_id = await _join_active("1")
+        waiting_id, _ = await QueueService.join_with_new_session("1")
+        redis_client.zadd(QueueService._get_deadline_key("1"), {overdue_id: 0})
+        
+        assert (await PurchaseService.purchase("1", "missing", 1))[1] == "SESSION_NOT_FOUND"
+        assert (await PurchaseService.purchase("1", overdue_id, 1))[1] == "NOT_IN_ACTIVE_QUEUE"
+        redis_client.zrem(QueueService._get_active_key("1"), overdue_id)
+        assert (await PurchaseService.purchase("1", waiting_id, 1))[1] == "NOT_IN_ACTIVE_QUEUE"
+        assert redis_client.get(InventoryService._get_stock_key("1")) == "5"
+    
+    @pytest.mark.asyncio
+    async def test_purchase_insufficient_stock(self, redis_client):
+        """測試庫存不足時不扣減且保留搖滾區資格"""
+        redis_client.set(InventoryService._get_stock_key("1"), 0)
+        session_id = await _join_active("1")
+        
+        success, error, remaining_stock = await PurchaseService.purchase("1", session_id, 1)
+        
+        assert (success, error, remaining_stock) == (False, "INSUFFICIENT_STOCK", 0)
+        assert redis_client.zscore(QueueService._get_active_key("1"), session_id) is not None
+    
+    @pytest.mark.asyncio
+    async def test_purchase_backfills_active_zone(self, redis_client):
+        """測試購買後由排隊區第一位遞補空出的名額"""
+        redis_client.set(InventoryService._get_stock_key("1"), 50)
+        for _ in range(QueueService.ACTIVE_QUEUE_MAX_SIZE):
+            await QueueService.join_with_new_session("1")
+        await QueueService.move_to_active("1")
+        buyer_id = redis_client.zrange(QueueService._get_active_key("1"), 0, 0)[0]
+        next_id, _ = await QueueService.join_with_new_session("1")
+        
+        success, _, _ = await PurchaseService.purchase("1", buyer_id, 1)
+        
+        assert success
+        assert redis_client.zcard(QueueService._get_active_key("1")) == QueueService.ACTIVE_QUEUE_MAX_SIZE
+        assert await QueueService.get_waiting_count("1") == 0
+        session = await SessionService.get_session(next_id, "1")
+        assert session.queue_status == "active"
+        assert session.purchase_timeout_at
+    
+    @pytest.mark.asyncio
+    async def test_purchase_many_allocates_in_order(self, redis_client):
+        """測試批次購買依順序分配庫存並回傳各自的結果"""
+        redis_client.set(InventoryService._get_stock_key("1"), 2)
+        session_ids = []
+        for _ in range(3):
+            session_id, _ = await QueueService.join_with_new_session("1")
+            session_ids.append(session_id)
+        await QueueService.move_to_active("1")
+        
+        outcomes = await PurchaseService.purchase_many(
+            "1",
+            [(session_ids[0], 1), (session_ids[0], 1), (session_ids[1], 1), (session_ids[2], 1)]
+        )
+        
+        assert outcomes == [
+            (True, None, 1),
+            (False, "ALREADY_PURCHASED", None),
+            (True, None, 0),
+            (False, "INSUFFICIENT_STOCK", 0)
+        ]
+        assert redis_client.get(InventoryService._get_stock_key("1")) == "0"
+    
+    @pytest.mark.asyncio
+    async def test_sharded_purchases_never_oversell(self, redis_client, monkeypatch):
+        """測試庫存分片時並行購買會向其他分片取用，且成交數不超過總庫存"""
+        monkeypatch.setenv("INVENTORY_SHARDS", "4")
+        monkeypatch.setattr(QueueService, "ACTIVE_QUEUE_MAX_SIZE", 20)
+        for stock_key, stock in InventoryService.get_stock_values("1", 6).items():
+            redis_client.set(stock_key, stock)
+        session_ids = []
+        for _ in range(10):
+            session_id, _ = await QueueService.join_with_new_session("1")
+            session_ids.append(session_id)
+        await QueueService.move_to_active("1")
+        
+        outcomes = await asyncio.gather(*(PurchaseService.purchase("1", session_id, 1) for session_id in session_ids))
+        
+        assert sum(1 for success, _, _ in outcomes if success) == 6
+        assert {error for success, error, _ in outcomes if not success} == {"INSUFFICIENT_STOCK"}
+        assert await InventoryService.get_stock("1") == 0
+        assert redis_client.scard(InventoryService._get_purchases_key("1")) == 6
+        assert redis_client.exists(InventoryService._get_sold_out_key("1"))
+        assert redis_client.hget(InventoryService._get_reservations_key("1"), "pending") == "0"
+    
+    @pytest.mark.asyncio
+    async def test_reserve_stock_fallback_round_trips(self, redis_client, monkeypatch):
+        """測試選定的分片不足時，向其他分片取用的往返次數不隨分片數增加"""
+        monkeypatch.setenv("INVENTORY_SHARDS", "8")
+        first = InventoryService._pick_shard("session")
+        for shard in range(8):
+            redis_client.set(InventoryService._get_stock_shard_key("1", shard), 1 if shard != first else 0)
+        round_trips_before = _count_round_trips("InventoryService")
+        
+        grants = await InventoryService.reserve_stock("1", 3, "session")
+        
+        assert sum(granted for _, granted in grants) == 3
+        assert first not in {shard for shard, _ in grants}
+        assert _count_round_trips("InventoryService") - round_trips_before == 3
+        assert await InventoryService.get_stock("1") == 4
+        assert await InventoryService.reserve_stock("1", 5, "session") is not None
+        assert await InventoryService.get_stock("1") == 0
+        assert await InventoryService.reserve_stock("2", 1, "session") is None
+    
+    @pytest.mark.asyncio
+    async def test_sharded_ineligible_purchases_do_not_hold_stock(self, redis_client, monkeypatch):
+        """測試庫存分片時資格不符的購買不預留庫存，不會擋住同批的有效購買"""
+        monkeypatch.setenv("INVENTORY_SHARDS", "2")
+        for stock_key, stock in InventoryService.get_stock_values("1", 1).items():
+            redis_client.set(stock_key, stock)
+        buyer_id = await _join_active("1")
+        waiting_id, _ = await QueueService.join_with_new_session("1")
+        
+        outcomes = await PurchaseService.purchase_many("1", [("missing", 1), (waiting_id, 1), (buyer_id, 1)])
+        
+        assert outcomes == [
+            (False, "SESSION_NOT_FOUND", None),
+            (False, "NOT_IN_ACTIVE_QUEUE", None),
+            (True, None, 0)
+        ]
+        assert await InventoryService.get_stock("1") == 0
+    
+    @pytest.mark.asyncio
+    async def test_sharded_purchase_returns_unused_reservation(self, redis_client, monkeypatch):
+        """測試庫存分片時預先檢查通過、但腳本判定資格不符的購買會歸還預留的庫存"""
+        monkeypatch.setenv("INVENTORY_SHARDS", "2")
+        for stock_key, stock in InventoryService.get_stock_values("1", 3).items():
+            redis_client.set(stock_key, stock)
+        waiting_id, _ = await QueueService.join_with_new_session("1")
+        
+        async def stale_check(product_id, purchases):
+            return [None] * len(purchases)
+        
+        monkeypatch.setattr(PurchaseService, "_check_eligibility", stale_check)
+        
+        assert (await PurchaseService.purchase("1", waiting_id, 1))[1] == "NOT_IN_ACTIVE_QUEUE"
+        assert await InventoryService.get_stock("1") == 3
+    
+    @pytest.mark.asyncio
+    async def test_sharded_purchase_releases_reservation_on_script_error(self, redis_client, monkeypatch):
+        """測試庫存分片時購買腳本錯誤會歸還預留的庫存"""
+        monkeypatch.setenv("INVENTORY_SHARDS", "2")
+        for stock_key, stock in InventoryService.get_stock_values("1", 3).items():
+            redis_client.set(stock_key, stock)
+        buyer_id = await _join_active("1")
+        
+        async def failing_script(*args, **kwargs):
+            raise ConnectionError("connection lost")
+        
+        monkeypatch.setattr(PurchaseService, "_run_purchase_script", failing_script)
+        
+        with pytest.raises(ConnectionError):
+            await PurchaseService.purchase("1", buyer_id, 1)
+        assert await InventoryService.get_stock("1") == 3
+    
+    @pytest.mark.asyncio
+    async def test_sharded_purchase_keeps_consumed_stock_on_lost_reply(self, redis_client, monkeypatch):
+        """測試庫存分片時腳本已執行但回應遺失，只歸還未成交的件數"""
+        monkeypatch.setenv("INVENTORY_SHARDS", "2")
+        for stock_key, stock in InventoryService.get_stock_values("1", 3).items():
+            redis_client.set(stock_key, stock)
+        buyer_id = await _join_active("1")
+        run_purchase_script = PurchaseService._run_purchase_script
+        
+        async def lost_reply(*args, **kwargs):
+            await run_purchase_script(*args, **kwargs)
+            raise ConnectionError("connection lost")
+        
+        monkeypatch.setattr(PurchaseService, "_run_purchase_script", lost_reply)
+        
+        with pytest.raises(ConnectionError):
+            await PurchaseService.purchase("1", buyer_id, 1)
+        assert await InventoryService.get_stock("1") == 2
+        assert redis_client.sismember(InventoryService._get_purchases_key("1"), buyer_id)
+    
+    @pytest.mark.asyncio
+    async def test_last_unit_sets_sold_out(self, redis_client):
+        """測試賣出最後一件時原子地設定售完旗標且不再遞補"""
+        redis_client.set(InventoryService._get_stock_key("1"), 1)
+        buyer_id = await _join_active("1")
+        await QueueService.join_with_new_session("1")
+        
+        assert await PurchaseService.purchase("1", buyer_id, 1) == (True, None, 0)
+        
+        assert redis_client.exists(InventoryService._get_sold_out_key("1"))
+        assert await QueueService.get_active_count("1") == 0
+        assert await QueueService.get_waiting_count("1") == 1
+    
+    @pytest.mark.asyncio
+    async def test_sharded_zero_with_pending_reservation_is_not_sold_out(self, redis_client, monkeypatch):
+        """測試庫存分片時加總為 0 但仍有其他購買的預留未結算時不設定售完旗標"""
+        monkeypatch.setenv("INVENTORY_SHARDS", "2")
+        for stock_key in InventoryService._get_stock_keys("1"):
+            redis_client.set(stock_key, 0)
+        # 另一筆購買已預留最後一件但尚未結算
+        redis_client.hset(InventoryService._get_reservations_key("1"), mapping={"pending": 1, "seq": 1})
+        buyer_id = await _join_active("1")
+        
+        assert await PurchaseService.purchase("1", buyer_id, 1) == (False, "INSUFFICIENT_STOCK", 0)
+        assert not redis_client.exists(InventoryService._get_sold_out_key("1"))
+        
+        # 另一筆購買失敗，歸還預留並結算
+        redis_client.incrby(InventoryService._get_stock_shard_key("1", 0), 1)
+        assert await InventoryService.settle_reservation("1") == (0, 2)
+        assert await PurchaseService.purchase("1", buyer_id, 1) == (True, None, 0)
+        assert redis_client.exists(InventoryService._get_sold_out_key("1"))
+    
+    @pytest.mark.asyncio
+    async def test_mark_sold_out_requires_no_new_reservations(self, redis_client):
+        """測試讀取分片後有新的預留開始時不設定售完旗標"""
+        redis_client.hset(InventoryService._get_reservations_key("1"), mapping={"pending": 0, "seq": 3})
+        
+        assert not await InventoryService.mark_sold_out("1", 2)
+        redis_client.hset(InventoryService._get_reservations_key("1"), "pending", 1)
+        assert not await InventoryService.mark_sold_out("1", 3)
+        redis_client.hset(InventoryService._get_reservations_key("1"), "pending", 0)
+        assert await InventoryService.mark_sold_out("1", 3)
+        assert not await InventoryService.mark_sold_out("1", 3)
+        assert redis_client.exists(InventoryService._get_sold_out_key("1"))
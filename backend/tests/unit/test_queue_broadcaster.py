@@ -0,0 +1,55 @@
+"""
+佇列廣播服務單元測試
+"""
+import asyncio
+import pytest
+from app.services.queue_broadcaster import QueueBroadcaster
+from app.services.queue_service import QueueService
+
+
+class TestQueueBroadcaster:
+    """佇列廣播服務測試"""
+    
+    @pytest.mark.asyncio
+    async def test_publish_reaches_local_waiters(self, redis_client):
+        """測試發布的佇列狀態會喚醒本行程的等待者"""
+        product_id = "1"
+        broadcaster = QueueBroadcaster()
+        broadcaster.start()
+        await asyncio.sleep(0.2)
+        
+        try:
+            await QueueService.join_waiting_queue(product_id, "test_session_1")
+            waiter = asyncio.create_task(broadcaster.wait_for_update(product_id, timeout=5))
+            await asyncio.sleep(0)
+            
+            await broadcaster.publish_queue_state(product_id)
+            snapshot = await waiter
+            
+            assert snapshot["product_id"] == product_id
+            assert snapshot["total_in_waiting"] == 1
+            assert snapshot["head"] == 0
+        finally:
+            await broadcaster.stop()
+    
+    @pytest.mark.asyncio
+    async def test_wait_for_update_timeout(self):
+        """測試沒有廣播時等待逾時"""
+        broadcaster = QueueBroadcaster()
+        assert await broadcaster.wait_for_update("1", timeout=0.05) is None
+    
+    @pytest.mark.asyncio
+    async def test_position_from_head_offset(self, redis_client):
+        """測試以 head 推算的排隊位置與 ZRANK 一致"""
+        product_id = "1"
+        for i in range(5):
+            await QueueService.join_waiting_queue(product_id, f"session_{i}")
+        
+        anchor = await QueueService.get_status_snapshot(product_id, "session_4")
+        assert anchor["queue_index"] == 4
+        
+        await QueueService.move_to_active(product_id, count=3)
+        totals = await QueueService.get_queue_totals(product_id)
+        
+        assert totals["head"] == 3
+        assert anchor["queue_index"] - totals["head"] == await QueueService.get_waiting_position(product_id, "session_4")
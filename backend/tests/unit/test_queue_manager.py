@@ -0,0 +1,87 @@
+"""
+佇列管理任務單元測試
+"""
+import asyncio
+import time
+import pytest
+from app.services.product_service import ProductService
+from app.services.queue_service import QueueService
+from app.services.sold_out import sold_out_registry
+from app.tasks.product_lease import product_lease_manager
+from app.tasks.queue_manager import QueueScheduler
+
+
+class TestQueueScheduler:
+    """佇列管理任務排程器測試"""
+    
+    def test_interval_backs_off_when_idle(self):
+        """測試閒置時間隔逐次加倍至上限，有處理時回到最短間隔"""
+        scheduler = QueueScheduler(min_interval_ms=50, max_interval_ms=300)
+        
+        assert [scheduler.next_interval(False) for _ in range(4)] == [0.1, 0.2, 0.3, 0.3]
+        assert scheduler.next_interval(True) == 0.05
+    
+    def test_interval_wakes_for_next_deadline(self):
+        """測試購買期限即將到期時提前醒來"""
+        scheduler = QueueScheduler(min_interval_ms=50, max_interval_ms=3000)
+        scheduler.interval = 3
+        
+        next_deadline = int(time.time() * 1000) + 500
+        
+        assert 0.4 < scheduler.next_interval(False, next_deadline) <= 0.5
+    
+    @pytest.mark.asyncio
+    async def test_tick_promotes_and_reports_backlog(self, redis_client):
+        """測試單次週期移入搖滾區並回報排隊人數"""
+        product_id = "1"
+        redis_client.zadd(ProductService.PRODUCT_REGISTRY_KEY, {product_id: 1})
+        for _ in range(QueueService.ACTIVE_QUEUE_MAX_SIZE + 3):
+            await QueueService.join_with_new_session(product_id)
+        scheduler = QueueScheduler(min_interval_ms=50, max_interval_ms=3000)
+        
+        try:
+            interval = await scheduler.tick()
+        finally:
+            await product_lease_manager.release_all()
+        
+        assert interval == 0.05
+        assert await QueueService.get_active_count(product_id) == QueueService.ACTIVE_QUEUE_MAX_SIZE
+        assert scheduler.stats["backlog"] == 3
+        assert scheduler.stats["ticks"] == 1
+    
+    @pytest.mark.asyncio
+    async def test_notify_wakes_waiting_scheduler(self, redis_client):
+        """測試發布佇列變動事件會喚醒等待中的排程器"""
+        scheduler = QueueScheduler()
+        scheduler.start()
+        await asyncio.sleep(0.2)
+        
+        try:
+            started = time.perf_counter()
+            waiter = asyncio.create_task(scheduler.wait(5))
+            await scheduler.notify("1")
+            await waiter
+            
+            assert time.perf_counter() - started < 1
+            assert scheduler.stats["wakeups"] == 1
+        finally:
+            await scheduler.stop()
+    
+    @pytest.mark.asyncio
+    async def test_tick_drains_sold_out_product(self, redis_client):
+        """測試售完的商品不再晉升，改為分批清空佇列"""
+        product_id = "1"
+        redis_client.zadd(ProductService.PRODUCT_REGISTRY_KEY, {product_id: 1})
+        for _ in range(3):
+            await QueueService.join_with_new_session(product_id)
+        sold_out_registry.mark(product_id)
+        scheduler = QueueScheduler(min_interval_ms=50, max_interval_ms=3000)
+        
+        try:
+            await scheduler.tick()
+        finally:
+            await product_lease_manager.release_all()
+        
+        assert await QueueService.get_active_count(product_id) == 0
+        assert await QueueService.get_waiting_count(product_id) == 0
+        assert scheduler.stats["backlog"] == 0
@@ -4,26 +4,29 @@
 import pytest
 import time
 from app.services.queue_service import QueueService
+from app.services.session_service import SessionService
 from app.core.redis import get_redis_client
 
 
 class TestQueueService:
     """佇列服務測試"""
     
-    def test_join_waiting_queue(self, redis_client):
+    @pytest.mark.asyncio
+    async def test_join_waiting_queue(self, redis_client):
         """測試加入排隊區"""
         product_id = "1"
         session_id = "test_session_1"
         
-        position = QueueService.join_waiting_queue(product_id, session_id)
+        position = await QueueService.join_waiting_queue(product_id, session_id)
         
         assert position == 0
         
-        waiting_key = f"queue:waiting:product:{product_id}"
+        waiting_key = QueueService._get_waiting_key(product_id)
         score = redis_client.zscore(waiting_key, session_id)
         assert score is not None
     
-    def test_queue_order(self, redis_client):
+    @pytest.mark.asyncio
+    async def test_queue_order(self, redis_client):
         """測試佇列順序"""
         product_id = "1"
         
@@ -33,38 +36,215 @@ class TestQueueService:
         time.sleep(0.001)
         session3 = "session_3"
         
-        pos1 = QueueService.join_waiting_queue(product_id, session1)
-        pos2 = QueueService.join_waiting_queue(product_id, session2)
-        pos3 = QueueService.join_waiting_queue(product_id, session3)
+        pos1 = await QueueService.join_waiting_queue(product_id, session1)
+        pos2 = await QueueService.join_waiting_queue(product_id, session2)
+        pos3 = await QueueService.join_waiting_queue(product_id, session3)
         
         assert pos1 < pos2 < pos3
     
-    def test_move_to_active(self, redis_client):
+    @pytest.mark.asyncio
+    async def test_move_to_active(self, redis_client):
         """測試從排隊區移入搖滾區"""
         product_id = "1"
         
         for i in range(5):
-            QueueService.join_waiting_queue(product_id, f"session_{i}")
+            await QueueService.join_waiting_queue(product_id, f"session_{i}")
         
-        moved = QueueService.move_to_active(product_id, count=3)
+        moved = await QueueService.move_to_active(product_id, count=3)
         
         assert moved == 3
         
-        active_count = QueueService.get_active_count(product_id)
+        active_count = await QueueService.get_active_count(product_id)
         assert active_count == 3
         
-        waiting_count = QueueService.get_waiting_count(product_id)
+        waiting_count = await QueueService.get_waiting_count(product_id)
         assert waiting_count == 2
     
-    def test_get_positions(self, redis_client):
+    @pytest.mark.asyncio
+    async def test_get_positions(self, redis_client):
         """測試查詢位置"""
         product_id = "1"
         session_id = "test_session"
         
-        QueueService.join_waiting_queue(product_id, session_id)
+        await QueueService.join_waiting_queue(product_id, session_id)
         
-        waiting_pos = QueueService.get_waiting_position(product_id, session_id)
+        waiting_pos = await QueueService.get_waiting_position(product_id, session_id)
         assert waiting_pos == 0
         
-        active_pos = QueueService.get_active_position(product_id, session_id)
+        active_pos = await QueueService.get_active_position(product_id, session_id)
         assert active_pos is None
+    
+    @pytest.mark.asyncio
+    async def test_join_with_new_session(self, redis_client):
+        """測試以單一腳本建立會話並加入排隊區"""
+        product_id = "1"
+        
+        await QueueService.join_waiting_queue(product_id, "test_session_first")
+        session_id, position = await QueueService.join_with_new_session(product_id)
+        
+        assert position == 1
+        assert redis_client.zrank(QueueService._get_waiting_key(product_id), session_id) == 1
+        
+        session_data = redis_client.hgetall(SessionService._get_session_key(session_id, product_id))
+        assert session_data["product_id"] == product_id
+        assert session_data["queue_status"] == "waiting"
+        assert session_data["queue_position_waiting"] == "1"
+        assert session_data["turnstile_verified"] == "true"
+        assert redis_client.ttl(SessionService._get_session_key(session_id, product_id)) > 0
+    
+    @pytest.mark.asyncio
+    async def test_move_to_active_respects_capacity(self, redis_client):
+        """測試移入搖滾區不會超過上限，並同步更新會話"""
+        product_id = "1"
+        max_size = QueueService.ACTIVE_QUEUE_MAX_SIZE
+        
+        session_ids = []
+        for _ in range(max_size + 5):
+            session_id, _ = await QueueService.join_with_new_session(product_id)
+            session_ids.append(session_id)
+        
+        moved = await QueueService.promote(product_id)
+        assert moved == session_ids[:max_size]
+        assert await QueueService.move_to_active(product_id) == 0
+        
+        assert await QueueService.get_active_count(product_id) == max_size
+        assert await QueueService.get_waiting_count(product_id) == 5
+        
+        session_data = redis_client.hgetall(SessionService._get_session_key(session_ids[0], product_id))
+        assert session_data["queue_status"] == "active"
+        assert session_data["queue_position_active"] == "0"
+        assert session_data["queue_position_waiting"] == ""
+    
+    @pytest.mark.asyncio
+    async def test_tickets_keep_fifo_order(self, redis_client):
+        """測試同一毫秒加入的使用者依排隊號碼維持先後順序"""
+        product_id = "1"
+        
+        session_ids = []
+        for _ in range(20):
+            session_id, _ = await QueueService.join_with_new_session(product_id)
+            session_ids.append(session_id)
+        
+        waiting_key = QueueService._get_waiting_key(product_id)
+        assert redis_client.zrange(waiting_key, 0, -1) == session_ids
+        assert redis_client.hget(SessionService._get_session_key(session_ids[3], product_id), "queue_ticket") == "3"
+    
+    @pytest.mark.asyncio
+    async def test_position_from_ticket_after_promotion(self, redis_client):
+        """測試晉升後位置等於 號碼 - head"""
+        product_id = "1"
+        
+        for i in range(6):
+            await QueueService.join_waiting_queue(product_id, f"session_{i}")
+        await QueueService.move_to_active(product_id, count=2)
+        
+        assert redis_client.get(QueueService._get_head_key(product_id)) == "2"
+        assert await QueueService.get_waiting_position(product_id, "session_5") == 3
+        assert await QueueService.join_waiting_queue(product_id, "session_5") == 3
+    
+    @pytest.mark.asyncio
+    async def test_compact_removes_abandoned_front(self, redis_client):
+        """測試壓縮移除前段已失效的號碼並推進 head"""
+        product_id = "1"
+        
+        session_ids = []
+        for _ in range(4):
+            session_id, _ = await QueueService.join_with_new_session(product_id)
+            session_ids.append(session_id)
+        redis_client.delete(SessionService._get_session_key(session_ids[0], product_id), SessionService._get_session_key(session_ids[1], product_id), SessionService._get_session_key(session_ids[3], product_id))
+        
+        removed = await QueueService.compact(product_id)
+        
+        assert removed == 2
+        assert redis_client.get(QueueService._get_head_key(product_id)) == "2"
+        assert await QueueService.get_waiting_position(product_id, session_ids[2]) == 0
+        assert await QueueService.get_waiting_count(product_id) == 2
+    
+    def test_calculate_position_scales_by_density(self):
+        """測試號碼區間內有放棄者時依實際人數比例換算位置"""
+        assert QueueService.calculate_position(ticket=10, head=4, tail=20, total_waiting=16) == 6
+        assert QueueService.calculate_position(ticket=10, head=4, tail=20, total_waiting=8) == 3
+        assert QueueService.calculate_position(ticket=3, head=4, tail=20, total_waiting=8) == 0
+    
+    @pytest.mark.asyncio
+    async def test_update_rates_tracks_throughput(self, redis_client):
+        """測試吞吐率依晉升數與搖滾區離開數以 EWMA 更新"""
+        product_id = "1"
+        rate_key = QueueService._get_rate_key(product_id)
+        
+        for i in range(8):
+            await QueueService.join_waiting_queue(product_id, f"session_{i}")
+        assert await QueueService.update_rates(product_id, 0) == (0.0, 0.0)
+        
+        # 模擬 10 秒後：搖滾區有 1 人離開、本週期晉升 4 人
+        await QueueService.move_to_active(product_id, count=4)
+        redis_client.hset(rate_key, mapping={"active": 1, "updated_at": int(time.time() * 1000) - 10000})
+        promote_rate, exit_rate = await QueueService.update_rates(product_id, 4)
+        
+        assert 0 < promote_rate < 0.4
+        assert 0 < exit_rate < 0.1
+        assert promote_rate / exit_rate == pytest.approx(4, rel=0.01)
+        
+        totals = await QueueService.get_queue_totals(product_id)
+        assert totals["promote_rate"] == pytest.approx(promote_rate)
+    
+    def test_calculate_wait_time_from_rates(self):
+        """測試有吞吐率時以吞吐率推算等待時間，否則使用固定估計值"""
+        assert QueueService.calculate_wait_time(9, -1, promote_rate=2.0) == 5
+        assert QueueService.calculate_wait_time(-1, 3, exit_rate=0.5) == 6
+        assert QueueService.calculate_wait_time(9, -1) == QueueService.ACTIVE_QUEUE_MAX_SIZE * 30
+    
+    @pytest.mark.asyncio
+    async def test_promote_records_purchase_deadline(self, redis_client):
+        """測試晉升時寫入購買期限索引與會話的 purchase_timeout_at"""
+        product_id = "1"
+        session_id, _ = await QueueService.join_with_new_session(product_id)
+        
+        await QueueService.promote(product_id)
+        
+        deadline = redis_client.zscore(QueueService._get_deadline_key(product_id), session_id)
+        entered_at = redis_client.zscore(QueueService._get_active_key(product_id), session_id)
+        assert deadline == entered_at + QueueService.PURCHASE_TIMEOUT_MS
+        assert redis_client.hget(SessionService._get_session_key(session_id, product_id), "purchase_timeout_at") == str(int(deadline))
+    
+    @pytest.mark.asyncio
+    async def test_expire_active_removes_only_overdue(self, redis_client):
+        """測試只移除超過購買期限的使用者，並刪除購買鎖、標記會話逾時"""
+        product_id = "1"
+        session_ids = []
+        for _ in range(3):
+            session_id, _ = await QueueService.join_with_new_session(product_id)
+            session_ids.append(session_id)
+        await QueueService.promote(product_id)
+        
+        deadline_key = QueueService._get_deadline_key(product_id)
+        redis_client.zadd(deadline_key, {session_ids[0]: 1, session_ids[1]: 2})
+        redis_client.set(QueueService._get_lock_key(product_id, session_ids[0]), "1")
+        
+        expired, next_deadline = await QueueService.expire_active(product_id)
+        
+        assert expired == session_ids[:2]
+        assert next_deadline == redis_client.zscore(deadline_key, session_ids[2])
+        assert redis_client.zrange(QueueService._get_active_key(product_id), 0, -1) == session_ids[2:]
+        assert redis_client.zcard(deadline_key) == 1
+        assert redis_client.exists(QueueService._get_lock_key(product_id, session_ids[0])) == 0
+        assert redis_client.hget(SessionService._get_session_key(session_ids[0], product_id), "queue_status") == "expired"
+        assert redis_client.hget(SessionService._get_session_key(session_ids[2], product_id), "queue_status") == "active"
+    
+    @pytest.mark.asyncio
+    async def test_drain_empties_queue_in_batches(self, redis_client):
+        """測試售完後分批清空排隊區與搖滾區，會話標記為 sold_out 並縮短 TTL"""
+        product_id = "1"
+        session_ids = []
+        for _ in range(5):
+            session_id, _ = await QueueService.join_with_new_session(product_id)
+            session_ids.append(session_id)
+        await QueueService.promote(product_id, 2)
+        
+        assert await QueueService.drain(product_id, limit=4) == (4, 1)
+        assert await QueueService.drain(product_id, limit=4) == (1, 0)
+        
+        assert redis_client.zcard(QueueService._get_deadline_key(product_id)) == 0
+        session_key = SessionService._get_session_key(session_ids[0], product_id)
+        assert redis_client.hget(session_key, "queue_status") == "sold_out"
+        assert redis_client.ttl(session_key) <= QueueService.SOLD_OUT_SESSION_TTL_SECONDS
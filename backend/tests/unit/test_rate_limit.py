@@ -0,0 +1,92 @@
+"""
+速率限制單元測試
+"""
+import pytest
+from fastapi import HTTPException
+from app.middleware.rate_limit import LocalTokenBucket, RateLimiter
+
+
+class TestRateLimiter:
+    """速率限制測試"""
+    
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("algorithm", ["sliding_window", "fixed_window", "gcra"])
+    async def test_burst_within_same_second(self, redis_client, algorithm):
+        """測試同一秒內的連續請求各自計數"""
+        limiter = RateLimiter(max_requests=3, window_seconds=60, algorithm=algorithm)
+        
+        results = [await limiter.hit("10.0.0.1", "test") for _ in range(4)]
+        
+        assert [allowed for allowed, _, _ in results] == [True, True, True, False]
+        assert [remaining for _, remaining, _ in results[:3]] == [2, 1, 0]
+        assert 0 < results[3][2] <= 60000
+    
+    @pytest.mark.asyncio
+    async def test_limits_are_per_ip(self, redis_client):
+        """測試不同 IP 分別計數"""
+        limiter = RateLimiter(max_requests=1, window_seconds=60)
+        
+        assert (await limiter.hit("10.0.0.1", "test"))[0] is True
+        assert (await limiter.hit("10.0.0.2", "test"))[0] is True
+        assert (await limiter.hit("10.0.0.1", "test"))[0] is False
+    
+    @pytest.mark.asyncio
+    async def test_check_rate_limit_raises_with_retry_after(self, redis_client):
+        """測試超過限制時回傳 429 與 Retry-After"""
+        limiter = RateLimiter(max_requests=1, window_seconds=60)
+        request = type("FakeRequest", (), {"headers": {"X-Real-IP": "10.0.0.3"}, "client": None})()
+        
+        assert await limiter.check_rate_limit(request, "test") is True
+        with pytest.raises(HTTPException) as exc_info:
+            await limiter.check_rate_limit(request, "test")
+        
+        assert exc_info.value.status_code == 429
+        assert int(exc_info.value.headers["Retry-After"]) >= 1
+    
+    def test_unknown_algorithm(self):
+        """測試不支援的演算法"""
+        with pytest.raises(ValueError):
+            RateLimiter(algorithm="leaky")
+    
+    @pytest.mark.asyncio
+    async def test_local_bucket_rejects_without_redis(self, redis_client):
+        """測試本地 token bucket 用盡後不再查詢 Redis"""
+        limiter = RateLimiter(
+            max_requests=100,
+            window_seconds=60,
+            local_bucket=LocalTokenBucket(capacity=2, refill_per_second=0.01)
+        )
+        request = type("FakeRequest", (), {"headers": {"X-Real-IP": "10.0.0.4"}, "client": None})()
+        
+        assert await limiter.check_rate_limit(request, "test") is True
+        assert await limiter.check_rate_limit(request, "test") is True
+        with pytest.raises(HTTPException):
+            await limiter.check_rate_limit(request, "test")
+        
+        assert limiter.stats == {"local_rejected": 1, "remote_allowed": 2, "remote_rejected": 0}
+        assert redis_client.zcard("rate_limit:10.0.0.4:test") == 2
+    
+    @pytest.mark.asyncio
+    async def test_remote_rejection_blocks_locally(self, redis_client):
+        """測試 Redis 判定超限後，在 retry-after 期間由本地直接拒絕"""
+        limiter = RateLimiter(
+            max_requests=1,
+            window_seconds=60,
+            local_bucket=LocalTokenBucket(capacity=100, refill_per_second=100)
+        )
+        request = type("FakeRequest", (), {"headers": {"X-Real-IP": "10.0.0.5"}, "client": None})()
+        
+        await limiter.check_rate_limit(request, "test")
+        for _ in range(3):
+            with pytest.raises(HTTPException):
+                await limiter.check_rate_limit(request, "test")
+        
+        assert limiter.stats["remote_rejected"] == 1
+        assert limiter.stats["local_rejected"] == 2
+    
+    def test_local_bucket_lru_bound(self):
+        """測試本地 bucket 追蹤的 IP 數有上限"""
+        bucket = LocalTokenBucket(capacity=1, refill_per_second=1, max_entries=3)
+        for i in range(10):
+            bucket.consume(f"10.0.1.{i}")
+        assert len(bucket) == 3
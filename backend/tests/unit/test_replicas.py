@@ -0,0 +1,67 @@
+"""
+唯讀複本路由單元測試
+"""
+import time
+import pytest
+import pytest_asyncio
+import redis
+from app.core.redis import get_async_redis_client, get_redis_client, get_redis_url
+from app.core.replicas import ReplicaRouter
+
+
+@pytest.fixture
+def replica_db(monkeypatch):
+    """以同一個 Redis 的 db 1 模擬複本（心跳由測試寫入，代表複本同步到的時間點）"""
+    replica_url = f"{get_redis_url()}/1"
+    monkeypatch.setenv("REDIS_REPLICA_URLS", replica_url)
+    client = redis.Redis.from_url(replica_url, decode_responses=True)
+    yield client
+    client.flushdb()
+    client.close()
+
+
+@pytest_asyncio.fixture
+async def router(replica_db):
+    """複本路由"""
+    replica_router = ReplicaRouter(max_staleness_ms=1000)
+    yield replica_router
+    await replica_router.stop()
+    get_redis_client().delete(ReplicaRouter.HEARTBEAT_KEY)
+
+
+class TestReplicaRouter:
+    """唯讀複本路由測試"""
+    
+    @pytest.mark.asyncio
+    async def test_reads_from_fresh_replica(self, router, replica_db):
+        """測試複製延遲在上限內時讀取分送到複本"""
+        replica_db.set(ReplicaRouter.HEARTBEAT_KEY, int(time.time() * 1000))
+        
+        assert await router.check() == [0]
+        
+        client = router.get_client()
+        assert client is not get_async_redis_client()
+        assert await client.get(ReplicaRouter.HEARTBEAT_KEY) is not None
+        assert router.stats["replica_reads"] == 1
+    
+    @pytest.mark.asyncio
+    async def test_falls_back_to_primary_when_stale(self, router, replica_db):
+        """測試複本延遲超過上限時改讀主節點"""
+        replica_db.set(ReplicaRouter.HEARTBEAT_KEY, int(time.time() * 1000))
+        await router.check()
+        
+        replica_db.set(ReplicaRouter.HEARTBEAT_KEY, int(time.time() * 1000) - 5000)
+        
+        assert await router.check() == []
+        assert router.get_client() is get_async_redis_client()
+        assert router.staleness_ms[0] >= 5000
+        assert router.stats["stale"] == 1
+    
+    @pytest.mark.asyncio
+    async def test_primary_without_replicas(self, monkeypatch):
+        """測試未設定複本時一律讀主節點"""
+        monkeypatch.delenv("REDIS_REPLICA_URLS", raising=False)
+        replica_router = ReplicaRouter()
+        
+        assert replica_router.start() is None
+        assert replica_router.get_client() is get_async_redis_client()
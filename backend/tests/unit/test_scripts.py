@@ -0,0 +1,78 @@
+"""
+Lua 腳本註冊單元測試
+"""
+import pytest
+from redis.crc import key_slot
+from app.core.scripts import register_scripts, run_script, run_script_many, get_script_stats
+from app.services.inventory_service import InventoryService
+from app.services.queue_service import QueueService
+from app.services.session_service import SessionService
+
+
+class TestScriptRegistry:
+    """Lua 腳本註冊測試"""
+    
+    @pytest.mark.asyncio
+    async def test_run_registered_script(self, redis_client):
+        """測試以 EVALSHA 執行已註冊的腳本"""
+        redis_client.set("product:stock:{1:0}", 5)
+        await register_scripts()
+        calls_before = get_script_stats()["reserve_stock"]["calls"]
+        
+        result = await run_script("reserve_stock", keys=["product:stock:{1:0}"], args=[1])
+        
+        assert result == [1, 4]
+        assert redis_client.get("product:stock:{1:0}") == "4"
+        assert get_script_stats()["reserve_stock"]["calls"] == calls_before + 1
+    
+    @pytest.mark.asyncio
+    async def test_reload_after_script_flush(self, redis_client):
+        """測試 Redis 遺失腳本（NOSCRIPT）時自動重新載入"""
+        redis_client.set("product:stock:{1:0}", 5)
+        await register_scripts()
+        redis_client.script_flush()
+        reloads_before = get_script_stats()["reserve_stock"]["reloads"]
+        
+        result = await run_script("reserve_stock", keys=["product:stock:{1:0}"], args=[1])
+        
+        assert result == [1, 4]
+        assert get_script_stats()["reserve_stock"]["reloads"] == reloads_before + 1
+    
+    @pytest.mark.asyncio
+    async def test_run_script_many_in_one_pipeline(self, redis_client):
+        """測試以一個 pipeline 多次執行腳本，NOSCRIPT 時重新載入並重送"""
+        redis_client.set("product:stock:{1:0}", 5)
+        redis_client.set("product:stock:{1:1}", 1)
+        await register_scripts()
+        redis_client.script_flush()
+        reloads_before = get_script_stats()["reserve_stock"]["reloads"]
+        
+        results = await run_script_many(
+            "reserve_stock",
+            [(["product:stock:{1:0}"], [2]), (["product:stock:{1:1}"], [2]), (["product:stock:{1:2}"], [2])]
+        )
+        
+        assert results == [[2, 3], [1, 0], [0, -1]]
+        assert get_script_stats()["reserve_stock"]["reloads"] == reloads_before + 1
+    
+    @pytest.mark.asyncio
+    async def test_unknown_script(self):
+        """測試執行不存在的腳本"""
+        with pytest.raises(KeyError):
+            await run_script("not_a_script", keys=[], args=[])
+    
+    def test_product_keys_share_slot(self):
+        """測試同一商品的佇列、庫存、購買紀錄與會話 key 落在同一個 Cluster slot"""
+        keys = [
+            QueueService._get_waiting_key("1"),
+            QueueService._get_active_key("1"),
+            QueueService._get_deadline_key("1"),
+            QueueService._get_lock_key("1", "test_session"),
+            InventoryService._get_stock_key("1"),
+            InventoryService._get_purchases_key("1"),
+            InventoryService._get_reservations_key("1"),
+            SessionService._get_session_key("test_session", "1")
+        ]
+        
+        assert len({key_slot(key.encode()) for key in keys}) == 1
+        assert key_slot(QueueService._get_waiting_key("1").encode()) != key_slot(QueueService._get_waiting_key("2").encode())
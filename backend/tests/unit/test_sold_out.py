@@ -0,0 +1,68 @@
+"""
+售完狀態單元測試
+"""
+import asyncio
+import pytest
+from app.services.inventory_service import InventoryService
+from app.services.product_service import ProductService
+from app.services.purchase_service import PurchaseService
+from app.services.queue_service import QueueService
+from app.services.sold_out import SoldOutRegistry
+
+
+async def _wait_until(condition, timeout: float = 2):
+    """等待條件成立（訂閱通知為非同步送達）"""
+    for _ in range(int(timeout / 0.02)):
+        if condition():
+            return True
+        await asyncio.sleep(0.02)
+    return condition()
+
+
+class TestSoldOutRegistry:
+    """售完狀態測試"""
+    
+    @pytest.mark.asyncio
+    async def test_sync_reads_flags(self, redis_client):
+        """測試從 Redis 同步所有商品的售完旗標"""
+        await ProductService.initialize_products()
+        redis_client.set(InventoryService._get_sold_out_key("1"), 1)
+        registry = SoldOutRegistry()
+        
+        await registry.sync()
+        
+        assert registry.is_sold_out("1")
+        assert registry.get_sold_out() == ["1"]
+    
+    @pytest.mark.asyncio
+    async def test_purchase_broadcast_and_reset(self, redis_client):
+        """測試賣出最後一件時所有副本收到售完通知，重設庫存後清除"""
+        await ProductService.initialize_products()
+        redis_client.set(InventoryService._get_stock_key("1"), 1)
+        session_id, _ = await QueueService.join_with_new_session("1")
+        await QueueService.move_to_active("1")
+        registry = SoldOutRegistry()
+        registry.start()
+        await asyncio.sleep(0.2)
+        
+        try:
+            await PurchaseService.purchase("1", session_id, 1)
+            assert await _wait_until(lambda: registry.is_sold_out("1"))
+            
+            await ProductService.reset_stock()
+            assert await _wait_until(lambda: not registry.is_sold_out("1"))
+            assert not redis_client.exists(InventoryService._get_sold_out_key("1"))
+        finally:
+            await registry.stop()
+    
+    @pytest.mark.asyncio
+    async def test_sharded_sell_out_sets_flag(self, redis_client, monkeypatch):
+        """測試庫存分片時加總庫存歸零後設定售完旗標"""
+        monkeypatch.setenv("INVENTORY_SHARDS", "2")
+        for stock_key, stock in InventoryService.get_stock_values("1", 1).items():
+            redis_client.set(stock_key, stock)
+        session_id, _ = await QueueService.join_with_new_session("1")
+        await QueueService.move_to_active("1")
+        
+        assert await PurchaseService.purchase("1", session_id, 1) == (True, None, 0)
+        assert redis_client.exists(InventoryService._get_sold_out_key("1"))
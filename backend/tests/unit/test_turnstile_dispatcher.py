@@ -0,0 +1,98 @@
+"""
+Turnstile 驗證調度器單元測試
+"""
+import asyncio
+import pytest
+import pytest_asyncio
+from app.services.turnstile_dispatcher import TurnstileDispatcher, DUPLICATE_ERROR, OVERLOADED_ERROR
+from app.services.turnstile_service import TurnstileService
+
+
+@pytest_asyncio.fixture
+async def gated_verifier():
+    """在 gate 開啟前阻塞的驗證器，用來模擬 siteverify 積壓"""
+    gate = asyncio.Event()
+    calls = []
+    
+    async def verifier(token, remote_ip=None):
+        calls.append(token)
+        await gate.wait()
+        return await TurnstileService.stub_verify(token, remote_ip)
+    
+    TurnstileService.set_verifier(verifier)
+    yield gate, calls
+    TurnstileService.set_verifier(None)
+    await TurnstileService.close()
+
+
+class TestTurnstileDispatcher:
+    """Turnstile 驗證調度器測試"""
+    
+    @pytest.mark.asyncio
+    async def test_identical_tokens_are_verified_once(self, gated_verifier):
+        """測試相同 token 的並行請求共用同一次驗證，且只有第一個請求取得成功"""
+        gate, calls = gated_verifier
+        dispatcher = TurnstileDispatcher(workers=2, max_in_flight=4, max_backlog=100)
+        
+        waiters = [asyncio.create_task(dispatcher.verify("token-a", "10.0.0.1")) for _ in range(5)]
+        waiters.append(asyncio.create_task(dispatcher.verify("fail-b", "10.0.0.1")))
+        await asyncio.sleep(0.01)
+        gate.set()
+        results = await asyncio.gather(*waiters)
+        
+        assert results[0] == (True, None)
+        assert results[1:5] == [(False, DUPLICATE_ERROR)] * 4
+        assert results[5] == (False, "invalid-input-response")
+        assert sorted(calls) == ["fail-b", "token-a"]
+        assert dispatcher.stats["coalesced"] == 4
+        assert dispatcher.stats["duplicates"] == 4
+        
+        await dispatcher.stop()
+    
+    @pytest.mark.asyncio
+    async def test_coalesced_failures_are_shared(self, gated_verifier):
+        """測試相同 token 驗證失敗時所有請求取得同一個失敗結果"""
+        gate, calls = gated_verifier
+        dispatcher = TurnstileDispatcher(workers=1, max_in_flight=1, max_backlog=100)
+        
+        waiters = [asyncio.create_task(dispatcher.verify("fail-a")) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        gate.set()
+        
+        assert await asyncio.gather(*waiters) == [(False, "invalid-input-response")] * 3
+        assert calls == ["fail-a"]
+        await dispatcher.stop()
+    
+    @pytest.mark.asyncio
+    async def test_in_flight_limit(self, gated_verifier):
+        """測試同時進行的驗證數不超過上限"""
+        gate, calls = gated_verifier
+        dispatcher = TurnstileDispatcher(workers=2, max_in_flight=3, max_backlog=100)
+        
+        waiters = [asyncio.create_task(dispatcher.verify(f"token-{i}")) for i in range(10)]
+        await asyncio.sleep(0.01)
+        
+        assert len(calls) == 3
+        
+        gate.set()
+        assert await asyncio.gather(*waiters) == [(True, None)] * 10
+        await dispatcher.stop()
+    
+    @pytest.mark.asyncio
+    async def test_rejects_when_backlog_exceeds_threshold(self, gated_verifier):
+        """測試待驗證數超過門檻時立即拒絕"""
+        gate, _ = gated_verifier
+        dispatcher = TurnstileDispatcher(workers=1, max_in_flight=1, max_backlog=2)
+        
+        waiters = [asyncio.create_task(dispatcher.verify("token-0"))]
+        await asyncio.sleep(0.01)
+        waiters += [asyncio.create_task(dispatcher.verify(f"token-{i}")) for i in range(1, 3)]
+        await asyncio.sleep(0.01)
+        
+        assert dispatcher.get_backlog() == 2
+        assert await dispatcher.verify("token-overflow") == (False, OVERLOADED_ERROR)
+        assert dispatcher.get_retry_after() >= 1
+        
+        gate.set()
+        assert await asyncio.gather(*waiters) == [(True, None)] * 3
+        await dispatcher.stop()
@@ -0,0 +1,76 @@
+"""
+Turnstile 驗證服務單元測試
+"""
+import pytest
+import pytest_asyncio
+from app.services.turnstile_service import TurnstileService
+
+
+@pytest_asyncio.fixture
+async def counting_verifier():
+    """記錄呼叫次數的驗證器"""
+    calls = []
+    
+    async def verifier(token, remote_ip=None):
+        calls.append((token, remote_ip))
+        if token == "timeout":
+            return (False, "TIMEOUT")
+        return await TurnstileService.stub_verify(token, remote_ip)
+    
+    TurnstileService.set_verifier(verifier)
+    yield calls
+    TurnstileService.set_verifier(None)
+    await TurnstileService.close()
+
+
+class TestTurnstileService:
+    """Turnstile 驗證服務測試"""
+    
+    @pytest.mark.asyncio
+    async def test_missing_token(self, counting_verifier):
+        """測試未提供 token 時不呼叫驗證器"""
+        assert await TurnstileService.verify_token("") == (False, "MISSING_TOKEN")
+        assert counting_verifier == []
+    
+    @pytest.mark.asyncio
+    async def test_duplicate_failure_uses_cached_verdict(self, counting_verifier):
+        """測試同一 token 與 IP 重複送出時使用快取的失敗結果"""
+        assert await TurnstileService.verify_token("fail-b", "10.0.0.1") == (False, "invalid-input-response")
+        assert await TurnstileService.verify_token("fail-b", "10.0.0.1") == (False, "invalid-input-response")
+        
+        assert counting_verifier == [("fail-b", "10.0.0.1")]
+    
+    @pytest.mark.asyncio
+    async def test_success_is_not_cached(self, counting_verifier):
+        """測試驗證成功不快取，重複送出同一 token 時交由驗證器判定"""
+        assert await TurnstileService.verify_token("token-a", "10.0.0.1") == (True, None)
+        await TurnstileService.verify_token("token-a", "10.0.0.1")
+        
+        assert counting_verifier == [("token-a", "10.0.0.1")] * 2
+        assert TurnstileService.get_stats()["cached_verdicts"] == 0
+    
+    @pytest.mark.asyncio
+    async def test_cache_is_per_ip(self, counting_verifier):
+        """測試同一 token 由其他 IP 送出時重新驗證"""
+        await TurnstileService.verify_token("fail-a", "10.0.0.1")
+        await TurnstileService.verify_token("fail-a", "10.0.0.2")
+        
+        assert len(counting_verifier) == 2
+    
+    @pytest.mark.asyncio
+    async def test_transient_errors_are_not_cached(self, counting_verifier):
+        """測試逾時等暫時性錯誤不快取"""
+        assert await TurnstileService.verify_token("timeout") == (False, "TIMEOUT")
+        assert await TurnstileService.verify_token("timeout") == (False, "TIMEOUT")
+        
+        assert len(counting_verifier) == 2
+    
+    @pytest.mark.asyncio
+    async def test_stub_verifier_selected_by_env(self, monkeypatch):
+        """測試 TURNSTILE_VERIFIER=stub 時使用本地驗證器"""
+        monkeypatch.setenv("TURNSTILE_VERIFIER", "stub")
+        
+        assert TurnstileService.get_verifier() == TurnstileService.stub_verify
+        assert await TurnstileService.verify_token("any-token") == (True, None)
+        
+        await TurnstileService.close()